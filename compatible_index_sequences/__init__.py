@@ -0,0 +1,2 @@
+default_app_config = (
+    'compatible_index_sequences.apps.CompatibleIndexSequencesConfig')
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Index, IndexSet
+from .models import Index, IndexSet, SearchJob
 
 
 class IndexInline(admin.TabularInline):
@@ -18,8 +18,25 @@ class IndexAdmin(admin.ModelAdmin):
 
 @admin.register(IndexSet)
 class IndexSetAdmin(admin.ModelAdmin):
-    fields = ['name', 'description', 'url', 'index_type', 'visible_in_interactive']
+    fields = [
+        'name', 'description', 'url', 'index_type', 'visible_in_interactive',
+        'index_count', 'min_index_length', 'max_index_length']
     inlines = [IndexInline]
-    list_display = ['name', 'index_type', 'visible_in_interactive', 'url']
+    list_display = [
+        'name', 'index_type', 'index_count', 'min_index_length',
+        'max_index_length', 'visible_in_interactive', 'url']
+    readonly_fields = ['index_count', 'min_index_length', 'max_index_length']
     list_filter = ['index_type', 'visible_in_interactive']
     search_fields = ['name', 'description']
+
+
+@admin.register(SearchJob)
+class SearchJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'status', 'created', 'finished', 'nodes_explored', 'timed_out',
+        'incomplete']
+    list_filter = ['status', 'timed_out', 'incomplete']
+    readonly_fields = [
+        'status', 'parameters', 'result', 'best_partial', 'target_size',
+        'nodes_explored', 'timed_out', 'incomplete', 'missing', 'error',
+        'created', 'started', 'finished', 'estimated_finish']
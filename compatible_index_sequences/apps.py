@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CompatibleIndexSequencesConfig(AppConfig):
     name = 'compatible_index_sequences'
     verbose_name = 'Compatible Index Sequences'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,375 @@
+import re
+import time
+
+import numpy as np
+from django.conf import settings
+from django.urls import reverse
+
+from .jobs import create_search_job
+from .metrics import PhaseTimer
+from .models import IndexSet
+from .search import SEARCH_PROCESSES, find_compatible_subset
+from .utils import (
+    DUAL_INDEX_RULE_CHOICES, dual_index_incompatibility,
+    hamming_distance_matrix, minimum_index_length_from_lists,
+    minimum_index_length_from_sets, optimize_set_order)
+
+
+# Largest number of pools accepted in one batch
+BATCH_MAX_POOLS = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_BATCH_MAX_POOLS', 1000)
+
+# Longest time (in seconds) allowed for each pool's auto-mode search
+BATCH_MAX_TIMEOUT = 60
+
+# Longest total time (in seconds) spent on auto-mode searches within one
+# batch request; pools left over are not searched
+BATCH_SEARCH_TIME = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_BATCH_SEARCH_TIME', 60)
+
+# Pools compared at the same length share one distance matrix over all of
+# their distinct sequences, unless there are more sequences than this
+SHARED_MATRIX_MAX_SIZE = 4096
+
+DUAL_INDEX_RULES = [rule for rule, _ in DUAL_INDEX_RULE_CHOICES]
+
+
+class BatchError(ValueError):
+    pass
+
+
+class SharedDistances(object):
+    """
+    Distances between the sequences of many pools, computed once for every
+    distinct sequence compared at the same length.
+    """
+
+    def __init__(self, requests):
+        self.matrices = {}
+        sequences_by_length = {}
+        for sequences, length in requests:
+            sequences_by_length.setdefault(length, set()).update(sequences)
+        for length, sequences in sequences_by_length.items():
+            if len(sequences) <= SHARED_MATRIX_MAX_SIZE:
+                sequences = sorted(sequences)
+                positions = {s: i for i, s in enumerate(sequences)}
+                self.matrices[length] = (positions, hamming_distance_matrix(
+                    sequences, length=length))
+
+    def distances(self, sequences, length):
+        if length not in self.matrices:
+            return hamming_distance_matrix(sequences, length=length)
+        positions, matrix = self.matrices[length]
+        rows = [positions[s] for s in sequences]
+        return matrix[np.ix_(rows, rows)]
+
+
+def check_pools(data, timer=None, background=False):
+    """
+    Check a batch of pools for compatibility and suggest compatible subsets
+    from index sets. ``data`` is the decoded JSON request; the decoded JSON
+    response is returned.
+
+    Subsets are searched for within ``BATCH_SEARCH_TIME`` seconds in all,
+    or, if ``background``, queued as search jobs for the search workers.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('pools'), list):
+        raise BatchError('Expected an object with a list of pools.')
+    if len(data['pools']) > BATCH_MAX_POOLS:
+        raise BatchError(
+            'At most {} pools can be checked at once.'.format(BATCH_MAX_POOLS))
+
+    defaults = {
+        key: data[key] for key in
+        ['distance', 'distance_2', 'length', 'length_2', 'rule']
+        if key in data}
+
+    if timer is None:
+        timer = PhaseTimer('batch')
+
+    with timer.phase('parse'):
+        pools = []
+        for number, pool in enumerate(data['pools']):
+            try:
+                pools.append(normalize_pool(number, pool, defaults))
+            except BatchError as e:
+                pools.append({'id': pool_id(number, pool), 'error': str(e)})
+
+    with timer.phase('distance'):
+        requests = []
+        for pool in pools:
+            if 'error' not in pool:
+                requests.append((pool['indexes'], pool['length']))
+                if pool['dual_indexed']:
+                    requests.append((pool['indexes_2'], pool['length_2']))
+        shared_distances = SharedDistances(requests)
+
+        results = [
+            pool if 'error' in pool else check_pool(pool, shared_distances)
+            for pool in pools]
+
+    deadline = time.time() + BATCH_SEARCH_TIME
+    for pool, result in zip(pools, results):
+        if 'error' in pool or pool['auto'] is None:
+            continue
+        if not result['compatible']:
+            result['suggested'] = {
+                'error': 'The pool is not compatible with itself.'}
+        elif background:
+            result['suggested'] = queue_subset_search(pool)
+        elif time.time() < deadline:
+            result['suggested'] = suggest_subset(
+                pool, timer=timer, deadline=deadline)
+        else:
+            result['suggested'] = {
+                'error': 'The batch ran out of time to search for subsets.'}
+    return {'pools': results}
+
+
+def check_pool(pool, shared_distances):
+    indexes = pool['indexes']
+    distances = shared_distances.distances(indexes, pool['length'])
+    upper = np.triu(np.ones(distances.shape, dtype=bool), k=1)
+
+    result = {
+        'id': pool['id'],
+        'dual_indexed': pool['dual_indexed'],
+        'length': pool['length'],
+    }
+
+    if pool['dual_indexed']:
+        distances_2 = shared_distances.distances(
+            pool['indexes_2'], pool['length_2'])
+        incompatible = dual_index_incompatibility(
+            distances, distances_2, pool['distance'], pool['distance_2'],
+            pool['rule'])
+        result.update({
+            'length_2': pool['length_2'],
+            'minimum_distance': minimum_distance(distances, upper),
+            'minimum_distance_2': minimum_distance(distances_2, upper),
+        })
+    else:
+        incompatible = distances < pool['distance']
+        result['minimum_distance'] = minimum_distance(distances, upper)
+
+    pairs = []
+    for i, j in zip(*np.nonzero(incompatible & upper)):
+        pair = {
+            'positions': [int(i), int(j)],
+            'indexes': [indexes[i], indexes[j]],
+            'distance': int(distances[i, j]),
+        }
+        if pool['dual_indexed']:
+            pair['indexes_2'] = [pool['indexes_2'][i], pool['indexes_2'][j]]
+            pair['distance_2'] = int(distances_2[i, j])
+        pairs.append(pair)
+
+    result['compatible'] = len(pairs) == 0
+    result['incompatible_pairs'] = pairs
+    return result
+
+
+def minimum_distance(distances, upper):
+    if not upper.any():
+        return None
+    return int(distances[upper].min())
+
+
+def normalize_indexes(indexes):
+    if not isinstance(indexes, list):
+        raise BatchError('Expected a list of indexes.')
+
+    indexes_1 = []
+    indexes_2 = []
+    for index in indexes:
+        if isinstance(index, str):
+            index = index.split(',')
+        if not isinstance(index, list) or not 1 <= len(index) <= 2:
+            raise BatchError(
+                'Indexes must be sequences or pairs of sequences.')
+        sequences = []
+        for sequence in index:
+            sequence = str(sequence).replace(' ', '').upper()
+            if not re.match('^[ACGT]+$', sequence):
+                raise BatchError('Not a valid DNA sequence: {}'.format(sequence))
+            sequences.append(sequence)
+        indexes_1.append(sequences[0])
+        indexes_2.append(sequences[1] if len(sequences) > 1 else None)
+
+    dual_indexed = any(index is not None for index in indexes_2)
+    if dual_indexed and not all(index is not None for index in indexes_2):
+        raise BatchError('Indexes are a mix of single-indexing and dual-indexing.')
+    return indexes_1, indexes_2 if dual_indexed else None
+
+
+def normalize_pool(number, pool, defaults):
+    if not isinstance(pool, dict):
+        raise BatchError('Expected an object.')
+
+    indexes, indexes_2 = normalize_indexes(pool.get('indexes', []))
+    parameters = dict(defaults, **pool)
+
+    distance = parameter_int(parameters, 'distance', 3)
+    normalized = {
+        'id': pool_id(number, pool),
+        'indexes': indexes,
+        'dual_indexed': indexes_2 is not None,
+        'distance': distance,
+        'length': pool_length(indexes, parameters.get('length')),
+        'auto': None,
+    }
+
+    if indexes_2 is not None:
+        length_2 = pool_length(
+            indexes_2, parameters.get('length_2'), 'length_2')
+        rule = parameters.get('rule', 'both')
+        if rule not in DUAL_INDEX_RULES:
+            raise BatchError('Unknown dual-index rule: {}'.format(rule))
+        normalized.update({
+            'indexes_2': indexes_2,
+            'distance_2': parameter_int(parameters, 'distance_2', distance),
+            'length_2': length_2,
+            'rule': rule,
+        })
+
+    if pool.get('auto') is not None:
+        if indexes_2 is not None:
+            raise BatchError(
+                'Subsets can only be suggested for single-indexed pools.')
+        normalized['auto'] = normalize_auto(pool['auto'])
+        # Like auto mode, compare at the shortest index of the pool and sets
+        if parameters.get('length') is None:
+            normalized['length'] = int(min(
+                minimum_index_length_from_lists(indexes),
+                minimum_index_length_from_sets(
+                    normalized['auto']['index_sets'])))
+
+    return normalized
+
+
+def normalize_auto(auto):
+    if not isinstance(auto, dict) or not isinstance(auto.get('index_sets'), list):
+        raise BatchError('Expected auto to have a list of index_sets.')
+
+    maximize = auto.get('maximize', False)
+    if not isinstance(maximize, bool):
+        raise BatchError('maximize must be true or false.')
+
+    index_sets = []
+    subset_sizes = []
+    for requested in auto['index_sets']:
+        if not isinstance(requested, dict):
+            raise BatchError('Expected index set objects.')
+        name = requested.get('index_set')
+        try:
+            if isinstance(name, int):
+                index_set = IndexSet.objects.get(pk=name)
+            else:
+                index_set = IndexSet.objects.get_by_natural_key(name)
+        except IndexSet.DoesNotExist:
+            raise BatchError('Unknown index set: {}'.format(name))
+        size = parameter_int(requested, 'size', None, minimum=1)
+        # Searches for the largest subset do not need sizes
+        if size is None and maximize:
+            size = index_set.index_count
+        if size is None or not 0 < size <= index_set.index_count:
+            raise BatchError(
+                'Invalid number of indexes to use from {}.'.format(index_set))
+        index_sets.append(index_set)
+        subset_sizes.append(size)
+
+    timeout = parameter_int(auto, 'timeout', 10)
+    return {
+        'index_sets': index_sets,
+        'subset_sizes': subset_sizes,
+        'maximize': maximize,
+        'timeout': min(max(timeout, 1), BATCH_MAX_TIMEOUT),
+    }
+
+
+def parameter_int(parameters, name, default, minimum=0):
+    value = parameters.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise BatchError('{} must be an integer of at least {}.'.format(
+            name, minimum))
+    return value
+
+
+def pool_length(indexes, length, name='length'):
+    """
+    Return the length indexes are compared at: the requested length, if
+    any, but no longer than the shortest index.
+    """
+    shortest = minimum_index_length_from_lists(indexes)
+    if length is not None:
+        parameter_int({name: length}, name, None, minimum=1)
+        shortest = min(shortest, length)
+    return 0 if shortest == float('inf') else int(shortest)
+
+
+def pool_id(number, pool):
+    if isinstance(pool, dict) and 'id' in pool:
+        return pool['id']
+    return number
+
+
+def ordered_index_sets(auto):
+    order = optimize_set_order(*auto['index_sets'])
+    return ([auto['index_sets'][o] for o in order],
+            [auto['subset_sizes'][o] for o in order])
+
+
+def queue_subset_search(pool):
+    auto = pool['auto']
+    index_sets, subset_sizes = ordered_index_sets(auto)
+    initial = {
+        'config_distance': pool['distance'],
+        'index_list': '\n'.join(pool['indexes']),
+        'maximize': auto['maximize'],
+        'extend_search_time': auto['timeout'] > 10,
+    }
+    for number, (index_set, size) in enumerate(
+            zip(index_sets, subset_sizes), 1):
+        initial['index_set_{}'.format(number)] = index_set.pk
+        initial['subset_size_{}'.format(number)] = size
+
+    job = create_search_job(
+        index_sets, subset_sizes, pool['length'], pool['distance'],
+        pool['indexes'], auto['timeout'], {}, initial,
+        maximize=auto['maximize'])
+    return {
+        'job': str(job.pk),
+        'status': reverse(
+            'compatible_index_sequences:auto_job_status', args=[job.pk]),
+    }
+
+
+def suggest_subset(pool, timer=None, deadline=None):
+    auto = pool['auto']
+    index_sets, subset_sizes = ordered_index_sets(auto)
+    timeout = auto['timeout']
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.time())
+
+    compatible_subset = find_compatible_subset(
+        index_sets, subset_sizes, min_length=pool['length'],
+        min_distance=pool['distance'], previous_list=pool['indexes'],
+        timeout=timeout, processes=SEARCH_PROCESSES, use_cache=True,
+        anytime=True, timer=timer, maximize=auto['maximize'])
+
+    suggested = {
+        'indexes': compatible_subset or [],
+        'timed_out': find_compatible_subset.timed_out,
+        'incomplete': find_compatible_subset.incomplete,
+        'missing': {
+            index_set.name: missing for index_set, missing in zip(
+                index_sets, find_compatible_subset.missing) if missing},
+    }
+    if auto['maximize']:
+        suggested.update({
+            'upper_bound': find_compatible_subset.upper_bound,
+            'optimal': not find_compatible_subset.incomplete,
+        })
+    return suggested
@@ -0,0 +1,285 @@
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import time
+
+import numpy as np
+from django.db import transaction
+
+from .models import Index, IndexSet
+from .search import find_compatible_subset
+from .seqlogo import sequence_logo_svg
+from .utils import (
+    find_incompatible_index_pairs, hamming_distance, is_self_compatible,
+    remove_incompatible_indexes_from_queryset, weblogo_base64)
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Synthetic index sets are drawn from this seed, so every run benchmarks the
+# same sequences
+SEED = 0
+
+SIZES = [24, 96, 384, 1536, 10000]
+DISTANCES = [2, 3, 4]
+
+# Random sequences are short enough to collide often, while compatible ones
+# are long enough to be drawn at random with few collisions
+RANDOM_LENGTH = 8
+COMPATIBLE_LENGTH = 14
+MIXED_LENGTHS = (6, 10)
+
+# Runs whose time differs from the baseline by more than this share are
+# reported as faster or slower
+TOLERANCE = 0.1
+
+
+class Benchmark(object):
+    """
+    A named function to time; ``setup`` runs once, outside the timings, and
+    returns the function's arguments, which are passed to ``teardown`` once
+    the timings are done.
+    """
+
+    def __init__(self, name, function, setup=lambda: (), teardown=None):
+        self.name = name
+        self.function = function
+        self.setup = setup
+        self.teardown = teardown
+
+    def run(self, repeat):
+        arguments = self.setup()
+        try:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                self.function(*arguments)
+                times.append(time.perf_counter() - start)
+        finally:
+            if self.teardown is not None:
+                self.teardown(*arguments)
+        return {'min': min(times), 'median': statistics.median(times)}
+
+
+def compare_results(baseline, results, tolerance=TOLERANCE):
+    """
+    Yield ``(name, baseline seconds, seconds, ratio, change)`` for every
+    benchmark in ``results``, comparing minimum times.
+    """
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if previous is None:
+            yield (name, None, result['min'], None, 'new')
+            continue
+        ratio = result['min'] / previous['min']
+        if ratio > 1 + tolerance:
+            change = 'slower'
+        elif ratio < 1 - tolerance:
+            change = 'faster'
+        else:
+            change = ''
+        yield (name, previous['min'], result['min'], ratio, change)
+
+
+def compatible_sequences(size, distance=max(DISTANCES), seed=SEED):
+    """
+    Return ``size`` random sequences that are all at least ``distance``
+    apart.
+    """
+    sequences = random_sequences(
+        int(size * 1.1) + 10, length=COMPATIBLE_LENGTH, seed=seed)
+    _, positions = find_incompatible_index_pairs(
+        sequences, min_distance=distance, positions=True)
+    dropped = {j for _, j in positions}
+    compatible = [s for i, s in enumerate(sequences) if i not in dropped]
+    return compatible[:size]
+
+
+def default_benchmarks():
+    """
+    Return the benchmarks of the ``utils.py`` hot paths, over synthetic index
+    sets of each size in ``SIZES`` and the fixtures' index sets.
+    """
+    fixtures = fixture_index_sets()
+    all_fixtures = list(itertools.chain(*fixtures.values()))
+
+    lists = []
+    for size in SIZES:
+        lists.append(('random-{}'.format(size), random_sequences(size)))
+        lists.append(('compatible-{}'.format(size), compatible_sequences(size)))
+        lists.append(('mixed-{}'.format(size),
+                      random_sequences(size, length=MIXED_LENGTHS)))
+    lists.append(('fixtures-{}'.format(len(all_fixtures)), all_fixtures))
+
+    benchmarks = []
+
+    def all_pairs(sequences):
+        for a, b in itertools.combinations(sequences, 2):
+            hamming_distance(a, b)
+
+    for name, sequences in lists:
+        if len(sequences) <= 96:
+            benchmarks.append(Benchmark(
+                'hamming_distance/{}'.format(name), all_pairs,
+                lambda s=sequences: (s,)))
+
+    for name, sequences in lists:
+        for distance in DISTANCES:
+            benchmarks.append(Benchmark(
+                'is_self_compatible/{}/d{}'.format(name, distance),
+                is_self_compatible,
+                lambda s=sequences, d=distance: (s, d)))
+            benchmarks.append(Benchmark(
+                'find_incompatible_index_pairs/{}/d{}'.format(name, distance),
+                find_incompatible_index_pairs,
+                lambda s=sequences, d=distance: (s, d)))
+
+    previous_list = random_sequences(96, seed=SEED + 1)
+    for name, sequences in lists:
+        benchmarks.append(Benchmark(
+            'remove_incompatible_indexes_from_queryset/{}'.format(name),
+            remove_incompatible_indexes_from_queryset,
+            lambda s=sequences: (s, previous_list, 3)))
+
+    benchmarks.extend([
+        subset_search_benchmark(
+            'truseq', [fixtures['TruSeq']], [12]),
+        subset_search_benchmark(
+            'amaryllis-nextflex',
+            [fixtures['Amaryllis Nucleics'], fixtures['NEXTflex qRNA-Seq v2']],
+            [48, 48]),
+        subset_search_benchmark(
+            'compatible-1536', [compatible_sequences(1536)], [1000]),
+        subset_search_benchmark(
+            'maximum-amaryllis', [fixtures['Amaryllis Nucleics']], [None],
+            distance=5, maximize=True),
+        subset_search_benchmark(
+            'maximum-truseq-nextera',
+            [fixtures['TruSeq'], fixtures['Nextera i7']], [None, None],
+            maximize=True),
+        subset_search_benchmark(
+            'amaryllis-nextflex-two-channel',
+            [fixtures['Amaryllis Nucleics'], fixtures['NEXTflex qRNA-Seq v2']],
+            [48, 48],
+            color_balance={'chemistry': 'two_channel', 'mode': 'enforce'}),
+    ])
+
+    for name, sequences in lists:
+        if len(sequences) <= 1536:
+            benchmarks.append(Benchmark(
+                'sequence_logo_svg/{}'.format(name), sequence_logo_svg,
+                lambda s=sequences: (s,)))
+            # weblogo only draws sequences of one length
+            if weblogo_available() and len(set(map(len, sequences))) == 1:
+                benchmarks.append(Benchmark(
+                    'weblogo_base64/{}'.format(name), weblogo_base64,
+                    lambda s=sequences: (s,)))
+
+    return benchmarks
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def fixture_index_sets():
+    """
+    Return the sequences of each index set in the fixtures, by name.
+    """
+    index_sets = {}
+    for name in sorted(os.listdir(FIXTURE_DIR)):
+        with open(os.path.join(FIXTURE_DIR, name)) as f:
+            for obj in json.load(f):
+                if obj['model'] == 'compatible_index_sequences.index':
+                    index_set = obj['fields']['index_set'][0]
+                    index_sets.setdefault(index_set, []).append(
+                        obj['fields']['sequence'])
+    return index_sets
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def random_sequences(size, length=RANDOM_LENGTH, seed=SEED):
+    """
+    Return ``size`` random sequences of ``length`` bases, or of lengths drawn
+    from ``length`` if it is a ``(shortest, longest)`` range.
+    """
+    rng = random.Random('{}-{}-{}'.format(seed, size, length))
+    sequences = []
+    for _ in range(size):
+        n = rng.randint(*length) if isinstance(length, tuple) else length
+        sequences.append(''.join(rng.choice('ACGT') for _ in range(n)))
+    return sequences
+
+
+def run_benchmarks(benchmarks, repeat=3, pattern=None, callback=None):
+    results = {'environment': environment(), 'repeat': repeat, 'benchmarks': {}}
+    for benchmark in benchmarks:
+        if pattern is not None and pattern not in benchmark.name:
+            continue
+        results['benchmarks'][benchmark.name] = benchmark.run(repeat)
+        if callback is not None:
+            callback(benchmark.name, results['benchmarks'][benchmark.name])
+    return results
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def subset_search_benchmark(name, index_sets, subset_sizes, distance=3,
+                            maximize=False, color_balance=None):
+    """
+    Time ``find_compatible_subset`` on index sets that only exist for the
+    benchmark. They are created before and deleted after the timings, and
+    each run's distance matrices are rolled back so that they are computed
+    every time.
+    """
+    def setup():
+        sets = []
+        for number, sequences in enumerate(index_sets):
+            index_set = IndexSet.objects.create(
+                name='Benchmark {} {}'.format(name, number), index_type='i7')
+            Index.objects.bulk_create(
+                Index(name=str(i), sequence=sequence, index_set=index_set)
+                for i, sequence in enumerate(sequences))
+            IndexSet.objects.update_statistics(index_set)
+            index_set.refresh_from_db()
+            sets.append(index_set)
+        return (sets,)
+
+    def search(sets):
+        with transaction.atomic():
+            find_compatible_subset(
+                sets, subset_sizes, min_length=float('inf'),
+                min_distance=distance, timeout=600, maximize=maximize,
+                color_balance=color_balance)
+            transaction.set_rollback(True)
+
+    def teardown(sets):
+        IndexSet.objects.filter(pk__in=[s.pk for s in sets]).delete()
+
+    return Benchmark(
+        'find_compatible_subset/{}'.format(name), search, setup, teardown)
+
+
+def weblogo_available():
+    try:
+        import weblogolib  # noqa: F401
+    except ImportError:
+        return False
+    return shutil.which('gs') is not None
@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from django.db.models import Count, Max
+
+from .models import Index, IndexSet
+
+# Catalog shared by every request handled by this process
+index_catalog = None
+
+
+class IndexCatalog(object):
+    """
+    In-memory lookup from sequences to the indexes that use them, either
+    directly or as their reverse complement. Sequences are compared
+    case-insensitively.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.by_sequence = defaultdict(list)
+        self.by_reverse_complement = defaultdict(list)
+
+        for index in Index.objects.select_related('index_set'):
+            self.by_sequence[index.sequence].append(index)
+            self.by_reverse_complement[index.reverse_complement].append(index)
+
+    def lookup(self, sequence, include_reverse_complement=False):
+        sequence = sequence.upper()
+        hits = list(self.by_sequence.get(sequence, []))
+        if include_reverse_complement:
+            hits.extend(
+                index for index in self.by_reverse_complement.get(sequence, [])
+                if index not in hits)
+        return hits
+
+    def lookup_many(self, sequences, include_reverse_complement=False):
+        return {
+            sequence: self.lookup(sequence, include_reverse_complement)
+            for sequence in sequences}
+
+
+def catalog_state():
+    """
+    Return the time of the latest change to an index set (or None), with the
+    numbers of index sets and indexes.
+    """
+    catalog = IndexSet.objects.aggregate(
+        last_modified=Max('last_modified'),
+        index_sets=Count('pk', distinct=True),
+        indexes=Count('index'),
+    )
+    return (
+        catalog['last_modified'], catalog['index_sets'], catalog['indexes'])
+
+
+def catalog_version(state=None):
+    """
+    Return a string that changes whenever an index set or index is added,
+    changed or deleted, optionally from an already queried ``state``.
+    """
+    if state is None:
+        state = catalog_state()
+    last_modified, index_sets, indexes = state
+    return '{}-{}-{}'.format(
+        last_modified.timestamp() if last_modified is not None else 0,
+        index_sets, indexes)
+
+
+def get_index_catalog():
+    """
+    Return the process-wide index catalog, reloading it if index sets have
+    changed since it was loaded (possibly by another process).
+    """
+    global index_catalog
+    version = catalog_version()
+    catalog = index_catalog
+    if catalog is None or catalog.version != version:
+        catalog = index_catalog = IndexCatalog(version)
+    return catalog
+
+
+def invalidate_index_catalog():
+    global index_catalog
+    index_catalog = None
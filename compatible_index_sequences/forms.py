@@ -5,7 +5,9 @@ from django import forms
 from django.core import validators
 
 from .models import IndexSet
-from .utils import index_list_from_samplesheet
+from .utils import (
+    COLOR_BALANCE_CHOICES, COLOR_BALANCE_MODE_CHOICES, DUAL_INDEX_RULE_CHOICES,
+    INDEX_PAIRING_CHOICES, index_list_from_samplesheet)
 
 
 class BaseForm(forms.Form):
@@ -67,6 +69,32 @@ class CompatibilityParameters(forms.Form):
         required=False,
     )
 
+    config_dual = forms.BooleanField(
+        label='Dual-Indexed?',
+        required=False,
+        widget=forms.HiddenInput,
+    )
+
+    config_distance_2 = forms.IntegerField(
+        initial=3,
+        label='Minimum Hamming distance for index 2',
+        required=False,
+    )
+    config_dual_rule = forms.ChoiceField(
+        choices=DUAL_INDEX_RULE_CHOICES,
+        initial='both',
+        label='Dual-indexed pairs are incompatible when',
+        required=False,
+    )
+
+    def clean(self):
+        cleaned_data = super(CompatibilityParameters, self).clean()
+        if cleaned_data.get('config_distance_2') is None:
+            cleaned_data['config_distance_2'] = cleaned_data.get('config_distance')
+        if not cleaned_data.get('config_dual_rule'):
+            cleaned_data['config_dual_rule'] = 'both'
+        return cleaned_data
+
 
 class AutoIndexListForm(BaseForm, CompatibilityParameters):
 
@@ -77,7 +105,7 @@ class AutoIndexListForm(BaseForm, CompatibilityParameters):
     subset_size_1 = forms.IntegerField(
         label="Number of indexes to use",
         min_value = 1,
-        required=True,
+        required=False,
     )
 
     index_set_2 = forms.ModelChoiceField(
@@ -100,6 +128,44 @@ class AutoIndexListForm(BaseForm, CompatibilityParameters):
         required=False,
     )
 
+    index_2_set_1 = forms.ModelChoiceField(
+        queryset=IndexSet.objects.filter(index_type='i5'),
+        required=False,
+    )
+    index_2_set_2 = forms.ModelChoiceField(
+        queryset=IndexSet.objects.filter(index_type='i5'),
+        required=False,
+    )
+    index_2_set_3 = forms.ModelChoiceField(
+        queryset=IndexSet.objects.filter(index_type='i5'),
+        required=False,
+    )
+    config_pairing = forms.ChoiceField(
+        choices=INDEX_PAIRING_CHOICES,
+        initial='combinatorial',
+        label='Dual-indexed pairs combine',
+        required=False,
+    )
+
+    config_color_balance = forms.ChoiceField(
+        choices=COLOR_BALANCE_CHOICES,
+        initial='',
+        label='Color balance',
+        required=False,
+    )
+    config_color_balance_mode = forms.ChoiceField(
+        choices=COLOR_BALANCE_MODE_CHOICES,
+        initial='enforce',
+        label='Color balance mode',
+        required=False,
+    )
+
+    maximize = forms.BooleanField(
+        label='Find the largest compatible set of indexes instead of the '
+              'number of indexes to use from each index set.',
+        required=False,
+    )
+
     extend_search_time = forms.BooleanField(
         label='Extend maximum search time from 10 seconds to 1 minute.<br>'
               '<small>Some searches may take a while to finish, especially '
@@ -109,6 +175,23 @@ class AutoIndexListForm(BaseForm, CompatibilityParameters):
         required=False,
     )
 
+    def available_count(self, number):
+        """
+        Return how many indexes (or pairs, when dual-indexed) the index set
+        in row ``number`` can supply.
+        """
+        index_set = self.cleaned_data.get('index_set_{}'.format(number))
+        if not self.cleaned_data.get('config_dual'):
+            return index_set.index_count
+
+        index_2_set = self.cleaned_data.get('index_2_set_{}'.format(number))
+        if index_2_set is None:
+            raise forms.ValidationError(
+                'Please select an index 2 set for Index set {}.'.format(number))
+        if self.cleaned_data['config_pairing'] == 'paired':
+            return len(index_set.paired_index_names(index_2_set))
+        return index_set.index_count * index_2_set.index_count
+
     def clean(self):
         cleaned_data = super(AutoIndexListForm, self).clean()
         index_set_1 = cleaned_data.get('index_set_1')
@@ -117,45 +200,77 @@ class AutoIndexListForm(BaseForm, CompatibilityParameters):
         subset_size_1 = cleaned_data.get('subset_size_1')
         subset_size_2 = cleaned_data.get('subset_size_2')
         subset_size_3 = cleaned_data.get('subset_size_3')
-
-        try:
-            set_size_1 = len(index_set_1.index_set.all())
-            valid_subset_size_1 = (subset_size_1 <= set_size_1)
-        except:
-            pass
-        else:
-            if not valid_subset_size_1:
+        config_dual = cleaned_data.get('config_dual')
+        maximize = cleaned_data.get('maximize')
+        if not cleaned_data.get('config_pairing'):
+            cleaned_data['config_pairing'] = 'combinatorial'
+        unit = 'index pairs' if config_dual else 'indexes'
+
+        config_color_balance = cleaned_data.get('config_color_balance')
+        cleaned_data['color_balance'] = None
+        if config_color_balance:
+            if config_dual or maximize:
+                raise forms.ValidationError(
+                    'Color balance can only be used when choosing a number '
+                    'of single-indexed sequences.')
+            cleaned_data['color_balance'] = {
+                'chemistry': config_color_balance,
+                'mode': cleaned_data.get('config_color_balance_mode') or 'enforce',
+            }
+
+        if maximize:
+            if config_dual:
                 raise forms.ValidationError(
-                    'Number of indexes used ({}) exceeds the number available ({}) for Index set 1 ({}).'.format(
-                        subset_size_1, set_size_1, index_set_1))
+                    'The largest compatible set can only be found for single-indexed sequences.')
+        elif subset_size_1 is None:
+            if 'subset_size_1' not in self.errors:
+                self.add_error('subset_size_1', 'This field is required.')
+        elif index_set_1 is not None:
+            set_size_1 = self.available_count(1)
+            if subset_size_1 > set_size_1:
+                raise forms.ValidationError(
+                    'Number of {} used ({}) exceeds the number available '
+                    '({}) for Index set 1 ({}).'.format(
+                        unit, subset_size_1, set_size_1, index_set_1))
 
-        if index_set_2 is not None:
+        if index_set_2 is not None and not maximize:
             if subset_size_2 is None:
                 raise forms.ValidationError(
                     'Please enter number of indexes to use for Index set 2.')
 
-            set_size_2 = len(index_set_2.index_set.all())
+            set_size_2 = self.available_count(2)
             if subset_size_2 > set_size_2:
                 raise forms.ValidationError(
-                    'Number of indexes used ({}) exceeds the number available ({}) for Index set 2 ({}).'.format(
-                        subset_size_2, set_size_2, index_set_2))
-        if index_set_3 is not None:
+                    'Number of {} used ({}) exceeds the number available '
+                    '({}) for Index set 2 ({}).'.format(
+                        unit, subset_size_2, set_size_2, index_set_2))
+        if index_set_3 is not None and not maximize:
             if subset_size_3 is None:
                 raise forms.ValidationError(
                     'Please enter number of indexes to use for Index set 3.')
 
-            set_size_3 = len(index_set_3.index_set.all())
+            set_size_3 = self.available_count(3)
             if subset_size_3 > set_size_3:
                 raise forms.ValidationError(
-                    'Number of indexes used ({}) exceeds the number available ({}) for Index set 3 ({}).'.format(
-                        subset_size_3, set_size_3, index_set_3))
+                    'Number of {} used ({}) exceeds the number available '
+                    '({}) for Index set 3 ({}).'.format(
+                        unit, subset_size_3, set_size_3, index_set_3))
 
         selected_sets = [s for s in [index_set_1, index_set_2, index_set_3] if s is not None]
         if len(selected_sets) > len(set(selected_sets)):
             raise forms.ValidationError('You selected the same index set multiple times.')
+        if config_dual:
+            selected_sets += [
+                cleaned_data.get('index_2_set_{}'.format(number))
+                for number in range(1, 4)
+                if cleaned_data.get('index_set_{}'.format(number))]
+        for index_set in filter(None, selected_sets):
+            try:
+                index_set.min_length()
+            except ValueError:
+                raise forms.ValidationError(
+                    'Index set {} has no indexes.'.format(index_set))
 
-        # config_dual = cleaned_data.get('config_dual')
-        config_dual = False    # Dual indexing not yet implemented for Auto Mode
         index_list = cleaned_data.get('index_list')
 
         custom_index_list = index_list.splitlines()
@@ -169,6 +284,10 @@ class AutoIndexListForm(BaseForm, CompatibilityParameters):
 
         custom_index_list.extend(samplesheet_index_set.keys())
 
+        cleaned_data['dual_indexed'] = bool(config_dual)
+        cleaned_data['index_list'] = custom_index_list
+        cleaned_data['samplesheet_index_set'] = samplesheet_index_set
+
         if len(custom_index_list) > 0:
             comma_count = Counter()
             for index in custom_index_list:
@@ -200,12 +319,6 @@ class AutoIndexListForm(BaseForm, CompatibilityParameters):
 
 class CustomIndexListForm(BaseForm, CompatibilityParameters):
 
-    config_dual = forms.BooleanField(
-        label='Dual-Indexed?',
-        required=False,
-        widget=forms.HiddenInput,
-    )
-
     def clean(self):
         cleaned_data = super(CustomIndexListForm, self).clean()
         config_dual = cleaned_data.get('config_dual')
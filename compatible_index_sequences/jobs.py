@@ -0,0 +1,158 @@
+import datetime
+import json
+import logging
+import time
+import traceback
+
+from django.utils import timezone
+
+from .metrics import PhaseTimer, record_search, search_outcome
+from .models import IndexSet, SearchJob
+from .search import (
+    SEARCH_PROCESSES, build_subset_search, cache_search_result,
+    search_cache_key)
+
+
+# Minimum number of seconds between progress updates written for a job
+PROGRESS_INTERVAL = 1
+
+# Running jobs not finished within this time are assumed to have lost
+# their worker
+STALE_AFTER = datetime.timedelta(minutes=10)
+
+
+def claim_next_search_job():
+    pending = SearchJob.objects.filter(status='pending').order_by('created')
+    for job in pending[:10]:
+        claimed = SearchJob.objects.filter(
+            pk=job.pk, status='pending').update(
+                status='running', started=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def create_search_job(index_set_list, subset_size_list, min_length,
+                      min_distance, custom_list, timeout,
+                      samplesheet_index_set, initial, dual=None,
+                      maximize=False, color_balance=None):
+    selected = [
+        (index_set, subset_size)
+        for index_set, subset_size in zip(index_set_list, subset_size_list)
+        if index_set is not None]
+    # A search for the largest subset aims at (and keeps lowering) a bound
+    # on its size, starting from every candidate
+    if maximize:
+        target_size = sum(index_set.index_count for index_set, _ in selected)
+    else:
+        target_size = sum(size for _, size in selected)
+    parameters = {
+        'index_sets': [index_set.pk for index_set, _ in selected],
+        'subset_sizes': [subset_size for _, subset_size in selected],
+        'min_length': min_length,
+        'min_distance': min_distance,
+        'custom_list': list(custom_list),
+        'timeout': timeout,
+        'samplesheet_index_set': samplesheet_index_set,
+        'initial': initial,
+        'dual': dual,
+        'maximize': maximize,
+        'color_balance': color_balance,
+    }
+    return SearchJob.objects.create(
+        parameters=json.dumps(parameters),
+        target_size=target_size,
+    )
+
+
+def fail_stale_search_jobs():
+    return SearchJob.objects.filter(
+        status='running', started__lt=timezone.now() - STALE_AFTER).update(
+            status='failed', finished=timezone.now(),
+            error='The search worker stopped before finishing this search.')
+
+
+def run_search_job(job):
+    parameters = job.get_parameters()
+    maximize = parameters.get('maximize', False)
+    last_update = [0]
+
+    def report_progress(search):
+        now = time.time()
+        if now - last_update[0] < PROGRESS_INTERVAL:
+            return
+        last_update[0] = now
+        estimated_finish = timezone.now() + datetime.timedelta(
+            seconds=search.estimated_time_remaining())
+        progress = {}
+        if maximize:
+            progress['target_size'] = search.upper_bound
+        SearchJob.objects.filter(pk=job.pk).update(
+            nodes_explored=search.nodes_explored,
+            best_partial=json.dumps(search.format_result(search.best)),
+            estimated_finish=estimated_finish,
+            **progress
+        )
+
+    timer = PhaseTimer('search_job')
+    try:
+        with timer.phase('db'):
+            index_sets = IndexSet.objects.in_bulk(parameters['index_sets'])
+            index_set_list = [index_sets[pk] for pk in parameters['index_sets']]
+        with timer.phase('distance'):
+            search = build_subset_search(
+                index_set_list, parameters['subset_sizes'],
+                parameters['min_length'],
+                min_distance=parameters['min_distance'],
+                previous_list=parameters['custom_list'],
+                timeout=parameters['timeout'],
+                progress_callback=report_progress,
+                dual=parameters.get('dual'), maximize=maximize,
+                color_balance=parameters.get('color_balance'))
+        with timer.phase('search'):
+            search_start = time.perf_counter()
+            result = search.run(processes=SEARCH_PROCESSES, anytime=True)
+        record_search(search, timer.mode, time.perf_counter() - search_start)
+        cache_search_result(
+            search_cache_key(
+                index_set_list, parameters['subset_sizes'],
+                parameters['min_length'], parameters['min_distance'],
+                parameters['custom_list'], dual=parameters.get('dual'),
+                maximize=maximize,
+                color_balance=parameters.get('color_balance'), anytime=True,
+                processes=SEARCH_PROCESSES),
+            search, result, parameters['timeout'])
+    except Exception:
+        SearchJob.objects.filter(pk=job.pk).update(
+            status='failed', finished=timezone.now(),
+            error=traceback.format_exc())
+        timer.finish('failed', level=logging.ERROR, job=job.pk)
+    else:
+        finished = {}
+        if maximize:
+            finished['target_size'] = search.upper_bound
+        SearchJob.objects.filter(pk=job.pk).update(
+            status='done', finished=timezone.now(),
+            result=json.dumps(result),
+            best_partial=json.dumps(search.format_result(search.best)),
+            nodes_explored=search.nodes_explored,
+            timed_out=search.timed_out,
+            incomplete=search.incomplete,
+            missing=json.dumps(search.missing),
+            estimated_finish=None,
+            **finished
+        )
+        timer.finish(
+            search_outcome(result, search.timed_out, search.incomplete),
+            job=job.pk,
+            index_sets=parameters['index_sets'],
+            subset_sizes=parameters['subset_sizes'],
+            indexes=len(parameters['custom_list']),
+            dual_indexed=parameters.get('dual') is not None,
+            maximize=maximize,
+            min_distance=parameters['min_distance'],
+            length=parameters['min_length'],
+            nodes=search.nodes_explored)
+    job.refresh_from_db()
+    return job
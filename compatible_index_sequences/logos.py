@@ -0,0 +1,106 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+from .seqlogo import sequence_logo_svg
+from .utils import minimum_index_length_from_lists, weblogo_png
+
+
+# Cache alias and lifetime (in seconds) of sequence logos and the sequences
+# they are drawn from
+LOGO_CACHE = getattr(settings, 'COMPATIBLE_INDEX_SEQUENCES_LOGO_CACHE', 'default')
+LOGO_CACHE_TIMEOUT = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_LOGO_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Draw logos as SVG ('svg') or as PNG with weblogo ('weblogo')
+LOGO_RENDERER = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_LOGO_RENDERER', 'svg')
+
+LOGO_CONTENT_TYPES = {
+    'svg': 'image/svg+xml',
+    'weblogo': 'image/png',
+}
+
+LOGO_UNITS = ['bit', 'probability']
+
+# Logos whose sequences sign and compress to at most this many characters
+# are identified by them, so that they can be drawn from the URL alone;
+# larger ones are identified by a hash of sequences kept in the logo cache
+LOGO_TOKEN_MAX_LENGTH = 2000
+
+LOGO_TOKEN_SALT = 'compatible_index_sequences.logo'
+
+
+def get_logo(key, unit):
+    """
+    Return the logo in ``unit`` for the sequences in or registered under
+    ``key``, rendering and caching both units if needed, or ``None`` if the
+    sequences are unknown.
+    """
+    index_list = None
+    if not re.match('^[0-9a-f]{40}$', key):
+        try:
+            index_list = signing.loads(key, salt=LOGO_TOKEN_SALT)
+        except signing.BadSignature:
+            return None
+        key = logo_key(index_list)
+
+    cache = caches[LOGO_CACHE]
+    logo = cache.get(logo_cache_key(key, unit))
+    if logo is not None:
+        return logo
+
+    if index_list is None:
+        index_list = cache.get(logo_cache_key(key, 'sequences'))
+    if index_list is None:
+        return None
+
+    logos = render_logos(index_list)
+    cache.set_many(
+        {logo_cache_key(key, u): logos[u] for u in LOGO_UNITS},
+        LOGO_CACHE_TIMEOUT)
+    return logos[unit]
+
+
+def logo_cache_key(key, suffix):
+    return 'compatible_index_sequences:logo:{}:{}:{}'.format(
+        LOGO_RENDERER, key, suffix)
+
+
+def logo_key(index_list):
+    """
+    Identify a logo by the multiset of its sequences and their length, so
+    that the same sequences in any order share one logo.
+    """
+    length = minimum_index_length_from_lists(index_list)
+    sequences = '\n'.join(sorted(index.upper() for index in index_list))
+    return hashlib.sha1(
+        '{}\n{}'.format(length, sequences).encode('utf-8')).hexdigest()
+
+
+def register_logo(index_list):
+    """
+    Return the key of a logo: its signed sequences if they are short enough,
+    and otherwise a hash under which the sequences are remembered.
+    """
+    token = signing.dumps(
+        sorted(index.upper() for index in index_list), salt=LOGO_TOKEN_SALT,
+        compress=True)
+    if len(token) <= LOGO_TOKEN_MAX_LENGTH:
+        return token
+
+    key = logo_key(index_list)
+    caches[LOGO_CACHE].set(
+        logo_cache_key(key, 'sequences'), list(index_list), LOGO_CACHE_TIMEOUT)
+    return key
+
+
+def render_logos(index_list):
+    if LOGO_RENDERER == 'weblogo':
+        return weblogo_png(index_list)
+    return {
+        unit: sequence_logo_svg(index_list, unit).encode('utf-8')
+        for unit in LOGO_UNITS}
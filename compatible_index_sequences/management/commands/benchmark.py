@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+
+from compatible_index_sequences.benchmarks import (
+    compare_results, default_benchmarks, load_results, run_benchmarks,
+    save_results)
+
+
+class Command(BaseCommand):
+    help = ('Time the compatibility checks and searches on synthetic and '
+            'fixture index sets, optionally saving the timings as a baseline '
+            'or comparing them to one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--compare',
+            help='Compare the timings to a baseline saved with --save.',
+            metavar='BASELINE',
+        )
+        parser.add_argument(
+            '--filter',
+            help='Only run benchmarks whose names contain this text.',
+        )
+        parser.add_argument(
+            '--repeat',
+            default=3,
+            help='Number of times to run each benchmark (default: %(default)s).',
+            type=int,
+        )
+        parser.add_argument(
+            '--save',
+            help='Save the timings to this file.',
+            metavar='BASELINE',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            baseline = load_results(options['compare'])
+
+        def report(name, result):
+            self.stdout.write('{:<70} {:>10.6f} s'.format(name, result['min']))
+
+        results = run_benchmarks(
+            default_benchmarks(), repeat=options['repeat'],
+            pattern=options['filter'],
+            callback=None if baseline else report)
+
+        if options['save']:
+            save_results(results, options['save'])
+            self.stderr.write('Saved {} timings to {}.'.format(
+                len(results['benchmarks']), options['save']))
+
+        if baseline is not None:
+            if baseline['environment'] != results['environment']:
+                self.stderr.write(
+                    'The baseline was run in a different environment: '
+                    '{}'.format(baseline['environment']))
+            self.stdout.write('{:<70} {:>10} {:>10} {:>7}'.format(
+                'Benchmark', 'Baseline', 'Current', 'Ratio'))
+            for name, before, after, ratio, change in compare_results(
+                    baseline, results):
+                self.stdout.write('{:<70} {:>10} {:>10.6f} {:>7} {}'.format(
+                    name,
+                    '' if before is None else '{:.6f}'.format(before),
+                    after,
+                    '' if ratio is None else '{:.2f}'.format(ratio),
+                    change))
@@ -0,0 +1,328 @@
+import csv
+import io
+import json
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from compatible_index_sequences.catalog import invalidate_index_catalog
+from compatible_index_sequences.models import (
+    Index, IndexSet, IndexSetDistanceMatrix)
+
+
+# Indexes are written in batches of this many rows
+BATCH_SIZE = 1000
+
+# Characters read from JSON files at a time
+CHUNK_SIZE = 1 << 16
+
+# Index set fields that catalog files may set
+INDEX_SET_FIELDS = ['description', 'url', 'index_type', 'visible_in_interactive']
+
+# Errors reported before the import gives up
+MAX_ERRORS = 20
+
+FORMATS = {'.json': 'json', '.jsonl': 'json', '.csv': 'csv', '.tsv': 'tsv'}
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def clean_field(model, name, value):
+    """
+    Validate ``value`` the same way a form or ``full_clean`` would for the
+    field ``name`` of ``model``.
+    """
+    try:
+        return model._meta.get_field(name).clean(value, None)
+    except ValidationError as e:
+        raise ImportFileError('{}: {}'.format(name, ' '.join(e.messages)))
+
+
+def iter_json_objects(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield the objects of a JSON array (such as a fixture) or of JSON lines
+    one at a time, reading ``file`` in chunks rather than all at once.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        # Objects are separated by whitespace, commas and the array brackets
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            continue
+
+        try:
+            obj, end = decoder.raw_decode(buffer, position)
+        except ValueError as e:
+            if eof:
+                raise ImportFileError('Invalid JSON: {}'.format(e))
+            # The object continues in the next chunk
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            continue
+        yield obj
+        position = end
+
+
+def read_csv(file, delimiter):
+    """
+    Yield ``(line, record)`` for each row of a CSV or TSV catalog, which has
+    ``index_set``, ``name`` and ``sequence`` columns and, optionally, a
+    column for each field in ``INDEX_SET_FIELDS``.
+    """
+    reader = csv.DictReader(file, delimiter=delimiter)
+    missing = {'index_set', 'name', 'sequence'} - set(reader.fieldnames or [])
+    if missing:
+        raise ImportFileError(
+            'Missing columns: {}'.format(', '.join(sorted(missing))))
+
+    for row in reader:
+        index_set = {
+            field: row[field] for field in INDEX_SET_FIELDS
+            if row.get(field) not in (None, '')}
+        index_set['name'] = row['index_set']
+        yield reader.line_num, ('index_set', index_set)
+        yield reader.line_num, ('index', {
+            'index_set': row['index_set'],
+            'name': row['name'],
+            'sequence': row['sequence'],
+        })
+
+
+def read_json(file):
+    """
+    Yield ``(number, record)`` for each object of a JSON catalog in the
+    fixture format (see ``fixtures/``).
+    """
+    for number, obj in enumerate(iter_json_objects(file), 1):
+        if not isinstance(obj, dict) or not isinstance(obj.get('fields'), dict):
+            raise ImportFileError(
+                'Object {}: expected a model and fields.'.format(number))
+        fields = obj['fields']
+        if obj.get('model') == 'compatible_index_sequences.indexset':
+            yield number, ('index_set', {
+                field: fields[field] for field in ['name'] + INDEX_SET_FIELDS
+                if field in fields})
+        elif obj.get('model') == 'compatible_index_sequences.index':
+            index_set = fields.get('index_set')
+            # Natural keys are lists of the set's name
+            if isinstance(index_set, list) and len(index_set) == 1:
+                index_set = index_set[0]
+            yield number, ('index', {
+                'index_set': index_set,
+                'name': fields.get('name'),
+                'sequence': fields.get('sequence'),
+            })
+        else:
+            raise ImportFileError('Object {}: unsupported model {}.'.format(
+                number, obj.get('model')))
+
+
+def read_records(path, file_format=None):
+    """
+    Yield ``(location, record)`` for each index set and index in a catalog
+    file, where ``record`` is ``('index_set', fields)`` or
+    ``('index', fields)``.
+    """
+    if file_format is None:
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in FORMATS:
+            raise CommandError('Unknown file format: {}'.format(path))
+        file_format = FORMATS[extension]
+
+    with io.open(path, encoding='utf-8-sig', newline='') as file:
+        if file_format == 'json':
+            records = read_json(file)
+        else:
+            records = read_csv(file, ',' if file_format == 'csv' else '\t')
+        try:
+            for location, record in records:
+                yield '{}:{}'.format(path, location), record
+        except ImportFileError as e:
+            raise CommandError('{}: {}'.format(path, e))
+
+
+class CatalogImport(object):
+    """
+    Upsert index sets and indexes, writing indexes in batches and deferring
+    what signals would update after every save until ``finish``.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.index_sets = IndexSet.objects.in_bulk(field_name='name')
+        self.existing = {}
+        self.seen = set()
+        self.changed_sets = {}
+        self.to_create = []
+        self.to_update = []
+        self.counts = {'index_sets': 0, 'created': 0, 'updated': 0,
+                       'unchanged': 0}
+
+    def add_index_set(self, fields):
+        name = clean_field(IndexSet, 'name', fields.get('name'))
+        values = {
+            field: clean_field(IndexSet, field, value)
+            for field, value in fields.items() if field in INDEX_SET_FIELDS}
+
+        index_set = self.index_sets.get(name)
+        if index_set is None:
+            index_set = IndexSet.objects.create(name=name, **values)
+            self.index_sets[name] = index_set
+            self.existing[index_set.pk] = {}
+            self.counts['index_sets'] += 1
+        elif any(getattr(index_set, f) != v for f, v in values.items()):
+            for field, value in values.items():
+                setattr(index_set, field, value)
+            self.changed_sets[index_set.pk] = index_set
+        return index_set
+
+    def add_index(self, fields):
+        if not isinstance(fields['index_set'], str):
+            raise ImportFileError('index_set: Expected the name of a set.')
+        index_set = self.index_sets.get(fields['index_set'])
+        if index_set is None:
+            index_set = self.add_index_set({'name': fields['index_set']})
+        name = clean_field(Index, 'name', fields['name'])
+        sequence = clean_field(Index, 'sequence', fields['sequence']).upper()
+
+        if (index_set.pk, name) in self.seen:
+            raise ImportFileError(
+                'Duplicate index {} in {}.'.format(name, index_set))
+        self.seen.add((index_set.pk, name))
+
+        if index_set.pk not in self.existing:
+            self.existing[index_set.pk] = {
+                n: (pk, s) for pk, n, s in
+                index_set.index_set.values_list('pk', 'name', 'sequence')}
+        existing = self.existing[index_set.pk].get(name)
+
+        if existing is None:
+            index = Index(index_set=index_set, name=name, sequence=sequence)
+            self.to_create.append(index)
+            self.counts['created'] += 1
+        elif existing[1] != sequence:
+            index = Index(
+                pk=existing[0], index_set=index_set, name=name,
+                sequence=sequence)
+            self.to_update.append(index)
+            self.counts['updated'] += 1
+        else:
+            self.counts['unchanged'] += 1
+            return
+        # Bulk writes skip the pre_save signal that does this
+        index.normalize_sequence()
+
+        if len(self.to_create) + len(self.to_update) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.to_create:
+            Index.objects.bulk_create(self.to_create)
+        if self.to_update:
+            Index.objects.bulk_update(
+                self.to_update, ['sequence', 'reverse_complement'])
+        for index in self.to_create + self.to_update:
+            self.changed_sets.setdefault(index.index_set_id, None)
+        self.to_create = []
+        self.to_update = []
+
+    def finish(self):
+        """
+        Write the remaining indexes, then update the statistics (leaving
+        self distances to be recomputed when next read), distance matrices
+        and modification time of every changed set once.
+        """
+        self.flush()
+        IndexSet.objects.bulk_update(
+            [s for s in self.changed_sets.values() if s is not None],
+            INDEX_SET_FIELDS)
+        now = timezone.now()
+        for pk in self.changed_sets:
+            IndexSet.objects.update_statistics(pk)
+            IndexSetDistanceMatrix.objects.invalidate(pk)
+            IndexSet.objects.filter(pk=pk).update(last_modified=now)
+        invalidate_index_catalog()
+
+
+class Command(BaseCommand):
+    help = ('Import index sets and indexes from JSON fixtures, CSV or TSV '
+            'files, adding new indexes and updating changed sequences.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            help='Catalog files (.json, .jsonl, .csv or .tsv).',
+            nargs='+',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['json', 'csv', 'tsv'],
+            help='Format of every file (default: from its extension).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            default=BATCH_SIZE,
+            help='Number of indexes written at a time (default: %(default)s).',
+            type=int,
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate the files and report changes without saving them.',
+        )
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            if not os.path.isfile(path):
+                raise CommandError('No such file: {}'.format(path))
+
+        errors = []
+        with transaction.atomic():
+            catalog_import = CatalogImport(batch_size=options['batch_size'])
+            for path in options['paths']:
+                for location, (kind, fields) in read_records(
+                        path, options['format']):
+                    try:
+                        if kind == 'index_set':
+                            catalog_import.add_index_set(fields)
+                        else:
+                            catalog_import.add_index(fields)
+                    except ImportFileError as e:
+                        errors.append('{}: {}'.format(location, e))
+                        if len(errors) >= MAX_ERRORS:
+                            break
+                if len(errors) >= MAX_ERRORS:
+                    break
+
+            if errors:
+                raise CommandError('Nothing imported:\n{}'.format(
+                    '\n'.join(errors)))
+
+            catalog_import.finish()
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        counts = catalog_import.counts
+        self.stdout.write(
+            '{} {} new index sets; {} new, {} changed and {} unchanged '
+            'indexes.'.format(
+                'Would import' if options['dry_run'] else 'Imported',
+                counts['index_sets'], counts['created'], counts['updated'],
+                counts['unchanged']))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from compatible_index_sequences.catalog import invalidate_index_catalog
+from compatible_index_sequences.models import (
+    Index, IndexSet, IndexSetDistanceMatrix)
+
+
+# Indexes are written in batches of this many rows
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Store every index sequence in upper case, along with its '
+            'reverse complement.')
+
+    def handle(self, *args, **options):
+        count = 0
+        batch = []
+        changed_sets = set()
+        with transaction.atomic():
+            indexes = Index.objects.only(
+                'pk', 'index_set', 'sequence', 'reverse_complement')
+            for index in indexes.iterator():
+                stored = (index.sequence, index.reverse_complement)
+                index.normalize_sequence()
+                if (index.sequence, index.reverse_complement) == stored:
+                    continue
+                if index.sequence != stored[0]:
+                    changed_sets.add(index.index_set_id)
+                batch.append(index)
+                if len(batch) == BATCH_SIZE:
+                    Index.objects.bulk_update(
+                        batch, ['sequence', 'reverse_complement'])
+                    count += len(batch)
+                    batch = []
+            Index.objects.bulk_update(batch, ['sequence', 'reverse_complement'])
+            count += len(batch)
+
+            for pk in changed_sets:
+                IndexSet.objects.update_statistics(pk)
+                IndexSetDistanceMatrix.objects.invalidate(pk)
+            IndexSet.objects.filter(pk__in=changed_sets).update(
+                last_modified=timezone.now())
+        invalidate_index_catalog()
+
+        self.stdout.write('Normalized {} indexes.'.format(count))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from compatible_index_sequences.jobs import (
+    claim_next_search_job, fail_stale_search_jobs, run_search_job)
+
+
+class Command(BaseCommand):
+    help = 'Run queued Auto Mode searches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            default=1.0,
+            help='Seconds to wait before checking an empty queue again.',
+            type=float,
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            stale = fail_stale_search_jobs()
+            if stale:
+                self.stderr.write(
+                    'Marked {} stale search job(s) as failed.'.format(stale))
+
+            job = claim_next_search_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            job = run_search_job(job)
+            self.stdout.write('Search job {} {} after {} nodes.'.format(
+                job.pk, job.status, job.nodes_explored))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from compatible_index_sequences.models import IndexSet
+
+
+class Command(BaseCommand):
+    help = ('Recompute the stored index count, index lengths and self '
+            'distances of every index set.')
+
+    def handle(self, *args, **options):
+        count = 0
+        for pk in IndexSet.objects.values_list('pk', flat=True):
+            IndexSet.objects.update_statistics(pk, self_distances=True)
+            count += 1
+
+        self.stdout.write('Updated statistics for {} index sets.'.format(count))
@@ -0,0 +1,289 @@
+import csv
+import fnmatch
+import functools
+import glob
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from compatible_index_sequences.utils import (
+    DUAL_INDEX_RULE_CHOICES, find_incompatible_dual_index_pairs,
+    find_incompatible_index_pairs, hamming_distance,
+    index_list_from_samplesheet, minimum_index_length_from_lists)
+
+
+CSV_FIELDS = [
+    'samplesheet', 'status', 'error', 'sample_1', 'sample_2', 'index_1',
+    'index_2', 'distance', 'distance_2']
+
+
+def find_samplesheets(paths, pattern):
+    """
+    Yield ``(path, member)`` for each sample sheet in ``paths``, which may
+    be sample sheets, directories, zip archives or globs of any of them.
+    ``member`` is the sample sheet's name within a zip archive, or None.
+    """
+    def matches(name):
+        return fnmatch.fnmatch(os.path.basename(name).lower(), pattern.lower())
+
+    for path in paths:
+        matched = sorted(glob.glob(path, recursive=True)) or [path]
+        for path in matched:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if matches(name):
+                            yield (os.path.join(root, name), None)
+            elif zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as archive:
+                    for member in archive.namelist():
+                        if not member.endswith('/') and matches(member):
+                            yield (path, member)
+            elif os.path.isfile(path):
+                yield (path, None)
+            else:
+                raise CommandError('No such file or directory: {}'.format(path))
+
+
+def samplesheet_name(source):
+    path, member = source
+    return path if member is None else '{}:{}'.format(path, member)
+
+
+def read_samplesheet(source):
+    path, member = source
+    if member is None:
+        with open(path, 'rb') as file:
+            return index_list_from_samplesheet(files={'samplesheet_1': file})
+    with zipfile.ZipFile(path) as archive, archive.open(member) as file:
+        return index_list_from_samplesheet(files={'samplesheet_1': file})
+
+
+def compared_length(indexes, length, name='index'):
+    """
+    Return the length ``indexes`` are compared at: ``length``, or the
+    shortest index if ``length`` is ``None``.
+    """
+    shortest = minimum_index_length_from_lists(indexes)
+    if length is None:
+        return shortest
+    if length > shortest:
+        raise ValueError(
+            'Cannot compare {} sequences over {} bases: the shortest has '
+            '{}.'.format(name, length, shortest))
+    return length
+
+
+def validate_samplesheet(source, distance=3, distance_2=None, length=None,
+                         length_2=None, rule='both'):
+    """
+    Check the indexes of a sample sheet the same way custom mode does and
+    return a report of its incompatible samples.
+    """
+    report = {
+        'samplesheet': samplesheet_name(source),
+        'status': 'error',
+        'error': None,
+    }
+
+    try:
+        samplesheet = read_samplesheet(source)
+    except (IndexError, OSError, UnicodeDecodeError, ValueError,
+            zipfile.BadZipFile) as e:
+        report['error'] = str(e) or e.__class__.__name__
+        return report
+
+    indexes = [index.replace(' ', '').upper() for index in samplesheet]
+    sample_ids = list(samplesheet.values())
+    if not indexes:
+        report['error'] = 'No samples found.'
+        return report
+    if any(re.search('[^ACGT,]', index) for index in indexes):
+        report['error'] = 'Indexes must be composed of valid bases (e.g., ACGT).'
+        return report
+    if len({index.count(',') for index in indexes}) > 1:
+        report['error'] = 'Indexes are a mix of single-indexing and dual-indexing.'
+        return report
+
+    dual_indexed = ',' in indexes[0]
+    conflicts = []
+    if dual_indexed:
+        indexes, indexes_2 = zip(*[index.split(',') for index in indexes])
+        try:
+            length = compared_length(indexes, length)
+            length_2 = compared_length(indexes_2, length_2, 'index 2')
+        except ValueError as e:
+            report['error'] = str(e)
+            return report
+        for pair in find_incompatible_dual_index_pairs(
+                indexes, indexes_2, min_distance=distance,
+                min_distance_2=distance_2, index_length=length,
+                index_length_2=length_2, rule=rule):
+            i, j = pair['positions']
+            conflicts.append({
+                'samples': [sample_ids[i], sample_ids[j]],
+                'indexes': [
+                    ','.join([pair['pair'][0], pair['pair_2'][0]]),
+                    ','.join([pair['pair'][1], pair['pair_2'][1]])],
+                'distance': pair['distances'][0],
+                'distance_2': pair['distances'][1],
+            })
+    else:
+        try:
+            length = compared_length(indexes, length)
+        except ValueError as e:
+            report['error'] = str(e)
+            return report
+        for i, j in find_incompatible_index_pairs(
+                indexes, min_distance=distance, index_length=length,
+                sequences=False, positions=True):
+            conflicts.append({
+                'samples': [sample_ids[i], sample_ids[j]],
+                'indexes': [indexes[i], indexes[j]],
+                'distance': hamming_distance(
+                    indexes[i][:length], indexes[j][:length]),
+            })
+
+    report.update({
+        'status': 'incompatible' if conflicts else 'compatible',
+        'samples': len(indexes),
+        'dual_indexed': dual_indexed,
+        'length': length,
+        'conflicts': conflicts,
+    })
+    if dual_indexed:
+        report['length_2'] = length_2
+    return report
+
+
+def csv_rows(report):
+    row = {field: report.get(field) for field in CSV_FIELDS}
+    if not report.get('conflicts'):
+        yield row
+        return
+    for conflict in report['conflicts']:
+        row = dict(row)
+        row['sample_1'], row['sample_2'] = conflict['samples']
+        row['index_1'], row['index_2'] = conflict['indexes']
+        row['distance'] = conflict['distance']
+        row['distance_2'] = conflict.get('distance_2')
+        yield row
+
+
+class Command(BaseCommand):
+    help = ('Check sample sheets for incompatible indexes and report the '
+            'conflicts in each one as JSON lines or CSV.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            help='Sample sheets, directories, zip archives or globs of them.',
+            nargs='+',
+        )
+        parser.add_argument(
+            '--pattern',
+            default='SampleSheet*.csv',
+            help='Names of sample sheets to check within directories and '
+                 'zip archives (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--distance',
+            default=3,
+            help='Minimum Hamming distance (default: %(default)s).',
+            type=int,
+        )
+        parser.add_argument(
+            '--distance-2',
+            help='Minimum Hamming distance for index 2 (default: --distance).',
+            type=int,
+        )
+        parser.add_argument(
+            '--length',
+            help='Index length to compare (default: the shortest index).',
+            type=int,
+        )
+        parser.add_argument(
+            '--length-2',
+            help='Index 2 length to compare (default: the shortest index 2).',
+            type=int,
+        )
+        parser.add_argument(
+            '--rule',
+            choices=[rule for rule, _ in DUAL_INDEX_RULE_CHOICES],
+            default='both',
+            help='How dual-indexed distances are combined '
+                 '(default: %(default)s).',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'csv'],
+            default='jsonl',
+            help='Report format (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the report to this file instead of standard output.',
+        )
+        parser.add_argument(
+            '--processes',
+            help='Number of processes to check sample sheets with '
+                 '(default: one per CPU).',
+            type=int,
+        )
+
+    def write_reports(self, output, reports, report_format):
+        """Write each report to ``output`` and count them by status."""
+        if report_format == 'csv':
+            writer = csv.DictWriter(output, CSV_FIELDS)
+            writer.writeheader()
+
+        counts = {'compatible': 0, 'incompatible': 0, 'error': 0}
+        for report in reports:
+            counts[report['status']] += 1
+            if report_format == 'csv':
+                writer.writerows(csv_rows(report))
+            else:
+                output.write(json.dumps(report) + '\n')
+        return counts
+
+    def handle(self, *args, **options):
+        for option in ['length', 'length_2']:
+            if options[option] is not None and options[option] < 1:
+                raise CommandError('--{} must be at least 1.'.format(
+                    option.replace('_', '-')))
+
+        sources = list(find_samplesheets(options['paths'], options['pattern']))
+        validate = functools.partial(
+            validate_samplesheet, distance=options['distance'],
+            distance_2=options['distance_2'], length=options['length'],
+            length_2=options['length_2'], rule=options['rule'])
+
+        executor = None
+        if options['processes'] == 1:
+            reports = map(validate, sources)
+        else:
+            executor = ProcessPoolExecutor(options['processes'])
+            reports = executor.map(validate, sources, chunksize=16)
+
+        try:
+            if options['output']:
+                with open(options['output'], 'w', newline='') as output:
+                    counts = self.write_reports(
+                        output, reports, options['format'])
+            else:
+                counts = self.write_reports(
+                    self.stdout, reports, options['format'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stderr.write(
+            'Checked {} sample sheet(s): {} compatible, {} incompatible, '
+            '{} not checked.'.format(
+                len(sources), counts['compatible'], counts['incompatible'],
+                counts['error']))
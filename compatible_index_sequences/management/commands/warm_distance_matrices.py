@@ -0,0 +1,33 @@
+import itertools
+
+from django.core.management.base import BaseCommand
+
+from compatible_index_sequences.models import (
+    INDEX_TYPE_CHOICES, Index, IndexSet, IndexSetDistanceMatrix)
+
+
+class Command(BaseCommand):
+    help = ('Precompute Hamming distance matrices for each index set and '
+            'each pair of index sets of the same type.')
+
+    def handle(self, *args, **options):
+        catalog_lengths = sorted(set(
+            len(sequence)
+            for sequence in Index.objects.values_list('sequence', flat=True)))
+
+        count = 0
+        for index_type, _ in INDEX_TYPE_CHOICES:
+            index_sets = IndexSet.objects.filter(
+                index_type=index_type, index_count__gt=0)
+            pairs = itertools.combinations_with_replacement(index_sets, 2)
+            for index_set_1, index_set_2 in pairs:
+                max_length = min(
+                    index_set_1.min_length(), index_set_2.min_length())
+                for length in catalog_lengths:
+                    if length > max_length:
+                        break
+                    IndexSetDistanceMatrix.objects.get_distances(
+                        index_set_1, index_set_2, length)
+                    count += 1
+
+        self.stdout.write('Stored {} distance matrices.'.format(count))
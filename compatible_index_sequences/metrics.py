@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger('compatible_index_sequences')
+
+# Clients allowed to read the metrics endpoint
+METRICS_ALLOWED_IPS = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_METRICS_ALLOWED_IPS',
+    ['127.0.0.1', '::1'])
+
+METRICS_PREFIX = 'compatible_index_sequences_'
+
+# Upper bounds (in seconds) of the histogram buckets
+HISTOGRAM_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Outcomes logged as warnings rather than information
+WARNING_OUTCOMES = ['invalid', 'not_found', 'partial', 'timed_out']
+
+METRICS = OrderedDict([
+    ('requests_total', (
+        'counter', 'Requests handled, by mode and outcome.')),
+    ('request_seconds', (
+        'histogram', 'Time spent handling requests, by mode and outcome.')),
+    ('phase_seconds', (
+        'histogram', 'Time spent in each phase of handling requests.')),
+    ('search_seconds', (
+        'histogram', 'Time spent searching for compatible subsets.')),
+    ('search_nodes_explored_total', (
+        'counter', 'Partial subsets explored by searches.')),
+    ('search_nodes_pruned_total', (
+        'counter', 'Partial subsets pruned by searches.')),
+    ('search_timeouts_total', (
+        'counter', 'Searches that ran out of time.')),
+    ('search_cache_requests_total', (
+        'counter', 'Search result cache lookups, by result.')),
+])
+
+
+class MetricsRegistry(object):
+    """
+    Counters and histograms of this process, by metric name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount, labels):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(HISTOGRAM_BUCKETS), 0, 0]
+            buckets, _, _ = histogram = self.histograms[key]
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: [list(buckets), total, count]
+                for key, (buckets, total, count) in self.histograms.items()}
+        return counters, histograms
+
+
+registry = MetricsRegistry()
+
+
+class PhaseTimer(object):
+    """
+    Time the phases of handling a request in ``mode`` (e.g., ``'auto'``),
+    recording each phase as it ends and the whole request when finished.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.start = time.perf_counter()
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0) + elapsed
+            observe('phase_seconds', elapsed, mode=self.mode, phase=name)
+
+    def finish(self, outcome, level=None, **details):
+        """
+        Record the request and log its outcome, phase timings and
+        ``details`` of its input.
+        """
+        if level is None:
+            level = (logging.WARNING if outcome in WARNING_OUTCOMES
+                     else logging.INFO)
+        elapsed = time.perf_counter() - self.start
+        increment('requests_total', mode=self.mode, outcome=outcome)
+        observe('request_seconds', elapsed, mode=self.mode, outcome=outcome)
+
+        fields = ['total={:.3f}s'.format(elapsed)]
+        fields.extend(
+            '{}={:.3f}s'.format(name, seconds)
+            for name, seconds in self.timings.items())
+        fields.extend(
+            '{}={}'.format(name, value) for name, value in details.items())
+        logger.log(
+            level, '%s %s: %s', self.mode, outcome, ' '.join(fields),
+            extra={'metrics': {
+                'mode': self.mode,
+                'outcome': outcome,
+                'seconds': elapsed,
+                'phases': dict(self.timings),
+                'details': details,
+            }})
+
+
+def escape_label(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, escape_label(value))
+        for name, value in labels))
+
+
+def increment(name, amount=1, **labels):
+    registry.increment(name, amount, tuple(sorted(labels.items())))
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, tuple(sorted(labels.items())))
+
+
+def record_search(search, mode, seconds):
+    """
+    Record the work done by a ``CompatibleSubsetSearch`` that has run.
+    """
+    observe('search_seconds', seconds, mode=mode)
+    increment('search_nodes_explored_total', search.nodes_explored, mode=mode)
+    increment('search_nodes_pruned_total', search.nodes_pruned, mode=mode)
+    if search.timed_out:
+        increment('search_timeouts_total', mode=mode)
+
+
+def render_metrics():
+    """
+    Return the metrics of this process in the Prometheus text format.
+    """
+    counters, histograms = registry.snapshot()
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        full_name = METRICS_PREFIX + name
+        lines.append('# HELP {} {}'.format(full_name, description))
+        lines.append('# TYPE {} {}'.format(full_name, metric_type))
+        if metric_type == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(
+                        full_name, format_labels(labels), value))
+        else:
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                buckets, total, count = histogram
+                for bound, bucket in zip(HISTOGRAM_BUCKETS, buckets):
+                    lines.append('{}_bucket{} {}'.format(
+                        full_name, format_labels(labels, le=bound), bucket))
+                lines.append('{}_bucket{} {}'.format(
+                    full_name, format_labels(labels, le='+Inf'), count))
+                lines.append('{}_sum{} {}'.format(
+                    full_name, format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(
+                    full_name, format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def search_outcome(result, timed_out, incomplete=False):
+    if not result:
+        return 'timed_out' if timed_out else 'not_found'
+    return 'partial' if incomplete else 'found'
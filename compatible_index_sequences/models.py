@@ -1,10 +1,16 @@
-import itertools
+import json
 import re
+import uuid
 
+import numpy as np
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import IntegrityError, models
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Length
 
-from .utils import hamming_distance, reverse_complement
+from .utils import (
+    hamming_distance_matrix, minimum_distances_by_length,
+    minimum_index_length_from_lists, reverse_complement)
 
 
 INDEX_TYPE_CHOICES = [
@@ -12,6 +18,13 @@ INDEX_TYPE_CHOICES = [
     ('i5', 'Index 2 (i5)'),
 ]
 
+SEARCH_JOB_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
 
 class IndexSetManager(models.Manager):
 
@@ -19,6 +32,94 @@ class IndexSetManager(models.Manager):
         """For importing data via fixtures without specifying primary key"""
         return self.get(name=name)
 
+    def update_statistics(self, index_set, self_distances=False):
+        """
+        Store the number of indexes in ``index_set`` (an index set or its
+        primary key) and their shortest and longest lengths. Its table of
+        self distances is recomputed too if ``self_distances`` is set, and
+        otherwise left to be recomputed when next read.
+        """
+        pk = getattr(index_set, 'pk', index_set)
+        statistics = Index.objects.filter(index_set=pk).aggregate(
+            index_count=Count('pk'),
+            min_index_length=Min(Length('sequence')),
+            max_index_length=Max(Length('sequence')),
+        )
+        if self_distances:
+            sequences = list(Index.objects.filter(
+                index_set=pk).values_list('sequence', flat=True))
+            statistics['self_distances'] = json.dumps(
+                minimum_distances_by_length(sequences))
+        else:
+            statistics['self_distances'] = None
+        self.filter(pk=pk).update(**statistics)
+        return statistics
+
+
+class IndexSetDistanceMatrixManager(models.Manager):
+
+    def get_distances(self, index_set_1, index_set_2, length=None):
+        """
+        Return the indexes of both sets and the matrix of Hamming distances
+        between them at ``length`` (or the pair's shortest index length),
+        computing and storing the matrix if it is missing or out of date.
+        """
+        swapped = index_set_1.pk > index_set_2.pk
+        if swapped:
+            index_set_1, index_set_2 = index_set_2, index_set_1
+
+        indexes_1 = list(index_set_1.index_set.all())
+        if index_set_1.pk == index_set_2.pk:
+            indexes_2 = indexes_1
+        else:
+            indexes_2 = list(index_set_2.index_set.all())
+
+        sequences_1 = [i.sequence for i in indexes_1]
+        sequences_2 = [i.sequence for i in indexes_2]
+        index_length = minimum_index_length_from_lists(
+            sequences_1, sequences_2)
+        if length is not None:
+            index_length = min(index_length, length)
+
+        if index_length == float('inf'):
+            distances = np.zeros(
+                (len(indexes_1), len(indexes_2)), dtype=np.uint8)
+        else:
+            index_length = int(index_length)
+            index_ids_1 = ','.join(str(i.pk) for i in indexes_1)
+            index_ids_2 = ','.join(str(i.pk) for i in indexes_2)
+
+            matrix = self.filter(
+                index_set_1=index_set_1, index_set_2=index_set_2,
+                length=index_length).first()
+            if (matrix is not None and matrix.index_ids_1 == index_ids_1
+                    and matrix.index_ids_2 == index_ids_2):
+                distances = matrix.get_distances()
+            else:
+                distances = hamming_distance_matrix(
+                    sequences_1, sequences_2, length=index_length).astype(
+                        np.uint8)
+                try:
+                    self.update_or_create(
+                        index_set_1=index_set_1, index_set_2=index_set_2,
+                        length=index_length, defaults={
+                            'index_ids_1': index_ids_1,
+                            'index_ids_2': index_ids_2,
+                            'distances': distances.tobytes(),
+                        })
+                except IntegrityError:
+                    # Stored concurrently by another process
+                    pass
+
+        if swapped:
+            return indexes_2, indexes_1, distances.T
+        return indexes_1, indexes_2, distances
+
+    def invalidate(self, index_set):
+        return self.filter(
+            models.Q(index_set_1=index_set) |
+            models.Q(index_set_2=index_set)).delete()
+
 
 class Index(models.Model):
 
@@ -30,6 +131,7 @@ class Index(models.Model):
     )
 
     sequence = models.CharField(
+        db_index=True,
         help_text='Enter the index sequence.',
         max_length=255,
         validators=[
@@ -40,6 +142,14 @@ class Index(models.Model):
         ],
     )
 
+    # Stored so that indexes can be looked up in either i5 orientation
+    reverse_complement = models.CharField(
+        blank=True,
+        db_index=True,
+        editable=False,
+        max_length=255,
+    )
+
     class Meta:
         ordering = ['index_set', 'name']
         unique_together = ['index_set', 'name']
@@ -53,9 +163,10 @@ class Index(models.Model):
     def index_type(self):
         return self.index_set.index_type
 
-    @property
-    def reverse_complement(self):
-        return reverse_complement(self.sequence)
+    def normalize_sequence(self):
+        """Store the sequence in upper case, with its reverse complement."""
+        self.sequence = self.sequence.upper()
+        self.reverse_complement = reverse_complement(self.sequence)
 
 
 class IndexSet(models.Model):
@@ -89,24 +200,223 @@ class IndexSet(models.Model):
         help_text='Make visible by default in interactive mode.',
     )
 
+    last_modified = models.DateTimeField(
+        auto_now=True,
+        null=True,
+    )
+
+    # Statistics of the set's indexes, kept current by signals (see
+    # IndexSetManager.update_statistics)
+    index_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+    )
+
+    min_index_length = models.PositiveIntegerField(
+        blank=True,
+        editable=False,
+        null=True,
+    )
+
+    max_index_length = models.PositiveIntegerField(
+        blank=True,
+        editable=False,
+        null=True,
+    )
+
+    # JSON list of the minimum Hamming distance between any two indexes over
+    # their first 1, 2, ... bases; null when out of date
+    self_distances = models.TextField(
+        blank=True,
+        default='[]',
+        editable=False,
+        null=True,
+    )
+
     class Meta:
         ordering = ['name']
         verbose_name = 'Sequencing Index Set'
         verbose_name_plural = 'Sequencing Index Sets'
 
+    def get_self_distances(self):
+        """
+        Return the stored table of self distances, recomputing it first if
+        the set has changed since it was last computed.
+        """
+        if self.self_distances is None:
+            sequences = list(self.index_set.values_list('sequence', flat=True))
+            self.self_distances = json.dumps(
+                minimum_distances_by_length(sequences))
+            # Unless the set has changed again in the meantime
+            IndexSet.objects.filter(
+                pk=self.pk, last_modified=self.last_modified).update(
+                    self_distances=self.self_distances)
+        return json.loads(self.self_distances)
+
     def min_length(self):
-        index_list = [i.sequence for i in self.index_set.all()]
-        return min([len(i) for i in index_list])
+        if self.min_index_length is None:
+            # Statistics are missing if the set was stored before they were
+            # maintained, so recompute them before giving up
+            statistics = IndexSet.objects.update_statistics(self)
+            self.index_count = statistics['index_count']
+            self.min_index_length = statistics['min_index_length']
+            self.max_index_length = statistics['max_index_length']
+        if self.min_index_length is None:
+            raise ValueError('{} has no indexes.'.format(self))
+        return self.min_index_length
+
+    def paired_index_names(self, index_set_2):
+        """
+        Return the names of the indexes that this set and ``index_set_2``
+        share, which pair them as unique dual indexes.
+        """
+        names = set(self.index_set.values_list('name', flat=True))
+        return sorted(names.intersection(
+            index_set_2.index_set.values_list('name', flat=True)))
+
+    def self_min_distance(self, length=float('inf')):
+        """
+        Return the minimum Hamming distance between any two of the set's
+        indexes over their first ``length`` bases, or None if it has fewer
+        than two indexes.
+        """
+        if self.index_count < 2:
+            return None
+        self_distances = self.get_self_distances()
+        length = min(length, len(self_distances))
+        if length < 1:
+            return 0
+        return self_distances[int(length) - 1]
 
     def is_self_compatible(self, min_distance=3, length=float('inf')):
-        index_length = min(self.min_length(), length)
-        index_list = [i.sequence for i in self.index_set.all()]
-        for pair in itertools.combinations(index_list, 2):
-            distance = hamming_distance(
-                pair[0][0:index_length].upper(), pair[1][0:index_length].upper())
-            if distance < min_distance:
-                return False
-        return True
+        distance = self.self_min_distance(length)
+        return distance is None or distance >= min_distance
 
     def __str__(self):
         return self.name
+
+
+class IndexSetDistanceMatrix(models.Model):
+    """
+    Hamming distances between every index of one index set and every index
+    of another (or the same) set, with both truncated to ``length``.
+    """
+
+    objects = IndexSetDistanceMatrixManager()
+
+    index_set_1 = models.ForeignKey(
+        'IndexSet', on_delete=models.CASCADE, related_name='+')
+
+    index_set_2 = models.ForeignKey(
+        'IndexSet', on_delete=models.CASCADE, related_name='+')
+
+    length = models.PositiveSmallIntegerField()
+
+    index_ids_1 = models.TextField(
+        help_text='Comma-separated primary keys of the indexes in each row.',
+    )
+
+    index_ids_2 = models.TextField(
+        help_text='Comma-separated primary keys of the indexes in each column.',
+    )
+
+    distances = models.BinaryField()
+
+    class Meta:
+        unique_together = ['index_set_1', 'index_set_2', 'length']
+        verbose_name = 'Index Set Distance Matrix'
+        verbose_name_plural = 'Index Set Distance Matrices'
+
+    def __str__(self):
+        return '{} vs {} ({}-mers)'.format(
+            self.index_set_1, self.index_set_2, self.length)
+
+    def get_distances(self):
+        rows = len(self.index_ids_1.split(',')) if self.index_ids_1 else 0
+        columns = len(self.index_ids_2.split(',')) if self.index_ids_2 else 0
+        return np.frombuffer(
+            bytes(self.distances), dtype=np.uint8).reshape(rows, columns)
+
+
+class SearchJob(models.Model):
+
+    id = models.UUIDField(
+        default=uuid.uuid4,
+        editable=False,
+        primary_key=True,
+    )
+
+    status = models.CharField(
+        choices=SEARCH_JOB_STATUS_CHOICES,
+        db_index=True,
+        default='pending',
+        max_length=10,
+    )
+
+    parameters = models.TextField(
+        help_text='JSON-encoded search parameters.',
+    )
+
+    result = models.TextField(
+        blank=True,
+        help_text='JSON-encoded list of compatible index sequences.',
+    )
+
+    best_partial = models.TextField(
+        blank=True,
+        help_text='JSON-encoded largest compatible partial result so far.',
+    )
+
+    target_size = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of indexes searched for or, when searching for the '
+                  'largest compatible subset, the most it can have.',
+    )
+
+    nodes_explored = models.BigIntegerField(default=0)
+
+    timed_out = models.BooleanField(default=False)
+
+    incomplete = models.BooleanField(
+        default=False,
+        help_text='The search timed out and the result is only partial.',
+    )
+
+    missing = models.TextField(
+        blank=True,
+        help_text='JSON-encoded number of indexes missing from each set.',
+    )
+
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    started = models.DateTimeField(blank=True, null=True)
+
+    finished = models.DateTimeField(blank=True, null=True)
+
+    estimated_finish = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created']
+        verbose_name = 'Auto Mode Search Job'
+        verbose_name_plural = 'Auto Mode Search Jobs'
+
+    def __str__(self):
+        return '{} ({})'.format(self.id, self.status)
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def get_parameters(self):
+        return json.loads(self.parameters)
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else []
+
+    def get_best_partial(self):
+        return json.loads(self.best_partial) if self.best_partial else []
+
+    def get_missing(self):
+        return json.loads(self.missing) if self.missing else []
@@ -0,0 +1,1395 @@
+import hashlib
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .catalog import catalog_version
+from .metrics import PhaseTimer, increment, record_search
+from .models import IndexSet, IndexSetDistanceMatrix
+from .utils import (
+    channel_matrix, encode_index_list, hamming_distance_matrix, is_timed_out,
+    minimum_index_length_from_sets)
+
+
+# Number of processes used to search for compatible subsets (serial if None)
+SEARCH_PROCESSES = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_SEARCH_PROCESSES', None)
+
+# Cache alias and lifetime (in seconds) of stored search results
+SEARCH_CACHE = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_SEARCH_CACHE', 'default')
+SEARCH_CACHE_TIMEOUT = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_SEARCH_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Search used by each worker process of a parallel search
+branch_worker_search = None
+
+
+def bitmask(flags):
+    """Convert a boolean array into an integer with bit ``i`` set for ``flags[i]``."""
+    packed = np.packbits(np.asarray(flags, dtype=bool), bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+def count_bits(mask):
+    return bin(mask).count('1')
+
+
+class ColorBalance(object):
+    """
+    Per-cycle base counts of a pool of indexes and some of the candidates
+    for it, kept current in O(length) as candidates are added and removed.
+
+    The pool's balance is the number of indexes giving a signal in its
+    weakest channel (see ``COLOR_CHANNELS``) at any cycle.
+    """
+
+    def __init__(self, candidates, length, chemistry, pool=()):
+        bases = np.eye(4, dtype=np.int64)
+        self.channels = channel_matrix(chemistry)
+        self.bases = bases[
+            encode_index_list(candidates, length).astype(np.intp)]
+        self.pool_counts = np.zeros((length, 4), dtype=np.int64)
+        if len(pool) > 0:
+            self.pool_counts += bases[encode_index_list(
+                list(pool), length).astype(np.intp)].sum(axis=0)
+        self.counts = self.pool_counts.copy()
+
+        # Candidates with each base at each cycle
+        self.base_masks = [
+            [bitmask(self.bases[:, cycle, base]) for base in range(4)]
+            for cycle in range(length)]
+        # The channels each base gives a signal in; bases with the most
+        # channels come first
+        self.base_channels = [
+            (base, np.flatnonzero(self.channels[base]).tolist())
+            for base in range(4) if self.channels[base].any()]
+        self.base_channels.sort(key=lambda item: -len(item[1]))
+
+        # Candidates grouped by the signal they give in each channel, and in
+        # all channels together, summed over every cycle
+        weights = (self.bases @ self.channels).sum(axis=1)
+        weights = np.column_stack([weights, weights.sum(axis=1)])
+        self.weight_masks = [
+            [(int(weight), bitmask(column == weight))
+             for weight in sorted(set(column.tolist()), reverse=True)
+             if weight > 0]
+            for column in weights.T]
+
+    def reset(self):
+        self.counts = self.pool_counts.copy()
+
+    def add(self, candidate):
+        self.counts += self.bases[candidate]
+
+    def remove(self, candidate):
+        self.counts -= self.bases[candidate]
+
+    def signal(self):
+        return self.counts @ self.channels
+
+    def balance(self):
+        signal = self.signal()
+        return int(signal.min()) if signal.size else 0
+
+    def picks_needed(self, signal, available, cycle, target):
+        """
+        Return the fewest candidates from ``available`` that bring every
+        channel of ``signal`` (the signal at ``cycle``) up to ``target``, or
+        None if they cannot.
+
+        Bases are used in order of how many channels they give a signal in,
+        which needs the fewest picks when each base's channels either
+        include or exclude those of every base after it, as they do for
+        every chemistry in ``COLOR_CHANNELS``.
+        """
+        deficits = [max(0, target - int(s)) for s in signal]
+        picks = 0
+        for base, channels in self.base_channels:
+            wanted = max(deficits[channel] for channel in channels)
+            if wanted:
+                used = min(wanted, count_bits(
+                    available & self.base_masks[cycle][base]))
+                picks += used
+                for channel in channels:
+                    deficits[channel] = max(0, deficits[channel] - used)
+        return None if any(deficits) else picks
+
+    def most_signal(self, available, picks, weight_masks):
+        """
+        Return the most signal summed over every cycle that ``picks``
+        candidates from ``available`` can give, taking the strongest first.
+        """
+        total = 0
+        for weight, mask in weight_masks:
+            if picks == 0:
+                break
+            used = min(picks, count_bits(available & mask))
+            total += weight * used
+            picks -= used
+        return total
+
+    def bound(self, available, picks):
+        """
+        Upper bound on the balance once ``picks`` more candidates are added
+        from ``available``.
+        """
+        signal = self.signal()
+        if not signal.size:
+            return 0
+        balance = int(signal.min())
+        while self.can_exceed(available, picks, balance):
+            balance += 1
+        return balance
+
+    def can_exceed(self, available, picks, threshold):
+        """
+        Check whether adding ``picks`` more candidates from ``available``
+        could bring the balance above ``threshold``: whether that many
+        candidates could make up what each channel, and all of them
+        together, lack over every cycle, and whether at each cycle on its
+        own they could bring every channel above it.
+        """
+        signal = self.signal()
+        if not signal.size:
+            return threshold < 0
+        if (signal + picks).min() <= threshold:
+            return False
+        deficits = np.maximum(threshold + 1 - signal, 0).sum(axis=0)
+        deficits = np.append(deficits, deficits.sum())
+        for deficit, weight_masks in zip(deficits, self.weight_masks):
+            if deficit > self.most_signal(available, picks, weight_masks):
+                return False
+        for cycle in np.flatnonzero((signal <= threshold).any(axis=1)):
+            needed = self.picks_needed(
+                signal[cycle], available, cycle, threshold + 1)
+            if needed is None or needed > picks:
+                return False
+        return True
+
+
+class CompatibleSubsetSearch(object):
+    """
+    Branch-and-bound search for a compatible subset of indexes drawn from
+    several index sets.
+
+    Every candidate sequence is a node in an incompatibility graph whose
+    edges join sequences closer than ``min_distance``. Indexes are added one
+    at a time and a branch is abandoned as soon as any set can no longer
+    supply the number of compatible indexes still required from it.
+
+    Sets are filled most-constrained-first (least spare candidates), and
+    within a set the candidates with the fewest conflicts are tried first.
+    Indexes within a set are always chosen in increasing candidate order and
+    sets are filled one after another, so each subset is visited only once.
+
+    With ``color_balance`` (a chemistry from ``COLOR_CHANNELS`` and a mode
+    from ``COLOR_BALANCE_MODE_CHOICES``), the base counts of the previous
+    list and chosen indexes are updated with every pick, and a branch is
+    also abandoned once the candidates left cannot give every channel a
+    signal at every cycle (``'enforce'``) or beat the balance of the best
+    subset found so far (``'optimize'``). Optimizing searches go on after
+    the first subset until none can be better balanced or time runs out.
+    """
+
+    check_interval = 1000
+
+    def __init__(self, candidate_lists, subset_size_list, min_length,
+                 min_distance=3, previous_list=(), timeout=10,
+                 start_time=None, progress_callback=None, distances=None,
+                 color_balance=None):
+        self.min_distance = min_distance
+        self.timeout = timeout
+        self.start_time = time.time() if start_time is None else start_time
+        self.progress_callback = progress_callback
+
+        self.stop_event = None
+
+        self.timed_out = False
+        self.infeasible = False
+        self.incomplete = False
+        self.missing = []
+        self.nodes_explored = 0
+        self.nodes_pruned = 0
+        self.branches_searched = 0
+        self.best = []
+
+        self.subset_size_list = list(subset_size_list)
+
+        # Precomputed distances must cover the candidates in list order
+        sequences = [s for c in candidate_lists for s in c]
+        set_ids = [i for i, c in enumerate(candidate_lists) for _ in c]
+        if distances is None:
+            distances = hamming_distance_matrix(sequences, length=min_length)
+
+        # Drop candidates that are incompatible with the previous list
+        kept = np.ones(len(sequences), dtype=bool)
+        if len(sequences) > 0 and len(previous_list) > 0:
+            kept = hamming_distance_matrix(
+                sequences, list(previous_list), length=min_length).min(
+                    axis=1) >= min_distance
+        kept = np.nonzero(kept)[0]
+
+        self.sequences = [sequences[c] for c in kept]
+        set_ids = [set_ids[c] for c in kept]
+        self.candidate_lists = [
+            [s for s, i in zip(self.sequences, set_ids) if i == set_id]
+            for set_id in range(len(candidate_lists))]
+
+        incompatible = distances[np.ix_(kept, kept)] < min_distance
+        np.fill_diagonal(incompatible, True)
+        self.conflicts = [bitmask(row) for row in incompatible]
+        self.all_candidates = (1 << len(self.sequences)) - 1
+        degrees = incompatible.sum(axis=1)
+
+        slack = [
+            len(c) - s
+            for c, s in zip(self.candidate_lists, self.subset_size_list)]
+        self.set_order = sorted(
+            range(len(self.candidate_lists)), key=lambda i: slack[i])
+
+        self.orders = []
+        self.suffix_masks = []
+        for set_id in self.set_order:
+            order = sorted(
+                (c for c in range(len(self.sequences))
+                    if set_ids[c] == set_id),
+                key=lambda c: (degrees[c], c))
+            suffix_masks = [0] * (len(order) + 1)
+            for position in reversed(range(len(order))):
+                suffix_masks[position] = (
+                    suffix_masks[position + 1] | (1 << order[position]))
+            self.orders.append(order)
+            self.suffix_masks.append(suffix_masks)
+
+        # Candidates of the sets filled after each one
+        self.later_masks = [0] * len(self.orders)
+        for k in reversed(range(len(self.orders) - 1)):
+            self.later_masks[k] = (
+                self.later_masks[k + 1] | self.suffix_masks[k + 1][0])
+
+        # Complete subsets must have a balance above the threshold
+        self.balance = None
+        self.balance_threshold = -1
+        self.balance_target = None
+        self.optimize_balance = False
+        self.balanced = None
+        if color_balance is not None:
+            self.balance = ColorBalance(
+                self.sequences, int(min_length), color_balance['chemistry'],
+                pool=previous_list)
+            self.optimize_balance = color_balance['mode'] == 'optimize'
+            if not self.optimize_balance:
+                self.balance_threshold = 0
+
+        # Which ordered set each pick belongs to and how many picks remain
+        # in that set once it is made
+        self.slots = [
+            (k, self.subset_size_list[set_id] - n - 1)
+            for k, set_id in enumerate(self.set_order)
+            for n in range(self.subset_size_list[set_id])]
+
+    def clique_cover_bound(self, available):
+        """
+        Upper bound on the number of mutually compatible candidates in
+        ``available``, from a greedy partition into groups of mutually
+        incompatible candidates (at most one from each group can be used).
+        """
+        bound = 0
+        while available:
+            candidate = available.bit_length() - 1
+            group = available & self.conflicts[candidate]
+            members = 1 << candidate
+            group &= ~members
+            while group:
+                member = group.bit_length() - 1
+                members |= 1 << member
+                group &= self.conflicts[member] & ~(1 << member)
+            available &= ~members
+            bound += 1
+        return bound
+
+    def is_feasible(self, available, k, position, remaining):
+        """Check whether every unfilled set can still be completed."""
+        if count_bits(
+                available & self.suffix_masks[k][position]) < remaining:
+            return False
+        for j in range(k + 1, len(self.orders)):
+            needed = self.subset_size_list[self.set_order[j]]
+            if count_bits(available & self.suffix_masks[j][0]) < needed:
+                return False
+        return True
+
+    def is_balance_feasible(self, available, k, position, picks):
+        """
+        Check whether ``picks`` more candidates from ``available`` could
+        give the subset a balance above the threshold.
+        """
+        if self.balance is None:
+            return True
+        future = available & (
+            self.suffix_masks[k][position] | self.later_masks[k])
+        return self.balance.can_exceed(future, picks, self.balance_threshold)
+
+    def record_complete(self, chosen):
+        """
+        Record a complete subset, returning whether the search can stop
+        rather than look for one with a better color balance.
+        """
+        if not self.optimize_balance:
+            return True
+        self.balanced = list(chosen)
+        self.balance_threshold = self.balance.balance()
+        return self.balance_threshold >= self.balance_target
+
+    def unchoose(self, chosen):
+        candidate = chosen.pop()
+        if self.balance is not None:
+            self.balance.remove(candidate)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['progress_callback'] = None
+        state['stop_event'] = None
+        return state
+
+    def is_root_feasible(self):
+        k, remaining = self.slots[0]
+        if not self.is_feasible(self.all_candidates, k, 0, remaining + 1):
+            return False
+        if self.clique_cover_bound(self.all_candidates) < len(self.slots):
+            return False
+        for j, set_id in enumerate(self.set_order):
+            needed = self.subset_size_list[set_id]
+            if self.clique_cover_bound(self.suffix_masks[j][0]) < needed:
+                return False
+        return True
+
+    def run(self, processes=None, deterministic=True, anytime=False):
+        """
+        Search for a compatible subset, returning ``[]`` if there is none.
+
+        With ``processes`` greater than one, the first picks are searched
+        in parallel by a pool of processes. In ``deterministic`` mode the
+        result is identical to a serial search; otherwise the first subset
+        found by any process is returned.
+
+        In ``anytime`` mode a search that times out returns the largest
+        compatible partial subset found instead of ``[]``, setting
+        ``incomplete`` and the number of indexes each set is ``missing``.
+        A search optimizing color balance that times out returns the best
+        balanced subset found, also setting ``incomplete``.
+        """
+        if not self.slots:
+            return []
+        if not self.is_root_feasible():
+            self.infeasible = True
+            return []
+        if self.balance is not None:
+            self.balance.reset()
+            self.balance_target = self.balance.bound(
+                self.all_candidates, len(self.slots))
+            if self.balance_target <= self.balance_threshold:
+                self.infeasible = True
+                return []
+
+        # Optimizing color balance compares subsets across first picks
+        if (processes is not None and processes > 1 and
+                not self.optimize_balance):
+            chosen = self.search_branches_in_parallel(processes, deterministic)
+        else:
+            chosen = self.search_branches()
+
+        if chosen:
+            # Running out of time leaves a better balanced subset possible
+            if self.optimize_balance and self.timed_out:
+                self.incomplete = True
+            return self.format_result(chosen)
+        if not self.timed_out:
+            self.infeasible = True
+        elif anytime and self.best:
+            self.incomplete = True
+            self.missing = self.missing_counts(self.best)
+            return self.format_result(self.best)
+        return []
+
+    def search_branches(self):
+        for position in range(len(self.orders[self.slots[0][0]])):
+            chosen = self.search_branch(position)
+            self.branches_searched += 1
+            if chosen or self.timed_out:
+                return chosen or self.balanced
+            self.report_progress()
+        return self.balanced
+
+    def search_branches_in_parallel(self, processes, deterministic=True):
+        positions = range(len(self.orders[self.slots[0][0]]))
+        stop_event = multiprocessing.Event()
+        chosen = None
+
+        with ProcessPoolExecutor(
+                processes, initializer=init_branch_worker,
+                initargs=(self, stop_event)) as executor:
+            futures = [
+                executor.submit(search_branch_in_worker, position)
+                for position in positions]
+            if not deterministic:
+                futures = as_completed(futures)
+
+            for future in futures:
+                branch = future.result()
+                self.branches_searched += 1
+                self.nodes_explored += branch['nodes_explored']
+                self.nodes_pruned += branch['nodes_pruned']
+                if len(branch['best']) > len(self.best):
+                    self.best = branch['best']
+
+                if branch['chosen']:
+                    chosen = branch['chosen']
+                    self.timed_out = False
+                    break
+                if branch['timed_out']:
+                    self.timed_out = True
+                    if deterministic:
+                        break
+                self.report_progress()
+
+            stop_event.set()
+
+        return chosen
+
+    def should_stop(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        if is_timed_out(self.start_time, timeout=self.timeout):
+            self.timed_out = True
+            return True
+        return False
+
+    def search_branch(self, first_position):
+        """
+        Search every subset whose first pick is the candidate at
+        ``first_position`` of the first set to be filled.
+        """
+        k, remaining = self.slots[0]
+        first = self.orders[k][first_position]
+        available = self.all_candidates & ~self.conflicts[first]
+        chosen = [first]
+        if not self.best:
+            self.best = list(chosen)
+        if self.balance is not None:
+            self.balance.reset()
+            self.balance.add(first)
+
+        if not (self.is_feasible(available, k, first_position + 1, remaining)
+                and self.is_balance_feasible(
+                    available, k, first_position + 1, len(self.slots) - 1)):
+            self.nodes_pruned += 1
+            return None
+        if len(self.slots) == 1:
+            return chosen if self.record_complete(chosen) else None
+
+        # Each frame holds the candidates available to a pick and the next
+        # position to try for it
+        stack = [[available, self.next_start(0, first_position)]]
+
+        while stack:
+            self.nodes_explored += 1
+            if self.nodes_explored % self.check_interval == 0:
+                if self.should_stop():
+                    return None
+                self.report_progress()
+
+            depth = len(stack)
+            k, remaining = self.slots[depth]
+            order = self.orders[k]
+            frame = stack[-1]
+            available, position = frame
+
+            while (position < len(order)
+                    and not (available >> order[position]) & 1):
+                position += 1
+
+            if position == len(order):
+                stack.pop()
+                self.unchoose(chosen)
+                continue
+
+            frame[1] = position + 1
+            candidate = order[position]
+            next_available = available & ~self.conflicts[candidate]
+
+            if not self.is_feasible(next_available, k, position + 1,
+                                    remaining):
+                self.nodes_pruned += 1
+                continue
+            if self.balance is not None:
+                self.balance.add(candidate)
+                if not self.is_balance_feasible(
+                        next_available, k, position + 1,
+                        len(self.slots) - depth - 1):
+                    self.balance.remove(candidate)
+                    self.nodes_pruned += 1
+                    continue
+
+            chosen.append(candidate)
+            if len(chosen) > len(self.best):
+                self.best = list(chosen)
+            if len(chosen) == len(self.slots):
+                if self.record_complete(chosen):
+                    return chosen
+                self.unchoose(chosen)
+                continue
+            stack.append(
+                [next_available, self.next_start(depth, position)])
+
+        return None
+
+    def estimated_time_remaining(self):
+        """
+        Extrapolate from the share of first picks already searched, capped
+        by the time left before the timeout.
+        """
+        elapsed = time.time() - self.start_time
+        time_left = max(0, self.timeout - elapsed)
+        if not self.slots or self.branches_searched == 0:
+            return time_left
+        fraction = self.branches_searched / len(self.orders[self.slots[0][0]])
+        return min(time_left, elapsed * (1 - fraction) / fraction)
+
+    def report_progress(self):
+        if self.progress_callback is not None:
+            self.progress_callback(self)
+
+    def missing_counts(self, chosen):
+        """Return how many indexes each set, in the original order, lacks."""
+        chosen = set(chosen)
+        missing = []
+        offset = 0
+        for candidates, subset_size in zip(self.candidate_lists,
+                                           self.subset_size_list):
+            found = sum(
+                1 for c in range(offset, offset + len(candidates))
+                if c in chosen)
+            missing.append(subset_size - found)
+            offset += len(candidates)
+        return missing
+
+    def next_start(self, depth, position):
+        """First candidate position for the pick after ``depth``."""
+        if self.slots[depth + 1][0] == self.slots[depth][0]:
+            return position + 1
+        return 0
+
+    def format_result(self, chosen):
+        """Return chosen sequences grouped in the original set order."""
+        chosen = set(chosen)
+        result = []
+        offset = 0
+        for candidates in self.candidate_lists:
+            for c, sequence in enumerate(candidates, start=offset):
+                if c in chosen:
+                    result.append(sequence)
+            offset += len(candidates)
+        return result
+
+
+class DualIndexSubsetSearch(object):
+    """
+    Depth-first search for a compatible subset of dual-indexed pairs drawn
+    from several groups, each an index 1 (i7) list and an index 2 (i5) list
+    that are either paired position by position or freely combined.
+
+    Pairs are compatible unless they are incompatible under ``rule`` (see
+    ``dual_index_incompatibility``). The search never enumerates pairs:
+    each pick chooses an i7 candidate first, which fixes how far every i5
+    candidate must be from the i5 of each pair already chosen, and only the
+    i5 candidates that remain are tried with it. An i7 candidate that leaves
+    none is pruned without looking at its pairs.
+
+    Within a group, pairs are picked in increasing (i7, i5) order, so each
+    subset is visited only once. When the rule makes pairs with close i7s
+    or close i5s incompatible (``'either'``), every pick also needs an i7
+    and an i5 far from all others, and a branch is abandoned as soon as
+    either read can no longer supply enough of them for any group.
+    """
+
+    check_interval = 1000
+
+    def __init__(self, groups, subset_size_list, min_length, min_length_2,
+                 min_distance=3, min_distance_2=3, rule='both',
+                 previous_list=(), timeout=10, start_time=None,
+                 progress_callback=None, distances=None, distances_2=None):
+        self.timeout = timeout
+        self.start_time = time.time() if start_time is None else start_time
+        self.progress_callback = progress_callback
+
+        self.timed_out = False
+        self.infeasible = False
+        self.incomplete = False
+        self.missing = []
+        self.nodes_explored = 0
+        self.nodes_pruned = 0
+        self.best = []
+
+        self.subset_size_list = list(subset_size_list)
+        self.paired = [paired for _, _, paired in groups]
+        self.sequences = [s for group in groups for s in group[0]]
+        self.sequences_2 = [s for group in groups for s in group[1]]
+        offsets = np.cumsum([0] + [len(group[0]) for group in groups])
+        offsets_2 = np.cumsum([0] + [len(group[1]) for group in groups])
+
+        # Precomputed distances must cover the candidates in group order
+        if distances is None:
+            distances = hamming_distance_matrix(
+                self.sequences, length=min_length)
+        if distances_2 is None:
+            distances_2 = hamming_distance_matrix(
+                self.sequences_2, length=min_length_2)
+        self.distances = distances
+
+        # The i5 of a pair must be at least thresholds[d] from the i5 of
+        # each pair whose i7 is d from its own, or the pair is unusable if
+        # the threshold is negative
+        self.thresholds = dual_index_thresholds(
+            min_distance, min_distance_2, rule)
+        self.close_2 = [None] + [
+            [bitmask(row) for row in distances_2 < t]
+            for t in range(1, int(self.thresholds.max()) + 1)]
+
+        # i5 candidates ruled out for each i7 candidate by the previous list
+        self.blocked_2 = [0] * len(self.sequences)
+        if len(previous_list) > 0 and self.sequences:
+            previous, previous_2 = zip(*previous_list)
+            thresholds = self.thresholds[np.minimum(
+                hamming_distance_matrix(
+                    self.sequences, list(previous), length=min_length),
+                len(self.thresholds) - 1)]
+            previous_distances_2 = hamming_distance_matrix(
+                self.sequences_2, list(previous_2), length=min_length_2)
+            for a, row in enumerate(thresholds):
+                if row.min() < 0:
+                    self.blocked_2[a] = None
+                    continue
+                for p in np.flatnonzero(row):
+                    self.blocked_2[a] |= bitmask(
+                        previous_distances_2[:, p] < row[p])
+
+        # Within a group, i7 candidates with the fewest close i7s come first
+        degrees = (distances < min_distance).sum(axis=1)
+        self.orders = []
+        self.partners = []
+        self.group_masks_2 = []
+        for k, group in enumerate(groups):
+            self.orders.append(sorted(
+                range(offsets[k], offsets[k + 1]),
+                key=lambda a: (degrees[a], a)))
+            self.partners.append(offsets_2[k] - offsets[k])
+            self.group_masks_2.append(
+                ((1 << int(offsets_2[k + 1])) - 1) &
+                ~((1 << int(offsets_2[k])) - 1))
+
+        self.slots = [
+            k for k, size in enumerate(self.subset_size_list)
+            for _ in range(size)]
+        self.remaining = [
+            size - n - 1 for size in self.subset_size_list
+            for n in range(size)]
+        self.chosen = np.zeros(len(self.slots), dtype=int)
+        self.chosen_2 = [0] * len(self.slots)
+        self.first_position = 0
+
+        self.exclusive = self.thresholds[0] < 0
+        if self.exclusive:
+            self.conflicts = [bitmask(row) for row in distances < min_distance]
+            self.conflicts_2 = (
+                self.close_2[min_distance_2] if min_distance_2 > 0
+                else [0] * len(self.sequences_2))
+            self.suffix_masks = []
+            for order in self.orders:
+                suffix_masks = [0] * (len(order) + 1)
+                for position in reversed(range(len(order))):
+                    suffix_masks[position] = (
+                        suffix_masks[position + 1] | (1 << order[position]))
+                self.suffix_masks.append(suffix_masks)
+            self.available = [(1 << len(self.sequences)) - 1] + [0] * len(
+                self.slots)
+            self.available_2 = [(1 << len(self.sequences_2)) - 1] + [0] * len(
+                self.slots)
+
+    def candidates_2(self, k, a, depth, after=None):
+        """
+        Return the i5 candidates of group ``k`` that can be paired with the
+        i7 candidate ``a`` given the first ``depth`` picks, as a bitmask,
+        optionally only those after the i5 candidate ``after``.
+        """
+        if self.paired[k]:
+            mask = 1 << int(a + self.partners[k])
+        else:
+            mask = self.group_masks_2[k]
+        if after is not None:
+            mask &= ~((1 << (after + 1)) - 1)
+        blocked = self.blocked_2[a]
+        if not mask or blocked is None:
+            return 0
+        if depth:
+            thresholds = self.thresholds[np.minimum(
+                self.distances[a, self.chosen[:depth]],
+                len(self.thresholds) - 1)]
+            if thresholds.min() < 0:
+                return 0
+            for s in np.flatnonzero(thresholds):
+                blocked |= self.close_2[thresholds[s]][self.chosen_2[s]]
+        return mask & ~blocked
+
+    def is_feasible(self, available, available_2, depth, position):
+        """
+        Check whether the i7 and i5 candidates in ``available`` and
+        ``available_2`` could still complete every group after the pick at
+        ``depth`` of the i7 candidate at ``position``.
+        """
+        k = self.slots[depth] if depth >= 0 else 0
+        remaining = self.remaining[depth] if depth >= 0 else 0
+        suffix = self.suffix_masks[k][position + 1] if depth >= 0 else 0
+        if (count_bits(available & suffix) < remaining or
+                count_bits(available_2 & self.group_masks_2[k]) < remaining):
+            return False
+        for j in range(k + 1 if depth >= 0 else 0, len(self.orders)):
+            needed = self.subset_size_list[j]
+            if (count_bits(available & self.suffix_masks[j][0]) < needed or
+                    count_bits(available_2 & self.group_masks_2[j]) < needed):
+                return False
+        return True
+
+    def new_frame(self, depth):
+        """
+        Return the first i7 position and its i5 candidates for the pick at
+        ``depth``, which follows on from the previous pick within a group.
+        """
+        k = self.slots[depth]
+        if depth and self.slots[depth - 1] == k:
+            position = self.frames[depth - 1][0]
+            return [position, self.candidates_2(
+                k, self.orders[k][position], depth,
+                after=self.chosen_2[depth - 1])]
+        return [0, self.candidates_2(k, self.orders[k][0], depth)]
+
+    def run(self, processes=None, deterministic=True, anytime=False):
+        """
+        Search for a compatible subset of pairs, returning ``[]`` if there
+        is none. The search is serial; ``processes`` and ``deterministic``
+        are accepted for compatibility with ``CompatibleSubsetSearch``.
+
+        In ``anytime`` mode a search that times out returns the largest
+        compatible partial subset found, as ``CompatibleSubsetSearch`` does.
+        """
+        if not self.slots:
+            return []
+        if any(size and not order for order, size in zip(
+                self.orders, self.subset_size_list)) or (
+                    self.exclusive and not self.is_feasible(
+                        self.available[0], self.available_2[0], -1, 0)):
+            self.infeasible = True
+            return []
+
+        chosen = self.search()
+        if chosen:
+            return self.format_result(chosen)
+        if not self.timed_out:
+            self.infeasible = True
+        elif anytime and self.best:
+            self.incomplete = True
+            self.missing = self.missing_counts(self.best)
+            return self.format_result(self.best)
+        return []
+
+    def search(self):
+        self.frames = [self.new_frame(0)]
+        while self.frames:
+            self.nodes_explored += 1
+            if self.nodes_explored % self.check_interval == 0:
+                if self.should_stop():
+                    return None
+                self.report_progress()
+
+            depth = len(self.frames) - 1
+            k = self.slots[depth]
+            order = self.orders[k]
+            frame = self.frames[depth]
+            position, candidates = frame
+            while not candidates:
+                position += 1
+                if position == len(order):
+                    break
+                candidates = self.candidates_2(k, order[position], depth)
+                if not candidates:
+                    self.nodes_pruned += 1
+            if depth == 0:
+                self.first_position = position
+
+            if position == len(order):
+                self.frames.pop()
+                continue
+
+            b = (candidates & -candidates).bit_length() - 1
+            frame[0] = position
+            frame[1] = candidates & ~(1 << b)
+            self.chosen[depth] = order[position]
+            self.chosen_2[depth] = b
+
+            chosen = list(zip(
+                self.chosen[:depth + 1].tolist(), self.chosen_2[:depth + 1]))
+            if len(chosen) > len(self.best):
+                self.best = chosen
+            if len(chosen) == len(self.slots):
+                return chosen
+
+            if self.exclusive:
+                a = order[position]
+                available = self.available[depth] & ~self.conflicts[a]
+                available_2 = self.available_2[depth] & ~self.conflicts_2[b]
+                if not self.is_feasible(
+                        available, available_2, depth, position):
+                    self.nodes_pruned += 1
+                    continue
+                self.available[depth + 1] = available
+                self.available_2[depth + 1] = available_2
+
+            # Paired groups use each i7 candidate once
+            k_next = self.slots[depth + 1]
+            if (self.paired[k] and k_next == k and
+                    len(order) - position - 1 < self.subset_size_list[k] - (
+                        self.slots[:depth + 1].count(k))):
+                self.nodes_pruned += 1
+                continue
+            self.frames.append(self.new_frame(depth + 1))
+
+        return None
+
+    def should_stop(self):
+        if is_timed_out(self.start_time, timeout=self.timeout):
+            self.timed_out = True
+            return True
+        return False
+
+    def estimated_time_remaining(self):
+        """
+        Extrapolate from the share of first i7 candidates already searched,
+        capped by the time left before the timeout.
+        """
+        elapsed = time.time() - self.start_time
+        time_left = max(0, self.timeout - elapsed)
+        if not self.slots or self.first_position == 0:
+            return time_left
+        fraction = self.first_position / len(self.orders[self.slots[0]])
+        return min(time_left, elapsed * (1 - fraction) / fraction)
+
+    def report_progress(self):
+        if self.progress_callback is not None:
+            self.progress_callback(self)
+
+    def missing_counts(self, chosen):
+        """Return how many pairs each group lacks."""
+        missing = list(self.subset_size_list)
+        for k in self.slots[:len(chosen)]:
+            missing[k] -= 1
+        return missing
+
+    def format_result(self, chosen):
+        """Return chosen pairs as ``'i7,i5'`` strings, in group order."""
+        return [
+            '{},{}'.format(self.sequences[a], self.sequences_2[b])
+            for a, b in chosen]
+
+
+class MaximumCompatibleSubsetSearch(object):
+    """
+    Branch-and-bound search for the largest compatible subset of indexes
+    drawn from several index sets: a maximum independent set of the
+    incompatibility graph used by ``CompatibleSubsetSearch``.
+
+    The candidates available to each branch are greedily partitioned into
+    groups of mutually incompatible candidates, as in ``clique_cover_bound``.
+    At most one candidate from each group can be added, so a candidate in
+    the ``n``-th group can extend the branch by at most ``n``. Candidates are
+    tried from the last group back, each one then being dropped from the
+    branch, and the rest of a branch is abandoned as soon as its bound
+    cannot beat the best subset found (Tomita and Seki's MCQ algorithm,
+    applied to the complement of the graph).
+
+    When the search finishes, the best subset is a maximum one. When it
+    times out, ``upper_bound`` is the most indexes any subset could have.
+    """
+
+    check_interval = 1000
+
+    def __init__(self, candidate_lists, min_length, min_distance=3,
+                 previous_list=(), timeout=10, start_time=None,
+                 progress_callback=None, distances=None):
+        self.timeout = timeout
+        self.start_time = time.time() if start_time is None else start_time
+        self.progress_callback = progress_callback
+
+        self.timed_out = False
+        self.infeasible = False
+        self.incomplete = False
+        self.optimal = False
+        self.missing = []
+        self.nodes_explored = 0
+        self.nodes_pruned = 0
+        self.first_picks = 0
+        self.best = []
+
+        # Precomputed distances must cover the candidates in list order
+        sequences = [s for c in candidate_lists for s in c]
+        set_ids = [i for i, c in enumerate(candidate_lists) for _ in c]
+        if distances is None:
+            distances = hamming_distance_matrix(sequences, length=min_length)
+
+        # Drop candidates that are incompatible with the previous list
+        kept = np.ones(len(sequences), dtype=bool)
+        if len(sequences) > 0 and len(previous_list) > 0:
+            kept = hamming_distance_matrix(
+                sequences, list(previous_list), length=min_length).min(
+                    axis=1) >= min_distance
+        kept = np.nonzero(kept)[0]
+
+        # Candidates with the fewest conflicts get the lowest bits, so they
+        # are grouped first
+        incompatible = distances[np.ix_(kept, kept)] < min_distance
+        np.fill_diagonal(incompatible, True)
+        order = np.argsort(incompatible.sum(axis=1), kind='stable')
+        incompatible = incompatible[np.ix_(order, order)]
+
+        self.positions = kept[order].tolist()
+        self.sequences = [sequences[c] for c in self.positions]
+        self.set_ids = [set_ids[c] for c in self.positions]
+        self.candidate_lists = candidate_lists
+        self.conflicts = [bitmask(row) for row in incompatible]
+        self.all_candidates = (1 << len(self.sequences)) - 1
+        self.upper_bound = len(self.sequences)
+
+    def cover_order(self, available):
+        """
+        Return the candidates in ``available`` in the order they are
+        grouped, each with the number of its group.
+        """
+        order = []
+        group_number = 0
+        while available:
+            group_number += 1
+            group = available
+            while group:
+                candidate = (group & -group).bit_length() - 1
+                order.append((candidate, group_number))
+                available &= ~(1 << candidate)
+                group &= self.conflicts[candidate] & ~(1 << candidate)
+        return order
+
+    def run(self, processes=None, deterministic=True, anytime=False):
+        """
+        Search for the largest compatible subset, returning it even if the
+        search times out before proving that none is larger (in which case
+        ``incomplete`` is set). The search is serial; ``processes``,
+        ``deterministic`` and ``anytime`` are accepted for compatibility
+        with ``CompatibleSubsetSearch``.
+        """
+        self.search()
+        if self.timed_out and len(self.best) < self.upper_bound:
+            self.incomplete = True
+        else:
+            self.optimal = True
+            self.upper_bound = len(self.best)
+        return self.format_result(self.best)
+
+    def search(self):
+        # Each frame holds the candidates still available to a branch and
+        # those left to try, grouped in ascending order
+        chosen = []
+        frames = [[self.all_candidates, self.cover_order(self.all_candidates)]]
+        if frames[0][1]:
+            self.upper_bound = frames[0][1][-1][1]
+
+        while frames:
+            self.nodes_explored += 1
+            if self.nodes_explored % self.check_interval == 0:
+                if self.should_stop():
+                    return
+                self.report_progress()
+
+            frame = frames[-1]
+            available, order = frame
+            if not order or len(chosen) + order[-1][1] <= len(self.best):
+                # Candidates left in this frame have no larger bound
+                if order:
+                    self.nodes_pruned += 1
+                frames.pop()
+                if chosen:
+                    chosen.pop()
+                continue
+            candidate, bound = order.pop()
+
+            if len(frames) == 1:
+                self.first_picks += 1
+                self.upper_bound = max(len(self.best), bound)
+            frame[0] = available & ~(1 << candidate)
+            chosen.append(candidate)
+            if len(chosen) > len(self.best):
+                self.best = list(chosen)
+
+            next_available = available & ~self.conflicts[candidate]
+            if next_available:
+                frames.append(
+                    [next_available, self.cover_order(next_available)])
+            else:
+                chosen.pop()
+
+    def should_stop(self):
+        if is_timed_out(self.start_time, timeout=self.timeout):
+            self.timed_out = True
+            return True
+        return False
+
+    def estimated_time_remaining(self):
+        """
+        Extrapolate from the share of first picks already searched, capped
+        by the time left before the timeout.
+        """
+        elapsed = time.time() - self.start_time
+        time_left = max(0, self.timeout - elapsed)
+        if self.first_picks == 0:
+            return time_left
+        fraction = self.first_picks / len(self.sequences)
+        return min(time_left, elapsed * (1 - fraction) / fraction)
+
+    def report_progress(self):
+        if self.progress_callback is not None:
+            self.progress_callback(self)
+
+    def set_counts(self, chosen):
+        """Return how many indexes are chosen from each set."""
+        counts = [0] * len(self.candidate_lists)
+        for c in chosen:
+            counts[self.set_ids[c]] += 1
+        return counts
+
+    def format_result(self, chosen):
+        """Return chosen sequences grouped in the original set order."""
+        chosen = sorted(chosen, key=lambda c: self.positions[c])
+        return [self.sequences[c] for c in chosen]
+
+
+def init_branch_worker(search, stop_event):
+    global branch_worker_search
+    search.stop_event = stop_event
+    branch_worker_search = search
+
+
+def search_branch_in_worker(position):
+    search = branch_worker_search
+    search.timed_out = False
+    search.nodes_explored = 0
+    search.nodes_pruned = 0
+    search.best = []
+
+    chosen = None
+    if not search.should_stop():
+        chosen = search.search_branch(position)
+
+    return {
+        'chosen': chosen,
+        'timed_out': search.timed_out,
+        'nodes_explored': search.nodes_explored,
+        'nodes_pruned': search.nodes_pruned,
+        'best': search.best,
+    }
+
+
+def dual_index_thresholds(min_distance, min_distance_2, rule):
+    """
+    Return, for each index 1 distance up to ``min_distance`` (beyond which
+    it stays the same), the distance below which index 2 sequences make a
+    pair incompatible under ``rule``, or -1 if the index 1 distance alone
+    does.
+    """
+    distances = np.arange(min_distance + 1)
+    close = distances < min_distance
+    if rule == 'both':
+        return np.where(close, min_distance_2, 0)
+    elif rule == 'either':
+        return np.where(close, -1, min_distance_2)
+    elif rule == 'sum':
+        return np.maximum(min_distance - distances, 0)
+    else:
+        raise ValueError('Unknown dual-index rule: {}'.format(rule))
+
+
+def dual_search_parameters(index_set_list, index_set_2_list, min_length_2,
+                           pairing='combinatorial', min_distance_2=3,
+                           rule='both'):
+    """
+    Return the JSON-serializable index 2 parameters of a dual-indexed
+    search, pairing each selected index 1 set with the index 2 set at the
+    same position of ``index_set_2_list``.
+    """
+    return {
+        'index_sets_2': [
+            index_set_2.pk for index_set, index_set_2 in zip(
+                index_set_list, index_set_2_list) if index_set is not None],
+        'pairing': pairing,
+        'min_length_2': min_length_2,
+        'min_distance_2': min_distance_2,
+        'rule': rule,
+    }
+
+
+def stored_distances(index_sets, length):
+    """
+    Return the indexes of each set and the distances between all of them
+    at ``length``, assembled from the stored distance matrices.
+    """
+    index_lists = [None] * len(index_sets)
+    blocks = [[None] * len(index_sets) for _ in index_sets]
+    for i, index_set_1 in enumerate(index_sets):
+        for j in range(i, len(index_sets)):
+            indexes_1, indexes_2, distances = (
+                IndexSetDistanceMatrix.objects.get_distances(
+                    index_set_1, index_sets[j], length))
+            index_lists[i] = indexes_1
+            blocks[i][j] = distances
+            blocks[j][i] = distances.T
+    return index_lists, np.block(blocks)
+
+
+def build_subset_search(index_set_list, subset_size_list, min_length,
+                        min_distance=3, previous_list=(), timeout=10,
+                        start_time=None, progress_callback=None, dual=None,
+                        maximize=False, color_balance=None):
+    """
+    Build the search for a compatible subset of the selected index sets, or
+    of dual-indexed pairs if ``dual`` holds the index 2 parameters (see
+    ``dual_search_parameters``). With ``maximize``, the subset sizes are
+    ignored and the search is for the largest compatible subset.
+    ``color_balance`` (see ``CompatibleSubsetSearch``) only applies to
+    single-indexed searches for a number of indexes from each set.
+    """
+    selected = [
+        (index_set, subset_size)
+        for index_set, subset_size in zip(index_set_list, subset_size_list)
+        if index_set is not None]
+    if not selected:
+        return None
+
+    if dual is not None:
+        index_sets_2 = IndexSet.objects.in_bulk(dual['index_sets_2'])
+        return build_dual_subset_search(
+            [index_set for index_set, _ in selected],
+            [index_sets_2[pk] for pk in dual['index_sets_2']],
+            [subset_size for _, subset_size in selected], min_length,
+            dual['min_length_2'], pairing=dual['pairing'],
+            min_distance=min_distance, min_distance_2=dual['min_distance_2'],
+            rule=dual['rule'], previous_list=previous_list, timeout=timeout,
+            start_time=start_time, progress_callback=progress_callback)
+
+    index_sets = [index_set for index_set, _ in selected]
+    length = min(min_length, minimum_index_length_from_sets(index_sets))
+    if length == float('inf'):
+        # None of the sets has indexes
+        return None
+
+    index_lists, distances = stored_distances(index_sets, length)
+    candidate_lists = [
+        [index.sequence for index in indexes] for indexes in index_lists]
+
+    if maximize:
+        return MaximumCompatibleSubsetSearch(
+            candidate_lists, length, min_distance=min_distance,
+            previous_list=previous_list, timeout=timeout,
+            start_time=start_time, progress_callback=progress_callback,
+            distances=distances)
+    return CompatibleSubsetSearch(
+        candidate_lists, [subset_size for _, subset_size in selected],
+        length, min_distance=min_distance, previous_list=previous_list,
+        timeout=timeout, start_time=start_time,
+        progress_callback=progress_callback, distances=distances,
+        color_balance=color_balance)
+
+
+def build_dual_subset_search(index_set_list, index_set_2_list,
+                             subset_size_list, min_length, min_length_2,
+                             pairing='combinatorial', min_distance=3,
+                             min_distance_2=3, rule='both', previous_list=(),
+                             timeout=10, start_time=None,
+                             progress_callback=None):
+    """
+    Build a ``DualIndexSubsetSearch`` over pairs of an index 1 set from
+    ``index_set_list`` and the index 2 set at the same position of
+    ``index_set_2_list``, either paired by index name or combined freely
+    (see ``INDEX_PAIRING_CHOICES``). ``previous_list`` holds ``'i7,i5'``
+    pairs that every chosen pair must be compatible with.
+    """
+    selected = [
+        (index_set, index_set_2, subset_size)
+        for index_set, index_set_2, subset_size in zip(
+            index_set_list, index_set_2_list, subset_size_list)
+        if index_set is not None and index_set_2 is not None]
+    if not selected:
+        return None
+
+    index_sets, index_sets_2, subset_sizes = zip(*selected)
+    length = min(min_length, minimum_index_length_from_sets(index_sets))
+    length_2 = min(min_length_2, minimum_index_length_from_sets(index_sets_2))
+    if float('inf') in (length, length_2):
+        # None of the sets (or none of the index 2 sets) has indexes
+        return None
+    length = int(length)
+    length_2 = int(length_2)
+    index_lists, distances = stored_distances(index_sets, length)
+    index_lists_2, distances_2 = stored_distances(index_sets_2, length_2)
+
+    groups = []
+    kept = []
+    kept_2 = []
+    offset = offset_2 = 0
+    for indexes, indexes_2 in zip(index_lists, index_lists_2):
+        positions = list(range(len(indexes)))
+        positions_2 = list(range(len(indexes_2)))
+        if pairing == 'paired':
+            by_name = {index.name: i for i, index in enumerate(indexes_2)}
+            positions = [
+                i for i, index in enumerate(indexes) if index.name in by_name]
+            positions_2 = [by_name[indexes[i].name] for i in positions]
+        groups.append((
+            [indexes[i].sequence for i in positions],
+            [indexes_2[i].sequence for i in positions_2],
+            pairing == 'paired'))
+        kept.extend(offset + i for i in positions)
+        kept_2.extend(offset_2 + i for i in positions_2)
+        offset += len(indexes)
+        offset_2 += len(indexes_2)
+
+    return DualIndexSubsetSearch(
+        groups, subset_sizes, length, length_2, min_distance=min_distance,
+        min_distance_2=min_distance_2, rule=rule,
+        previous_list=[pair.split(',') for pair in previous_list],
+        timeout=timeout, start_time=start_time,
+        progress_callback=progress_callback,
+        distances=distances[np.ix_(kept, kept)],
+        distances_2=distances_2[np.ix_(kept_2, kept_2)])
+
+
+def cache_search_result(key, search, result, timeout):
+    caches[SEARCH_CACHE].set(key, {
+        'result': result,
+        'timed_out': search.timed_out,
+        'infeasible': search.infeasible,
+        'incomplete': search.incomplete,
+        'missing': search.missing,
+        'upper_bound': getattr(search, 'upper_bound', None),
+        'timeout': timeout,
+    }, SEARCH_CACHE_TIMEOUT)
+
+
+def find_compatible_subset(index_set_list, subset_size_list, min_length,
+                           min_distance=3, previous_list=[], timeout=10,
+                           start_time=None, progress_callback=None,
+                           processes=None, deterministic=True,
+                           use_cache=False, anytime=False, timer=None,
+                           dual=None, maximize=False, color_balance=None):
+
+    find_compatible_subset.timed_out = False
+    find_compatible_subset.incomplete = False
+    find_compatible_subset.missing = []
+    find_compatible_subset.upper_bound = None
+
+    if use_cache:
+        key = search_cache_key(
+            index_set_list, subset_size_list, min_length, min_distance,
+            previous_list, dual=dual, maximize=maximize,
+            color_balance=color_balance, anytime=anytime, processes=processes,
+            deterministic=deterministic)
+        cached = get_cached_search_result(key, timeout)
+        if cached is not None and (anytime or not cached['incomplete']):
+            find_compatible_subset.timed_out = cached['timed_out']
+            find_compatible_subset.incomplete = cached['incomplete']
+            find_compatible_subset.missing = cached['missing']
+            find_compatible_subset.upper_bound = cached.get('upper_bound')
+            return cached['result']
+
+    if timer is None:
+        timer = PhaseTimer('search')
+    with timer.phase('distance'):
+        search = build_subset_search(
+            index_set_list, subset_size_list, min_length,
+            min_distance=min_distance, previous_list=previous_list,
+            timeout=timeout, start_time=start_time,
+            progress_callback=progress_callback, dual=dual,
+            maximize=maximize, color_balance=color_balance)
+    if search is None:
+        return None
+    with timer.phase('search'):
+        search_start = time.perf_counter()
+        compatible_subset = search.run(
+            processes=processes, deterministic=deterministic, anytime=anytime)
+    record_search(search, timer.mode, time.perf_counter() - search_start)
+
+    if use_cache:
+        cache_search_result(key, search, compatible_subset, timeout)
+
+    find_compatible_subset.timed_out = search.timed_out
+    find_compatible_subset.incomplete = search.incomplete
+    find_compatible_subset.missing = search.missing
+    find_compatible_subset.upper_bound = getattr(search, 'upper_bound', None)
+    return compatible_subset
+
+
+def get_cached_search_result(key, timeout):
+    """
+    Return the cached result for ``key``, unless the cached search timed out
+    with less time than ``timeout`` and could do better with more.
+    """
+    cached = caches[SEARCH_CACHE].get(key)
+    if cached is not None and cached['timed_out'] and cached['timeout'] < timeout:
+        cached = None
+    increment(
+        'search_cache_requests_total',
+        result='miss' if cached is None else 'hit')
+    return cached
+
+
+def search_cache_key(index_set_list, subset_size_list, min_length,
+                     min_distance, previous_list, dual=None, maximize=False,
+                     color_balance=None, anytime=False, processes=None,
+                     deterministic=True):
+    """
+    Build a cache key from the canonical search inputs and the catalog
+    version, so that edits to any index set make old results unreachable.
+
+    How the search is run is part of the key too, since ``anytime`` changes
+    what a timed-out search returns and a search that is not
+    ``deterministic`` may return a different subset for each number of
+    ``processes``.
+    """
+    parameters = {
+        'catalog_version': catalog_version(),
+        'index_sets': [
+            [index_set.pk, subset_size]
+            for index_set, subset_size in zip(index_set_list, subset_size_list)
+            if index_set is not None],
+        'min_length': min_length,
+        'min_distance': min_distance,
+        'previous_list': sorted(index.upper() for index in previous_list),
+        'dual': dual,
+        'maximize': maximize,
+        'color_balance': color_balance,
+        'anytime': anytime,
+        'processes': None if deterministic else processes,
+    }
+    digest = hashlib.sha1(
+        json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+    return 'compatible_index_sequences:search:{}'.format(digest)
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+BASES = 'ACGT'
+
+# Bases are coded 0-3 in the order of BASES; anything else (including the
+# padding of shorter sequences) is 4 and is not counted
+LOGO_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(BASES):
+    LOGO_BASE_CODES[ord(base)] = code
+    LOGO_BASE_CODES[ord(base.lower())] = code
+
+# Same colors as Illumina's two-channel chemistry figures
+BASE_COLORS = {
+    'A': 'red',
+    'C': 'green',
+    'G': 'blue',
+    'T': 'black',
+}
+
+# Letter outlines drawn in a 100 x 100 box, y increasing downwards
+BASE_GLYPHS = {
+    'A': ['M0 100L40 0H60L100 100H82L71 72H29L18 100ZM35 57H65L50 19Z'],
+    'C': ['M91 28A46 50 0 1 0 91 72L77 64A30 34 0 1 1 77 36Z'],
+    'G': ['M91 28A46 50 0 1 0 91 72L77 64A30 34 0 1 1 77 36Z',
+          'M54 50H96V100H80V64H54Z'],
+    'T': ['M0 0H100V16H58V100H42V16H0Z'],
+}
+
+COLUMN_WIDTH = 24
+PLOT_HEIGHT = 120
+MARGIN_LEFT = 40
+MARGIN_RIGHT = 8
+MARGIN_TOP = 8
+MARGIN_BOTTOM = 24
+
+
+def information_content(frequencies):
+    """Return the information (in bits) of each row of base frequencies."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.where(
+            frequencies > 0, frequencies * np.log2(frequencies), 0).sum(axis=1)
+    return np.log2(len(BASES)) - entropy
+
+
+def position_frequency_matrix(index_list):
+    """
+    Return the frequency of each base at each position, counting only the
+    sequences long enough to reach that position.
+    """
+    length = max((len(index) for index in index_list), default=0)
+    padded = ''.join(index.ljust(length, '-') for index in index_list)
+    codes = LOGO_BASE_CODES[
+        np.frombuffer(padded.encode('ascii'), dtype=np.uint8)]
+    codes = codes.reshape(len(index_list), length)
+
+    counts = np.stack(
+        [(codes == code).sum(axis=0) for code in range(len(BASES))], axis=1)
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.divide(
+        counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+
+def sequence_logo_svg(index_list, unit='bit'):
+    """
+    Draw a sequence logo for ``index_list`` as an SVG document, with stack
+    heights in ``unit`` ('bit' or 'probability').
+    """
+    frequencies = position_frequency_matrix(index_list)
+    if unit == 'bit':
+        y_max = np.log2(len(BASES))
+        heights = frequencies * information_content(frequencies)[:, None]
+        ticks = np.arange(0, y_max + 0.01, 0.5)
+    elif unit == 'probability':
+        y_max = 1
+        heights = frequencies
+        ticks = np.arange(0, 1.01, 0.2)
+    else:
+        raise ValueError('Unknown logo unit: {}'.format(unit))
+
+    width = MARGIN_LEFT + COLUMN_WIDTH * len(frequencies) + MARGIN_RIGHT
+    height = MARGIN_TOP + PLOT_HEIGHT + MARGIN_BOTTOM
+    baseline = MARGIN_TOP + PLOT_HEIGHT
+    scale = PLOT_HEIGHT / y_max
+
+    svg = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+        'viewBox="0 0 {0} {1}" font-family="sans-serif" font-size="10">'
+        .format(width, height),
+        '<rect width="100%" height="100%" fill="white"/>',
+    ]
+
+    # Stack each position's bases with the tallest on top
+    for position, column_heights in enumerate(heights):
+        x = MARGIN_LEFT + position * COLUMN_WIDTH + 1
+        y = baseline
+        for code in np.argsort(column_heights, kind='stable'):
+            letter_height = column_heights[code] * scale
+            if letter_height < 0.5:
+                continue
+            y -= letter_height
+            base = BASES[code]
+            for glyph in BASE_GLYPHS[base]:
+                svg.append(
+                    '<path d="{}" fill="{}" fill-rule="evenodd" '
+                    'transform="translate({:.2f} {:.2f}) scale({:.4f} {:.4f})"/>'
+                    .format(glyph, BASE_COLORS[base], x, y,
+                            (COLUMN_WIDTH - 2) / 100, letter_height / 100))
+        svg.append(
+            '<text x="{:.1f}" y="{}" text-anchor="middle">{}</text>'.format(
+                x - 1 + COLUMN_WIDTH / 2, baseline + 14, position + 1))
+
+    svg.append(
+        '<path d="M{0} {1}V{2}H{3}" fill="none" stroke="black"/>'.format(
+            MARGIN_LEFT - 2, MARGIN_TOP, baseline,
+            MARGIN_LEFT + COLUMN_WIDTH * len(frequencies)))
+    for tick in ticks:
+        y = baseline - tick * scale
+        svg.append(
+            '<path d="M{0} {1:.2f}H{2}" stroke="black"/>'
+            '<text x="{3}" y="{4:.2f}" text-anchor="end">{5:g}</text>'.format(
+                MARGIN_LEFT - 6, y, MARGIN_LEFT - 2, MARGIN_LEFT - 8, y + 3,
+                round(tick, 1)))
+    svg.append(
+        '<text transform="translate(10 {}) rotate(-90)" '
+        'text-anchor="middle">{}</text>'.format(
+            MARGIN_TOP + PLOT_HEIGHT / 2, unit))
+    svg.append('</svg>')
+    return '\n'.join(svg)
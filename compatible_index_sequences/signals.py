@@ -0,0 +1,41 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .catalog import invalidate_index_catalog
+from .models import Index, IndexSet, IndexSetDistanceMatrix
+
+
+@receiver(pre_save, sender=Index)
+def normalize_index_sequence(sender, instance, **kwargs):
+    instance.normalize_sequence()
+
+
+@receiver(post_delete, sender=Index)
+@receiver(post_save, sender=Index)
+def invalidate_distance_matrices(sender, instance, **kwargs):
+    """Drop stored matrices for the changed set; they are rebuilt on demand."""
+    IndexSetDistanceMatrix.objects.invalidate(instance.index_set_id)
+
+
+@receiver(post_delete, sender=Index)
+@receiver(post_delete, sender=IndexSet)
+@receiver(post_save, sender=Index)
+@receiver(post_save, sender=IndexSet)
+def clear_index_catalog(sender, **kwargs):
+    invalidate_index_catalog()
+
+
+@receiver(post_delete, sender=Index)
+@receiver(post_save, sender=Index)
+def update_index_set_statistics(sender, instance, **kwargs):
+    """Store the changed set's new statistics (but not self distances)."""
+    IndexSet.objects.update_statistics(instance.index_set_id)
+
+
+@receiver(post_delete, sender=Index)
+@receiver(post_save, sender=Index)
+def touch_index_set(sender, instance, **kwargs):
+    """Mark the changed index's set (and so the catalog) as modified."""
+    IndexSet.objects.filter(pk=instance.index_set_id).update(
+        last_modified=timezone.now())
@@ -115,56 +115,25 @@ $('#config-visibility :checkbox').change(function() {
 });
 
 
-function hamming(input1, input2, length) {
-  if ($('#id_config_length_manual').is(':checked')) {
-    length = $('#id_config_length')[0].value;
-  } else if ( length == null ) {
-    length = Math.min(input1.length, input2.length);
-  }
+// Interactive mode adjacency data (each index's ID mapped to the IDs of the
+// indexes it is incompatible with), keyed by 'distance:length:index sets'
+var adjacencyCache = {},
+  adjacencyRequests = {};
 
-  var distance = 0;
-  for ( i = 0; i < length; i++ ) {
-    if ( input1[ i ] !== input2[ i ] ) {
-      distance += 1;
-    }
-  }
-  return distance;
-}
+// Selected index IDs and, for each index, how many of its incompatible
+// neighbors are selected, for the adjacency data in use
+var adjacencyKey = null,
+  selectedIds = {},
+  selectedNeighborCounts = {},
+  indexElements = null;
 
 
 function checkCompatibility() {
-  var min_dist = $('#id_config_distance')[0].value;
   var selected = $('.idx.selected');
-  var notSelected = $('.idx').not('.selected');
-  var incompatible = new Array();
 
   var s_length = selected.length;
-  var n_length = notSelected.length;
   var min_length = minimumIndexLength(selected);
-
-  // compare all members of selected set to self
-  for ( var s1 = 0; s1 < s_length; s1++) {
-    for ( var s2 = s1 + 1; s2 < s_length; s2++) {
-      var sequence1 = $( selected[s1] ).children('.sequence').text().trim();
-      var sequence2 = $( selected[s2] ).children('.sequence').text().trim();
-      var hamming_distance = hamming(sequence1.toUpperCase(),
-                                     sequence2.toUpperCase(), min_length);
-      if ( hamming_distance < min_dist ) {
-        incompatible.push(selected[s1], selected[s2]);
-      }
-    }
-
-    // compare all members of selected set to all members of non-selected set
-    for ( var n = 0; n < n_length; n++) {
-      var sequence1 = $( selected[s1] ).children('.sequence').text().trim();
-      var sequence2 = $( notSelected[n] ).children('.sequence').text().trim();
-      var hamming_distance = hamming(sequence1.toUpperCase(),
-                                     sequence2.toUpperCase(), min_length);
-      if ( hamming_distance < min_dist ) {
-        incompatible.push(notSelected[n]);
-      }
-    }
-  }
+  var pending = !updateIncompatible(selected);
 
   // Disable select/deselect all buttons when they are irrelevant
   if (s_length > 0) {
@@ -194,13 +163,12 @@ function checkCompatibility() {
     }
   }
 
-  $('.idx').removeClass('incompatible');
-  $(incompatible).addClass('incompatible');
-
   // Enable/Disable Sample Sheet Export Button
   $exportButton = $('#export-csv button[type="submit"]')
   $exportList = $('#export-csv input#id_index_list_csv')[0]
-  if ( $('.idx.selected.incompatible').length > 0 ) {
+  if ( pending ) {
+    $exportButton.prop('disabled', true)
+  } else if ( $('.idx.selected.incompatible').length > 0 ) {
     $exportButton.addClass('btn-danger')
     $exportButton.prop('disabled', true)
   } else if ( $('.idx.selected').length > 0 ) {
@@ -217,49 +185,159 @@ function checkCompatibility() {
 }
 
 
-function deselectIncompatible(index) {
-  if (!$(index).is('.selected.incompatible')) {
-    return;
+// Mark indexes incompatible with any selected index (other than
+// themselves). Returns false while the adjacency data is still loading.
+function updateIncompatible(selected) {
+  var distance = parseInt($('#id_config_distance')[0].value, 10);
+  var length = comparisonLength(selected);
+
+  if (selected.length === 0 || isNaN(distance) || !isFinite(length)) {
+    resetSelectedNeighborCounts(null);
+    return true;
+  }
+  // Indexes cannot be compared over fewer bases than the minimum distance
+  if (distance > length) {
+    return false;
   }
 
-  var min_dist = $('#id_config_distance')[0].value;
-  var allIndexes = $('.idx');
-  var sequence1 = index.children('.sequence').text().trim();
+  var indexSets = shownIndexSetIds();
+  var key = distance + ':' + length + ':' + indexSets;
+  var adjacency = loadAdjacency(distance, length, indexSets);
+  if (adjacency === null) {
+    return false;
+  }
+  if (key !== adjacencyKey) {
+    resetSelectedNeighborCounts(key);
+  }
 
-  var min_length = minimumIndexLength($('.idx.selected'));
+  var currentIds = {};
+  selected.each(function() {
+    currentIds[$(this).data('index-id')] = true;
+  });
 
-  for (var i = 0; i < allIndexes.length; i++) {
-    if ($(allIndexes[i]).hasClass('selected') && allIndexes[i] !== index[0]) {
-      var sequence2 = $(allIndexes[i]).children('.sequence').text().trim();
-      var hamming_distance = hamming(sequence1.toUpperCase(),
-                                     sequence2.toUpperCase(), min_length);
-      if ( hamming_distance < min_dist ) {
-        $(allIndexes[i]).removeClass('selected');
-      }
+  var changedIds = {},
+    id;
+  for (id in selectedIds) {
+    if (!(id in currentIds)) {
+      countSelectedNeighbors(adjacency[id], -1, changedIds);
+    }
+  }
+  for (id in currentIds) {
+    if (!(id in selectedIds)) {
+      countSelectedNeighbors(adjacency[id], 1, changedIds);
     }
   }
+  selectedIds = currentIds;
+
+  for (id in changedIds) {
+    $(indexElement(id)).toggleClass(
+      'incompatible', selectedNeighborCounts[id] > 0);
+  }
+  return true;
 }
 
-function flashIncompatible(index) {
+
+function countSelectedNeighbors(neighbors, change, changedIds) {
+  if (neighbors === undefined) {
+    return;
+  }
+  for (var i = 0; i < neighbors.length; i++) {
+    var id = neighbors[i];
+    selectedNeighborCounts[id] = (selectedNeighborCounts[id] || 0) + change;
+    changedIds[id] = true;
+  }
+}
+
+
+function resetSelectedNeighborCounts(key) {
+  adjacencyKey = key;
+  selectedIds = {};
+  selectedNeighborCounts = {};
+  $('.idx.incompatible').removeClass('incompatible');
+}
+
+
+// Return cached adjacency data for the index sets shown, or request it and
+// check compatibility again once it arrives
+function loadAdjacency(distance, length, indexSets) {
+  var key = distance + ':' + length + ':' + indexSets;
+  if (key in adjacencyCache) {
+    return adjacencyCache[key];
+  }
+  if (!(key in adjacencyRequests)) {
+    adjacencyRequests[key] = $.getJSON(
+      $('#index-sets').data('adjacency-url'),
+      {distance: distance, length: length, index_sets: indexSets},
+      function(data) {
+        adjacencyCache[key] = data.neighbors;
+        delete adjacencyRequests[key];
+        checkCompatibility();
+      }).fail(function() {
+        delete adjacencyRequests[key];
+      });
+  }
+  return null;
+}
+
+
+// Comma-separated IDs of the index sets currently shown
+function shownIndexSetIds() {
+  return $('.index_set.selected-set.selected-type').map(function() {
+    return $(this).data('index-set-id');
+  }).get().join(',');
+}
+
+
+function currentAdjacencyNeighbors(index) {
+  if (adjacencyKey === null || !(adjacencyKey in adjacencyCache)) {
+    return [];
+  }
+  return adjacencyCache[adjacencyKey][$(index).data('index-id')] || [];
+}
+
+
+function comparisonLength(selected) {
+  if ($('#id_config_length_manual').is(':checked')) {
+    return parseInt($('#id_config_length')[0].value, 10);
+  }
+  return minimumIndexLength(selected);
+}
+
+
+function indexElement(id) {
+  if (indexElements === null) {
+    indexElements = {};
+    $('.idx').each(function() {
+      indexElements[$(this).data('index-id')] = this;
+    });
+  }
+  return indexElements[id];
+}
+
+
+function deselectIncompatible(index) {
   if (!$(index).is('.selected.incompatible')) {
     return;
   }
 
-  var min_dist = $('#id_config_distance')[0].value;
-  var allIndexes = $('.idx');
-  var sequence1 = index.children('.sequence').text().trim();
+  var neighbors = currentAdjacencyNeighbors(index);
+  for (var i = 0; i < neighbors.length; i++) {
+    $(indexElement(neighbors[i])).removeClass('selected');
+  }
+}
 
-  var min_length = minimumIndexLength($('.idx.selected'));
+function flashIncompatible(index) {
+  if (!$(index).is('.selected.incompatible')) {
+    return;
+  }
 
-  var incompatibleSelectedIndexes = $('.idx').filter('.incompatible.selected')
+  var neighbors = currentAdjacencyNeighbors(index);
   var indexesToFlash = [];
 
-  for (var i = 0; i < incompatibleSelectedIndexes.length; i++) {
-    var sequence2 = $(incompatibleSelectedIndexes[i]).children('.sequence').text().trim();
-    var hamming_distance = hamming(sequence1.toUpperCase(),
-                                   sequence2.toUpperCase(), min_length);
-    if ( hamming_distance < min_dist ) {
-      indexesToFlash.push($(incompatibleSelectedIndexes[i]))
+  for (var i = 0; i < neighbors.length; i++) {
+    var neighbor = $(indexElement(neighbors[i]));
+    if (neighbor.is('.incompatible.selected')) {
+      indexesToFlash.push(neighbor)
     }
   }
 
@@ -1,3 +1,1138 @@
-from django.test import TestCase
+import csv
+import glob
+import itertools
+import json
+import os
+import random
+import tempfile
+import uuid
+from collections import Counter
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from .forms import AutoIndexListForm
+
+from .catalog import get_index_catalog
+from .jobs import create_search_job
+from .models import Index, IndexSet, IndexSetDistanceMatrix, SearchJob
+from .search import (
+    SEARCH_CACHE, CompatibleSubsetSearch, DualIndexSubsetSearch,
+    MaximumCompatibleSubsetSearch, dual_index_thresholds,
+    dual_search_parameters, find_compatible_subset)
+from . import utils
+from .utils import (
+    SEGMENT_INDEX_MIN_SIZE, channel_signal, find_incompatible_dual_index_pairs,
+    find_incompatible_index_pairs, hamming_distance, hamming_distance_matrix,
+    incompatible_position_pairs, is_self_compatible,
+    remove_incompatible_indexes_from_queryset)
+
+
+def brute_force_balance(candidate_lists, subset_size_list, min_distance,
+                        length, previous_list, chemistry):
+    """
+    Return the balance (the weakest channel at any cycle) of the best
+    balanced compatible subset, or ``None`` if there is no compatible subset.
+    """
+    return max((
+        channel_signal(
+            list(previous_list) + subset, chemistry, length).min()
+        for subset in brute_force_subsets(candidate_lists, subset_size_list)
+        if is_compatible(subset, min_distance, length, previous_list)),
+        default=None)
+
+
+def brute_force_maximum(index_list, min_distance, length, previous_list=()):
+    """Return the size of the largest compatible subset of ``index_list``."""
+    index_list = [
+        s for s in index_list
+        if is_compatible([s], min_distance, length, previous_list)]
+    incompatible = set(brute_force_incompatible_pairs(
+        index_list, min_distance, length))
+    for size in range(len(index_list), 0, -1):
+        if any(incompatible.isdisjoint(itertools.combinations(subset, 2))
+               for subset in itertools.combinations(
+                   range(len(index_list)), size)):
+            return size
+    return 0
+
+
+def brute_force_subsets(candidate_lists, subset_size_list):
+    """Yield every subset with the given number of indexes from each list."""
+    for combination in itertools.product(*[
+            itertools.combinations(candidates, size)
+            for candidates, size in zip(candidate_lists, subset_size_list)]):
+        yield [index for picks in combination for index in picks]
+
+
+def create_index_set(name, sequences, index_names=None):
+    index_set = IndexSet.objects.create(name=name)
+    if index_names is None:
+        index_names = [
+            '{} {}'.format(name, number)
+            for number in range(1, len(sequences) + 1)]
+    for index_name, sequence in zip(index_names, sequences):
+        Index.objects.create(
+            index_set=index_set, name=index_name, sequence=sequence)
+    index_set.refresh_from_db()
+    return index_set
+
+
+def dual_incompatible(pair, other, min_distance, min_distance_2, rule,
+                      length, length_2):
+    """Compare two ``(i7, i5)`` pairs under a dual-index rule."""
+    return dual_distances_incompatible(
+        hamming_distance(pair[0][:length], other[0][:length]),
+        hamming_distance(pair[1][:length_2], other[1][:length_2]),
+        min_distance, min_distance_2, rule)
+
+
+def dual_distances_incompatible(distance, distance_2, min_distance,
+                                min_distance_2, rule):
+    if rule == 'both':
+        return distance < min_distance and distance_2 < min_distance_2
+    elif rule == 'either':
+        return distance < min_distance or distance_2 < min_distance_2
+    return distance + distance_2 < min_distance
+
+
+def is_dual_compatible(pairs, min_distance, min_distance_2, rule, length,
+                       length_2, previous_list=()):
+    """The dual-indexed counterpart of ``is_compatible``."""
+    return not any(
+        dual_incompatible(
+            a, b, min_distance, min_distance_2, rule, length, length_2)
+        for a, b in itertools.chain(
+            itertools.combinations(pairs, 2),
+            itertools.product(pairs, previous_list)))
+
+
+def is_compatible(index_list, min_distance, length, previous_list=()):
+    """
+    Check that ``index_list`` is compatible with itself and with (but not
+    necessarily within) ``previous_list``.
+    """
+    if brute_force_incompatible_pairs(index_list, min_distance, length):
+        return False
+    return all(
+        hamming_distance(a[:length], b[:length]) >= min_distance
+        for a in index_list for b in previous_list)
+
+
+def random_sequences(rng, size, length, bases='ACGT'):
+    """
+    Return ``size`` random sequences of ``length`` bases, or of lengths drawn
+    from ``length`` if it is a ``(shortest, longest)`` range.
+    """
+    sequences = []
+    for _ in range(size):
+        n = rng.randint(*length) if isinstance(length, tuple) else length
+        sequences.append(''.join(rng.choice(bases) for _ in range(n)))
+    return sequences
+
+
+def brute_force_incompatible_pairs(index_list, min_distance, length):
+    return [
+        (i, j) for i, j in itertools.combinations(range(len(index_list)), 2)
+        if hamming_distance(
+            index_list[i][:length], index_list[j][:length]) < min_distance]
+
+
+class HammingDistanceTests(SimpleTestCase):
+    """
+    The packed distance engine gives the same distances as comparing
+    sequences base by base.
+    """
+
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def test_matrix_matches_hamming_distance(self):
+        # Lengths beyond 32 bases take more than one packed word
+        for length in [1, 6, 8, 31, 32, 33, 70]:
+            index_list = random_sequences(self.rng, 20, length)
+            distances = hamming_distance_matrix(index_list)
+            for i, j in itertools.product(range(20), repeat=2):
+                self.assertEqual(
+                    distances[i, j],
+                    hamming_distance(index_list[i], index_list[j]))
+
+    def test_matrix_compares_shortest_length(self):
+        index_list = random_sequences(self.rng, 15, (6, 10))
+        other_list = random_sequences(self.rng, 10, (7, 12))
+        for length in [None, 4]:
+            distances = hamming_distance_matrix(
+                index_list, other_list, length=length)
+            shortest = min(len(s) for s in index_list + other_list)
+            if length is not None:
+                shortest = min(shortest, length)
+            for i, j in itertools.product(range(15), range(10)):
+                self.assertEqual(distances[i, j], hamming_distance(
+                    index_list[i][:shortest], other_list[j][:shortest]))
+
+    def test_incompatible_pairs_match_brute_force(self):
+        for min_distance in [1, 2, 3, 4]:
+            # Short sequences collide often enough to give incompatible pairs
+            index_list = random_sequences(self.rng, 60, (5, 7))
+            expected = brute_force_incompatible_pairs(
+                index_list, min_distance, 5)
+            self.assertEqual(
+                find_incompatible_index_pairs(
+                    index_list, min_distance, sequences=False,
+                    positions=True),
+                expected)
+            self.assertEqual(
+                find_incompatible_index_pairs(index_list, min_distance),
+                [(index_list[i], index_list[j]) for i, j in expected])
+            self.assertEqual(
+                is_self_compatible(index_list, min_distance), not expected)
+
+    def test_remove_incompatible_indexes(self):
+        index_set = random_sequences(self.rng, 40, 6)
+        index_list = random_sequences(self.rng, 8, 6)
+        for min_distance in [1, 2, 3]:
+            self.assertEqual(
+                remove_incompatible_indexes_from_queryset(
+                    index_set, index_list, min_distance),
+                [s for s in index_set if all(
+                    hamming_distance(s, t) >= min_distance
+                    for t in index_list)])
+
+
+class SegmentIndexTests(SimpleTestCase):
+    """
+    Long lists are checked with a segment index, or compared pair by pair
+    when the segments would leave too many pairs, and both find the same
+    incompatible pairs as comparing every pair base by base.
+    """
+
+    def setUp(self):
+        self.rng = random.Random(3)
+
+    def assert_pairs_match(self, index_list, min_distance, segment_index):
+        length = min(len(s) for s in index_list)
+        with mock.patch.object(
+                utils, 'segment_index_candidate_pairs',
+                wraps=utils.segment_index_candidate_pairs) as candidates:
+            first, second = incompatible_position_pairs(
+                index_list, min_distance)
+            self.assertEqual(candidates.called, segment_index)
+        expected = brute_force_incompatible_pairs(
+            index_list, min_distance, length)
+        self.assertEqual(list(zip(first.tolist(), second.tolist())), expected)
+        self.assertEqual(
+            is_self_compatible(index_list, min_distance), not expected)
+        return expected
+
+    def mutated(self, sequence, mutations):
+        sequence = list(sequence)
+        for position in self.rng.sample(range(len(sequence)), mutations):
+            sequence[position] = self.rng.choice('ACGT')
+        return ''.join(sequence)
+
+    def test_segment_index(self):
+        index_list = random_sequences(self.rng, SEGMENT_INDEX_MIN_SIZE, 12)
+        # Add near copies, some at mixed lengths, so that there are pairs
+        # at every distance up to the minimum
+        index_list += [
+            self.mutated(s, self.rng.randint(0, 3)) + 'ACGT'[:i % 3]
+            for i, s in enumerate(self.rng.sample(index_list, 100))]
+        for min_distance in [2, 4]:
+            self.assertTrue(
+                self.assert_pairs_match(index_list, min_distance, True))
+
+    def test_segment_index_compatible_list(self):
+        # Random sequences this long are almost never close
+        index_list = random_sequences(self.rng, SEGMENT_INDEX_MIN_SIZE, 16)
+        self.assertFalse(self.assert_pairs_match(index_list, 3, True))
+        index_list.insert(10, self.mutated(index_list[500], 2))
+        self.assertTrue(self.assert_pairs_match(index_list, 3, True))
+
+    def test_dense_fallback(self):
+        # Segments of one or two bases are shared by most pairs
+        index_list = random_sequences(self.rng, SEGMENT_INDEX_MIN_SIZE, 4)
+        self.assertTrue(self.assert_pairs_match(index_list, 3, False))
+        # More segments than bases
+        self.assertTrue(self.assert_pairs_match(index_list, 5, False))
+
+    def test_short_lists_are_compared_pair_by_pair(self):
+        index_list = random_sequences(
+            self.rng, SEGMENT_INDEX_MIN_SIZE - 1, 12)
+        self.assert_pairs_match(index_list, 3, False)
+
+
+class CompatibleSubsetSearchTests(SimpleTestCase):
+    """
+    The branch-and-bound search finds a compatible subset exactly when
+    enumerating every subset does.
+    """
+
+    def assert_valid_subset(self, subset, candidate_lists, subset_size_list,
+                            min_distance, length, previous_list):
+        self.assertEqual(len(subset), sum(subset_size_list))
+        self.assertFalse(
+            Counter(subset) - Counter(itertools.chain(*candidate_lists)))
+        self.assertTrue(
+            is_compatible(subset, min_distance, length, previous_list))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        found = 0
+        for _ in range(300):
+            length = rng.randint(3, 5)
+            min_distance = rng.randint(1, 3)
+            candidate_lists = [
+                random_sequences(rng, rng.randint(1, 7), length)
+                for _ in range(rng.randint(1, 3))]
+            subset_size_list = [
+                rng.randint(1, min(3, len(candidates)))
+                for candidates in candidate_lists]
+            previous_list = random_sequences(rng, rng.randint(0, 2), length)
+
+            expected = any(
+                is_compatible(subset, min_distance, length, previous_list)
+                for subset in brute_force_subsets(
+                    candidate_lists, subset_size_list))
+            search = CompatibleSubsetSearch(
+                candidate_lists, subset_size_list, length,
+                min_distance=min_distance, previous_list=previous_list,
+                timeout=60)
+            subset = search.run()
+
+            self.assertEqual(bool(subset), expected)
+            self.assertFalse(search.timed_out)
+            if subset:
+                found += 1
+                self.assert_valid_subset(
+                    subset, candidate_lists, subset_size_list, min_distance,
+                    length, previous_list)
+            else:
+                self.assertTrue(search.infeasible)
+        # Both outcomes are covered
+        self.assertTrue(0 < found < 300)
+
+
+class FindCompatibleSubsetTests(TestCase):
+
+    def test_searches_stored_index_sets(self):
+        rng = random.Random(2)
+        candidate_lists = [
+            random_sequences(rng, 8, 6), random_sequences(rng, 6, (6, 8))]
+        index_sets = [
+            create_index_set('Set {}'.format(number), candidates)
+            for number, candidates in enumerate(candidate_lists)]
+        previous_list = random_sequences(rng, 2, 6)
+
+        for subset_size_list in [[2, 1], [3, 3], [8, 6]]:
+            expected = any(
+                is_compatible(subset, 3, 6, previous_list)
+                for subset in brute_force_subsets(
+                    candidate_lists, subset_size_list))
+            subset = find_compatible_subset(
+                index_sets, subset_size_list, min_length=float('inf'),
+                min_distance=3, previous_list=previous_list)
+            self.assertEqual(bool(subset), expected)
+            if subset:
+                self.assertEqual(len(subset), sum(subset_size_list))
+                self.assertTrue(is_compatible(subset, 3, 6, previous_list))
+
+
+class DualIndexTests(SimpleTestCase):
+    """
+    Dual-indexed pairs are compared with separate index 1 and index 2
+    minimum distances and lengths, both when checking a list and when
+    searching for a subset.
+    """
+
+    def setUp(self):
+        self.rng = random.Random(4)
+
+    def test_thresholds_match_rules(self):
+        for rule in ['both', 'either', 'sum']:
+            for min_distance, min_distance_2 in itertools.product(
+                    range(5), repeat=2):
+                thresholds = dual_index_thresholds(
+                    min_distance, min_distance_2, rule)
+                for distance, distance_2 in itertools.product(
+                        range(8), repeat=2):
+                    threshold = thresholds[min(distance, min_distance)]
+                    self.assertEqual(
+                        threshold < 0 or distance_2 < threshold,
+                        dual_distances_incompatible(
+                            distance, distance_2, min_distance,
+                            min_distance_2, rule))
+
+    def test_incompatible_pairs_match_brute_force(self):
+        for rule in ['both', 'either', 'sum']:
+            index_list = random_sequences(self.rng, 40, (4, 6))
+            index_list_2 = random_sequences(self.rng, 40, (5, 7))
+            for min_distance, min_distance_2, length, length_2 in [
+                    (2, 2, None, None), (3, 1, 4, 5), (1, 3, 3, None)]:
+                pairs = find_incompatible_dual_index_pairs(
+                    index_list, index_list_2, min_distance, min_distance_2,
+                    index_length=length, index_length_2=length_2, rule=rule)
+                length = length or min(len(s) for s in index_list)
+                length_2 = length_2 or min(len(s) for s in index_list_2)
+                expected = [
+                    (i, j) for i, j in itertools.combinations(range(40), 2)
+                    if dual_incompatible(
+                        (index_list[i], index_list_2[i]),
+                        (index_list[j], index_list_2[j]),
+                        min_distance, min_distance_2, rule, length, length_2)]
+                self.assertEqual(
+                    [pair['positions'] for pair in pairs], expected)
+                for pair in pairs:
+                    i, j = pair['positions']
+                    self.assertEqual(pair['distances'], (
+                        hamming_distance(
+                            index_list[i][:length], index_list[j][:length]),
+                        hamming_distance(
+                            index_list_2[i][:length_2],
+                            index_list_2[j][:length_2])))
+
+    def test_search_matches_brute_force(self):
+        found = 0
+        for _ in range(300):
+            rule = self.rng.choice(['both', 'either', 'sum'])
+            min_distance = self.rng.randint(1, 3)
+            min_distance_2 = self.rng.randint(1, 3)
+            length, length_2 = self.rng.choice([(4, 4), (3, 5), (5, 3)])
+            groups = []
+            candidate_lists = []
+            for _ in range(self.rng.randint(1, 2)):
+                paired = self.rng.random() < 0.5
+                size = self.rng.randint(1, 4)
+                index_list = random_sequences(self.rng, size, length)
+                index_list_2 = random_sequences(
+                    self.rng, size if paired else self.rng.randint(1, 4),
+                    length_2)
+                groups.append((index_list, index_list_2, paired))
+                if paired:
+                    candidate_lists.append(list(zip(index_list, index_list_2)))
+                else:
+                    candidate_lists.append(
+                        list(itertools.product(index_list, index_list_2)))
+            subset_size_list = [
+                self.rng.randint(1, min(3, len(candidates)))
+                for candidates in candidate_lists]
+            previous_list = [
+                (random_sequences(self.rng, 1, length)[0],
+                 random_sequences(self.rng, 1, length_2)[0])
+                for _ in range(self.rng.randint(0, 1))]
+            parameters = (
+                min_distance, min_distance_2, rule, length, length_2,
+                previous_list)
+
+            expected = any(
+                is_dual_compatible(subset, *parameters)
+                for subset in brute_force_subsets(
+                    candidate_lists, subset_size_list))
+            search = DualIndexSubsetSearch(
+                groups, subset_size_list, length, length_2,
+                min_distance=min_distance, min_distance_2=min_distance_2,
+                rule=rule, previous_list=previous_list, timeout=60)
+            subset = search.run()
+
+            self.assertEqual(bool(subset), expected)
+            self.assertFalse(search.timed_out)
+            if subset:
+                found += 1
+                subset = [tuple(pair.split(',')) for pair in subset]
+                self.assertEqual(len(subset), sum(subset_size_list))
+                self.assertFalse(
+                    Counter(subset) - Counter(itertools.chain(
+                        *candidate_lists)))
+                self.assertTrue(is_dual_compatible(subset, *parameters))
+        self.assertTrue(0 < found < 300)
+
+
+class FindCompatibleDualIndexSubsetTests(TestCase):
+
+    def test_searches_stored_index_set_pairs(self):
+        rng = random.Random(5)
+        names = ['Index {}'.format(number) for number in range(1, 5)]
+        index_list = random_sequences(rng, 4, 6)
+        index_list_2 = random_sequences(rng, 4, 8)
+        index_set = create_index_set('i7', index_list, names)
+        # Reversed so that pairing goes by name rather than by position
+        index_set_2 = create_index_set(
+            'i5', index_list_2[::-1], names[::-1])
+        previous_list = ['{},{}'.format(
+            random_sequences(rng, 1, 6)[0], random_sequences(rng, 1, 8)[0])]
+
+        outcomes = set()
+        for pairing, rule, subset_size in itertools.product(
+                ['paired', 'combinatorial'], ['both', 'either', 'sum'],
+                [2, 3, 4]):
+            if pairing == 'paired':
+                candidates = list(zip(index_list, index_list_2))
+            else:
+                candidates = list(itertools.product(index_list, index_list_2))
+            parameters = (
+                4, 3, rule, 6, 8,
+                [pair.split(',') for pair in previous_list])
+            expected = any(
+                is_dual_compatible(subset, *parameters)
+                for subset in itertools.combinations(candidates, subset_size))
+            dual = dual_search_parameters(
+                [index_set], [index_set_2], float('inf'), pairing=pairing,
+                min_distance_2=3, rule=rule)
+            subset = find_compatible_subset(
+                [index_set], [subset_size], min_length=float('inf'),
+                min_distance=4, previous_list=previous_list, dual=dual)
+
+            self.assertEqual(bool(subset), expected, (pairing, rule))
+            outcomes.add(expected)
+            if subset:
+                subset = [tuple(pair.split(',')) for pair in subset]
+                self.assertEqual(len(subset), subset_size)
+                self.assertTrue(set(subset) <= set(candidates))
+                self.assertTrue(is_dual_compatible(subset, *parameters))
+        self.assertEqual(outcomes, {False, True})
+
+
+class MaximumCompatibleSubsetSearchTests(SimpleTestCase):
+    """
+    Maximize mode finds a compatible subset as large as the largest one
+    found by enumerating every subset, and proves it is the largest.
+    """
+
+    def test_matches_brute_force(self):
+        rng = random.Random(6)
+        for _ in range(300):
+            length = rng.randint(3, 5)
+            min_distance = rng.randint(1, 3)
+            candidate_lists = [
+                random_sequences(rng, rng.randint(0, 5), length)
+                for _ in range(rng.randint(1, 3))]
+            previous_list = random_sequences(rng, rng.randint(0, 2), length)
+            candidates = list(itertools.chain(*candidate_lists))
+
+            expected = brute_force_maximum(
+                candidates, min_distance, length, previous_list)
+            search = MaximumCompatibleSubsetSearch(
+                candidate_lists, length, min_distance=min_distance,
+                previous_list=previous_list, timeout=60)
+            subset = search.run()
+
+            self.assertEqual(len(subset), expected)
+            self.assertTrue(search.optimal)
+            self.assertFalse(search.incomplete)
+            self.assertEqual(search.upper_bound, expected)
+            self.assertFalse(Counter(subset) - Counter(candidates))
+            self.assertTrue(
+                is_compatible(subset, min_distance, length, previous_list))
+
+    def test_timeout_keeps_best_subset(self):
+        rng = random.Random(7)
+        candidate_lists = [random_sequences(rng, 200, 8)]
+        search = MaximumCompatibleSubsetSearch(
+            candidate_lists, 8, min_distance=5, timeout=0)
+        search.check_interval = 1
+        subset = search.run()
+
+        self.assertTrue(search.timed_out)
+        self.assertTrue(search.incomplete)
+        self.assertFalse(search.optimal)
+        self.assertGreater(search.upper_bound, len(subset))
+        self.assertTrue(is_compatible(subset, 5, 8))
+
+
+class FindMaximumCompatibleSubsetTests(TestCase):
+
+    def test_searches_stored_index_sets(self):
+        rng = random.Random(8)
+        candidate_lists = [
+            random_sequences(rng, 7, 6), random_sequences(rng, 5, (6, 8))]
+        index_sets = [
+            create_index_set('Set {}'.format(number), candidates)
+            for number, candidates in enumerate(candidate_lists)]
+        previous_list = random_sequences(rng, 1, 6)
+
+        expected = brute_force_maximum(
+            list(itertools.chain(*candidate_lists)), 3, 6, previous_list)
+        # Subset sizes are ignored
+        subset = find_compatible_subset(
+            index_sets, [1, 1], min_length=float('inf'), min_distance=3,
+            previous_list=previous_list, maximize=True)
+
+        self.assertEqual(len(subset), expected)
+        self.assertTrue(is_compatible(subset, 3, 6, previous_list))
+        self.assertEqual(find_compatible_subset.upper_bound, expected)
+        self.assertFalse(find_compatible_subset.incomplete)
+
+
+class ColorBalanceTests(SimpleTestCase):
+    """
+    Color-balanced searches find a subset giving a signal in every channel
+    at every cycle exactly when one exists, or the subset whose weakest
+    channel is strongest.
+    """
+
+    def search(self, candidate_lists, subset_size_list, length, min_distance,
+               previous_list, chemistry, mode, **kwargs):
+        return CompatibleSubsetSearch(
+            candidate_lists, subset_size_list, length,
+            min_distance=min_distance, previous_list=previous_list,
+            color_balance={'chemistry': chemistry, 'mode': mode}, **kwargs)
+
+    def test_matches_brute_force(self):
+        rng = random.Random(9)
+        outcomes = set()
+        for _ in range(300):
+            length = rng.randint(2, 4)
+            min_distance = rng.randint(1, 2)
+            # Extra Gs make unbalanced pools more likely
+            candidate_lists = [
+                random_sequences(rng, rng.randint(1, 6), length, 'ACGTG')
+                for _ in range(rng.randint(1, 2))]
+            subset_size_list = [
+                rng.randint(1, min(3, len(candidates)))
+                for candidates in candidate_lists]
+            previous_list = random_sequences(
+                rng, rng.randint(0, 1), length, 'ACGTG')
+            chemistry = rng.choice(['two_channel', 'four_channel'])
+            parameters = (
+                candidate_lists, subset_size_list, length, min_distance,
+                previous_list, chemistry)
+
+            expected = brute_force_balance(
+                candidate_lists, subset_size_list, min_distance, length,
+                previous_list, chemistry)
+            outcomes.add(expected and min(expected, 2))
+            for mode in ['enforce', 'optimize']:
+                search = self.search(*parameters, mode=mode, timeout=60)
+                subset = search.run()
+                self.assertFalse(search.incomplete)
+                if expected is None or mode == 'enforce' and expected == 0:
+                    self.assertEqual(subset, [])
+                    self.assertTrue(search.infeasible)
+                    continue
+
+                self.assertEqual(len(subset), sum(subset_size_list))
+                self.assertTrue(is_compatible(
+                    subset, min_distance, length, previous_list))
+                balance = channel_signal(
+                    previous_list + subset, chemistry, length).min()
+                if mode == 'enforce':
+                    self.assertGreater(balance, 0)
+                else:
+                    self.assertEqual(balance, expected)
+        # No compatible subset, no balanced subset, and balances above one
+        # are all covered
+        self.assertEqual(set(outcomes), {None, 0, 1, 2})
+
+    def test_timed_out_optimization_is_incomplete(self):
+        rng = random.Random(10)
+        candidate_lists = [random_sequences(rng, 40, 8)]
+        search = self.search(
+            candidate_lists, [6], 8, 3, [], 'two_channel', 'optimize',
+            timeout=60)
+        search.check_interval = 1
+        record_complete = search.record_complete
+
+        def time_out_after_first_subset(chosen):
+            record_complete(chosen)
+            search.timeout = 0
+            return False
+
+        search.record_complete = time_out_after_first_subset
+        subset = search.run()
+
+        self.assertTrue(search.timed_out)
+        self.assertTrue(search.incomplete)
+        self.assertFalse(search.infeasible)
+        self.assertEqual(len(subset), 6)
+        self.assertTrue(is_compatible(subset, 3, 8))
+
+
+class FindColorBalancedSubsetTests(TestCase):
+
+    fixtures = ['truseq']
+
+    def test_searches_stored_index_sets(self):
+        rng = random.Random(11)
+        candidates = random_sequences(rng, 8, 4, 'ACGTG')
+        index_set = create_index_set('Set', candidates)
+        outcomes = set()
+        for subset_size, chemistry in itertools.product(
+                [1, 2, 3, 4], ['two_channel', 'four_channel']):
+            expected = brute_force_balance(
+                [candidates], [subset_size], 2, 4, [], chemistry)
+            subset = find_compatible_subset(
+                [index_set], [subset_size], min_length=float('inf'),
+                min_distance=2,
+                color_balance={'chemistry': chemistry, 'mode': 'enforce'})
+
+            self.assertEqual(bool(subset), bool(expected))
+            outcomes.add(bool(expected))
+            if subset:
+                self.assertEqual(len(subset), subset_size)
+                self.assertTrue(is_compatible(subset, 2, 4))
+                self.assertGreater(channel_signal(subset, chemistry).min(), 0)
+        self.assertEqual(outcomes, {False, True})
+
+    def test_optimization_finishes(self):
+        index_set = IndexSet.objects.get(name='TruSeq')
+        for subset_size, chemistry in itertools.product(
+                [6, 10, 14], ['two_channel', 'four_channel']):
+            subset = find_compatible_subset(
+                [index_set], [subset_size], min_length=float('inf'),
+                color_balance={'chemistry': chemistry, 'mode': 'optimize'})
+            self.assertEqual(len(subset), subset_size)
+            self.assertFalse(find_compatible_subset.timed_out)
+            self.assertFalse(find_compatible_subset.incomplete)
+
+
+class InteractiveAdjacencyTests(TestCase):
+
+    def setUp(self):
+        self.index_set = create_index_set('Set', ['ACGTAC', 'ACGTAA', 'TTTTTT'])
+        self.other_set = create_index_set('Other', ['ACGTAG', 'ACGTACGT'])
+
+    def get(self, **params):
+        return self.client.get(
+            reverse('compatible_index_sequences:interactive_adjacency'), params)
+
+    def neighbors(self, **params):
+        response = self.get(**params)
+        self.assertEqual(response.status_code, 200)
+        ids = dict(Index.objects.values_list('id', 'sequence'))
+        return {
+            ids[int(index_id)]: sorted(ids[n] for n in neighbors)
+            for index_id, neighbors in response.json()['neighbors'].items()}
+
+    def test_only_shown_index_sets(self):
+        self.assertEqual(
+            self.neighbors(
+                distance=2, length=6, index_sets=str(self.index_set.pk)),
+            {'ACGTAC': ['ACGTAA'], 'ACGTAA': ['ACGTAC']})
+        self.assertEqual(
+            self.neighbors(distance=2, length=6, index_sets='{},{}'.format(
+                self.index_set.pk, self.other_set.pk)),
+            {'ACGTAC': ['ACGTAA', 'ACGTACGT', 'ACGTAG'],
+             'ACGTAA': ['ACGTAC', 'ACGTACGT', 'ACGTAG'],
+             'ACGTAG': ['ACGTAA', 'ACGTAC', 'ACGTACGT'],
+             'ACGTACGT': ['ACGTAA', 'ACGTAC', 'ACGTAG']})
+
+    def test_length_is_limited_to_longest_index(self):
+        response = self.get(
+            distance=2, length=100, index_sets=str(self.index_set.pk))
+        self.assertEqual(response.json()['length'], 6)
+
+    def test_rejects_unbounded_parameters(self):
+        index_sets = str(self.index_set.pk)
+        for params in [
+                {'distance': 2, 'length': 6},
+                {'distance': 'x', 'length': 6, 'index_sets': index_sets},
+                {'distance': -1, 'length': 6, 'index_sets': index_sets},
+                {'distance': 7, 'length': 6, 'index_sets': index_sets},
+                # Beyond the longest index of the set
+                {'distance': 8, 'length': 10, 'index_sets': index_sets}]:
+            self.assertEqual(self.get(**params).status_code, 400, params)
+
+
+class IndexSetStatisticsTests(TestCase):
+    """
+    Index set statistics are kept current as indexes change, and read
+    without loading the set's indexes.
+    """
+
+    def test_signals_update_statistics(self):
+        index_set = create_index_set('Set', ['ACGTAC', 'ACGTACGT'])
+        self.assertEqual(
+            (index_set.index_count, index_set.min_index_length,
+             index_set.max_index_length), (2, 6, 8))
+
+        Index.objects.create(index_set=index_set, name='3', sequence='TGCA')
+        index = index_set.index_set.get(sequence='ACGTACGT')
+        index.sequence = 'TTTTTTTTTT'
+        index.save()
+        index_set.refresh_from_db()
+        self.assertEqual(
+            (index_set.index_count, index_set.min_index_length,
+             index_set.max_index_length), (3, 4, 10))
+        self.assertEqual(index_set.self_min_distance(), 3)
+
+        index_set.index_set.all().delete()
+        index_set.refresh_from_db()
+        self.assertEqual(
+            (index_set.index_count, index_set.min_index_length,
+             index_set.max_index_length), (0, None, None))
+
+    def test_missing_statistics_are_recomputed(self):
+        index_set = create_index_set('Set', ['ACGTAC', 'ACGTACGT'])
+        IndexSet.objects.filter(pk=index_set.pk).update(
+            index_count=0, min_index_length=None, max_index_length=None)
+        index_set.refresh_from_db()
+        self.assertEqual(index_set.min_length(), 6)
+        self.assertEqual(index_set.index_count, 2)
+
+    def test_sets_without_indexes(self):
+        index_set = create_index_set('Set', ['ACGTAC'])
+        empty = create_index_set('Empty', [])
+        with self.assertRaises(ValueError):
+            empty.min_length()
+        self.assertEqual(
+            utils.minimum_index_length_from_sets([None, empty, index_set]), 6)
+        self.assertEqual(
+            utils.minimum_index_length_from_sets([None, empty]), float('inf'))
+        self.assertEqual(
+            utils.optimize_set_order(None, empty, index_set), [2, 1, 0])
+        self.assertIsNone(find_compatible_subset(
+            [empty], [1], min_length=float('inf'), maximize=True))
+
+        form = AutoIndexListForm(data={
+            'config_distance': 3, 'index_set_1': empty.pk, 'maximize': True,
+            'index_list': ''})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(
+            form.non_field_errors(), ['Index set Empty has no indexes.'])
+
+
+class SearchCacheTests(TestCase):
+
+    def setUp(self):
+        caches[SEARCH_CACHE].clear()
+        rng = random.Random(12)
+        self.index_set = create_index_set('Set', random_sequences(rng, 30, 8))
+
+    def search(self, **kwargs):
+        return find_compatible_subset(
+            [self.index_set], [10], min_length=float('inf'), timeout=0,
+            use_cache=True, **kwargs)
+
+    @mock.patch.object(CompatibleSubsetSearch, 'check_interval', 1)
+    def test_anytime_searches_are_cached_separately(self):
+        self.assertEqual(self.search(), [])
+        self.assertTrue(find_compatible_subset.timed_out)
+
+        # Not the empty result of the search that was not anytime
+        partial = self.search(anytime=True)
+        self.assertTrue(partial)
+        self.assertTrue(find_compatible_subset.incomplete)
+
+        with mock.patch.object(CompatibleSubsetSearch, 'run') as run:
+            self.assertEqual(self.search(anytime=True), partial)
+            self.assertEqual(self.search(), [])
+        self.assertFalse(run.called)
+
+
+class SearchJobTests(TestCase):
+
+    def setUp(self):
+        self.index_set = create_index_set(
+            'Set', ['ACGTAC', 'ACGTAA', 'TTTTTT', 'GGGCCC'])
+
+    def status(self, job):
+        response = self.client.get(reverse(
+            'compatible_index_sequences:auto_job_status', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_worker_runs_queued_job(self):
+        job = create_search_job(
+            [self.index_set, None], [3, None], min_length=6, min_distance=3,
+            custom_list=[], timeout=10, samplesheet_index_set=None,
+            initial={})
+        status = self.status(job)
+        self.assertEqual(
+            (status['status'], status['finished'], status['target_size']),
+            ('pending', False, 3))
+
+        stdout = StringIO()
+        call_command('run_search_worker', once=True, stdout=stdout)
+        self.assertIn('Search job {} done'.format(job.pk), stdout.getvalue())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertIsNotNone(job.finished)
+        result = job.get_result()
+        self.assertEqual(len(result), 3)
+        self.assertTrue(is_compatible(result, 3, 6))
+        status = self.status(job)
+        self.assertEqual(
+            (status['status'], status['finished'], status['result']),
+            ('done', True, result))
+
+        # Nothing is left for the worker to claim
+        stdout = StringIO()
+        call_command('run_search_worker', once=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_unknown_jobs(self):
+        response = self.client.get(reverse(
+            'compatible_index_sequences:auto_job_status', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse('compatible_index_sequences:auto') + 'not-a-job/status/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(SearchJob.objects.exists())
+
+
+class IndexSetDistanceMatrixTests(TestCase):
+
+    def setUp(self):
+        self.index_set = create_index_set('Set', ['ACGTAC', 'ACGTAA'])
+        self.other_set = create_index_set('Other', ['TTGTAC', 'ACGTACGT'])
+
+    def distances(self, index_set_1, index_set_2):
+        indexes_1, indexes_2, distances = (
+            IndexSetDistanceMatrix.objects.get_distances(
+                index_set_1, index_set_2))
+        self.assertEqual(distances.tolist(), [
+            [hamming_distance(a.sequence[:6], b.sequence[:6])
+             for b in indexes_2] for a in indexes_1])
+        return distances.tolist()
+
+    def test_matrices_are_stored(self):
+        self.assertEqual(
+            self.distances(self.index_set, self.other_set), [[2, 0], [3, 1]])
+        self.assertEqual(IndexSetDistanceMatrix.objects.count(), 1)
+        # The stored matrix is reused, in either order
+        with mock.patch('compatible_index_sequences.models.hamming_distance_matrix') as compute:
+            self.assertEqual(
+                self.distances(self.other_set, self.index_set),
+                [[2, 3], [0, 1]])
+        self.assertFalse(compute.called)
+
+    def test_saving_an_index_invalidates_matrices(self):
+        self.distances(self.index_set, self.other_set)
+        self.distances(self.index_set, self.index_set)
+        self.assertEqual(IndexSetDistanceMatrix.objects.count(), 2)
+
+        index = self.other_set.index_set.get(sequence='ACGTACGT')
+        index.sequence = 'ACGTAAGT'
+        index.save()
+        self.assertEqual(
+            list(IndexSetDistanceMatrix.objects.values_list(
+                'index_set_1', 'index_set_2')),
+            [(self.index_set.pk, self.index_set.pk)])
+        self.assertEqual(
+            self.distances(self.index_set, self.other_set), [[2, 1], [3, 0]])
+
+
+class BatchTests(TestCase):
+
+    def setUp(self):
+        caches[SEARCH_CACHE].clear()
+        self.index_set = create_index_set(
+            'Set', ['TTTTTT', 'GGGCCC', 'ACGTAA'])
+
+    def post(self, body):
+        return self.client.post(
+            reverse('compatible_index_sequences:api_batch'), body,
+            content_type='application/json')
+
+    def check(self, data):
+        response = self.post(json.dumps(data))
+        self.assertEqual(response.status_code, 200)
+        return {pool['id']: pool for pool in response.json()['pools']}
+
+    def test_errors_are_reported_for_each_pool(self):
+        auto = {'index_sets': [{'index_set': 'Set', 'size': 2}]}
+        pools = self.check({'pools': [
+            {'id': 'good', 'indexes': ['ACGTAC', 'CAGTCA'], 'auto': auto},
+            {'id': 'clash', 'indexes': ['ACGTAC', 'ACGTAG'], 'auto': auto},
+            {'id': 'dna', 'indexes': ['ACGTAC', 'ACGXAC']},
+            {'id': 'length', 'indexes': ['ACGTAC'], 'length': 0},
+            {'id': 'unknown', 'indexes': ['ACGTAC'],
+             'auto': {'index_sets': [{'index_set': 'Missing', 'size': 1}]}},
+            {'id': 'size', 'indexes': ['ACGTAC'],
+             'auto': {'index_sets': [{'index_set': 'Set', 'size': 4}]}},
+            {'id': 'mixed', 'indexes': ['ACGTAC,TTTTTT', 'CAGTCA']}]})
+
+        self.assertTrue(pools['good']['compatible'])
+        suggested = pools['good']['suggested']['indexes']
+        self.assertEqual(len(suggested), 2)
+        self.assertTrue(is_compatible(
+            ['ACGTAC', 'CAGTCA'] + suggested, 3, 6))
+
+        self.assertFalse(pools['clash']['compatible'])
+        self.assertEqual(pools['clash']['incompatible_pairs'], [{
+            'positions': [0, 1], 'indexes': ['ACGTAC', 'ACGTAG'],
+            'distance': 1}])
+        self.assertEqual(
+            pools['clash']['suggested'],
+            {'error': 'The pool is not compatible with itself.'})
+
+        self.assertEqual(pools['dna'], {
+            'id': 'dna', 'error': 'Not a valid DNA sequence: ACGXAC'})
+        self.assertEqual(pools['length'], {
+            'id': 'length', 'error': 'length must be an integer of at least 1.'})
+        self.assertEqual(pools['unknown'], {
+            'id': 'unknown', 'error': 'Unknown index set: Missing'})
+        self.assertEqual(pools['size'], {
+            'id': 'size', 'error': 'Invalid number of indexes to use from Set.'})
+        self.assertEqual(pools['mixed'], {
+            'id': 'mixed',
+            'error': 'Indexes are a mix of single-indexing and dual-indexing.'})
+
+    @mock.patch('compatible_index_sequences.batch.BATCH_SEARCH_TIME', 0)
+    def test_out_of_time(self):
+        pools = self.check({'pools': [{
+            'indexes': ['ACGTAC'],
+            'auto': {'index_sets': [{'index_set': 'Set', 'size': 1}]}}]})
+        self.assertEqual(
+            pools[0]['suggested'],
+            {'error': 'The batch ran out of time to search for subsets.'})
+
+    def test_invalid_batches(self):
+        for body in ['[', json.dumps({'pools': 'ACGTAC'})]:
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class ValidateSamplesheetsTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.write('SampleSheet1.csv', [
+            '[Data]', 'Sample_ID,Sample_Name,index', 'a,,ACGTAC', 'b,,TTGGCA'])
+        self.write('SampleSheet2.csv', [
+            '[Data]', 'Sample_ID,Sample_Name,index', 'a,,ACGTAC', 'b,,ACGTAG'])
+        self.write('SampleSheet3.csv', [
+            '[Data]', 'Sample_ID,Sample_Name,index', 'a,,ACGTAC', 'b,,ACGNAG'])
+        self.write('Notes.csv', ['[Data]'])
+
+    def write(self, name, lines):
+        with open(os.path.join(self.directory, name), 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def validate(self, **options):
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command(
+            'validate_samplesheets', self.directory, processes=1,
+            stdout=stdout, stderr=stderr, **options)
+        self.assertEqual(
+            stderr.getvalue(),
+            'Checked 3 sample sheet(s): 1 compatible, 1 incompatible, '
+            '1 not checked.\n')
+        return stdout.getvalue()
+
+    def test_json_lines(self):
+        reports = [json.loads(line) for line in self.validate().splitlines()]
+        self.assertEqual(
+            [(os.path.basename(report['samplesheet']), report['status'])
+             for report in reports],
+            [('SampleSheet1.csv', 'compatible'),
+             ('SampleSheet2.csv', 'incompatible'),
+             ('SampleSheet3.csv', 'error')])
+        self.assertEqual(reports[0]['conflicts'], [])
+        self.assertEqual(reports[1]['conflicts'], [{
+            'samples': ['a', 'b'], 'indexes': ['ACGTAC', 'ACGTAG'],
+            'distance': 1}])
+        self.assertEqual(
+            reports[2]['error'],
+            'Indexes must be composed of valid bases (e.g., ACGT).')
+
+    def test_csv(self):
+        output = os.path.join(self.directory, 'report.csv')
+        self.assertEqual(self.validate(format='csv', output=output), '')
+        with open(output, newline='') as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(
+            [(os.path.basename(row['samplesheet']), row['status'],
+              row['sample_1'], row['sample_2'], row['distance'])
+             for row in rows],
+            [('SampleSheet1.csv', 'compatible', '', '', ''),
+             ('SampleSheet2.csv', 'incompatible', 'a', 'b', '1'),
+             ('SampleSheet3.csv', 'error', '', '', '')])
+
+
+class ImportIndexSetsTests(TestCase):
+
+    fixture_paths = sorted(glob.glob(
+        os.path.join(os.path.dirname(__file__), 'fixtures', '*.json')))
+
+    def import_index_sets(self, *paths, **options):
+        stdout = StringIO()
+        call_command('import_index_sets', *paths, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_imports_are_idempotent(self):
+        self.assertEqual(
+            self.import_index_sets(*self.fixture_paths),
+            'Imported 5 new index sets; 240 new, 0 changed and 0 unchanged '
+            'indexes.\n')
+        self.assertEqual(Index.objects.count(), 240)
+        self.assertEqual(
+            self.import_index_sets(*self.fixture_paths),
+            'Imported 0 new index sets; 0 new, 0 changed and 240 unchanged '
+            'indexes.\n')
+        self.assertEqual(Index.objects.count(), 240)
+        for index_set in IndexSet.objects.all():
+            self.assertEqual(
+                index_set.index_count, index_set.index_set.count())
+
+    def test_changed_sequences(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'catalog.csv')
+        with open(path, 'w') as file:
+            file.write('index_set,name,sequence\nSet,1,ACGTAC\nSet,2,ttggca\n')
+        self.import_index_sets(path)
+        with open(path, 'w') as file:
+            file.write('index_set,name,sequence\nSet,1,ACGTAC\nSet,2,TTGGCC\n'
+                       'Set,3,GGGCCC\n')
+
+        self.assertEqual(
+            self.import_index_sets(path, dry_run=True),
+            'Would import 0 new index sets; 1 new, 1 changed and 1 unchanged '
+            'indexes.\n')
+        self.assertEqual(
+            list(Index.objects.order_by('name').values_list('sequence', flat=True)),
+            ['ACGTAC', 'TTGGCA'])
+
+        self.import_index_sets(path)
+        self.assertEqual(
+            list(Index.objects.order_by('name').values_list(
+                'sequence', 'reverse_complement')),
+            [('ACGTAC', 'GTACGT'), ('TTGGCC', 'GGCCAA'), ('GGGCCC', 'GGGCCC')])
+        self.assertEqual(IndexSet.objects.get().index_count, 3)
+
+
+class NormalizedSequenceTests(TestCase):
+
+    def setUp(self):
+        self.index_set = create_index_set(
+            'Set', ['acgtaa', 'TTGGCA'], index_names=['1', '2'])
+
+    def stored(self):
+        return list(Index.objects.values_list('sequence', 'reverse_complement'))
+
+    def test_sequences_are_normalized_when_saved(self):
+        self.assertEqual(
+            self.stored(), [('ACGTAA', 'TTACGT'), ('TTGGCA', 'TGCCAA')])
+
+    def test_normalize_index_sequences(self):
+        # Rows stored before the columns were normalized
+        Index.objects.filter(name='1').update(
+            sequence='acgtaa', reverse_complement='')
+        Index.objects.filter(name='2').update(reverse_complement='')
+
+        stdout = StringIO()
+        call_command('normalize_index_sequences', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Normalized 2 indexes.\n')
+        self.assertEqual(
+            self.stored(), [('ACGTAA', 'TTACGT'), ('TTGGCA', 'TGCCAA')])
+
+        stdout = StringIO()
+        call_command('normalize_index_sequences', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Normalized 0 indexes.\n')
+
+    def test_lookup_in_either_orientation(self):
+        catalog = get_index_catalog()
+        index = Index.objects.get(sequence='ACGTAA')
+        self.assertEqual(catalog.lookup('acgtaa'), [index])
+        self.assertEqual(catalog.lookup('TTACGT'), [])
+        self.assertEqual(
+            catalog.lookup('ttacgt', include_reverse_complement=True), [index])
@@ -1,15 +1,30 @@
 from django.conf.urls import url
 
 from .views import (
-    IndexSetDetailView, InteractiveView, auto, custom,
-    export_samplesheet, select_mode)
+    IndexSetDetailView, InteractiveView, api_batch, auto, auto_job, auto_job_status,
+    custom, export_samplesheet, index_set_compatibility,
+    interactive_adjacency, metrics, select_mode, sequence_logo)
 
 
+# Search jobs are identified by UUIDs, so anything else is not a job
+UUID_PATTERN = (
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
 urlpatterns = [
     url(r'^$', select_mode, name='select_mode'),
+    url(r'^api/batch/$', api_batch, name='api_batch'),
     url(r'^auto/$', auto, name='auto'),
+    url(r'^auto/(?P<pk>{})/$'.format(UUID_PATTERN), auto_job,
+        name='auto_job'),
+    url(r'^auto/(?P<pk>{})/status/$'.format(UUID_PATTERN), auto_job_status,
+        name='auto_job_status'),
     url(r'^custom/$', custom, name='custom'),
     url(r'^export_samplesheet/$', export_samplesheet, name='export_samplesheet'),
     url(r'^index_set/(?P<pk>\d+)/$', IndexSetDetailView.as_view(), name='index_set_detail'),
+    url(r'^index_set/compatibility/$', index_set_compatibility, name='index_set_compatibility'),
     url(r'^interactive/$', InteractiveView.as_view(), name='interactive'),
+    url(r'^interactive/adjacency/$', interactive_adjacency, name='interactive_adjacency'),
+    url(r'^logo/(?P<key>[\w.:-]+)/(?P<unit>bit|probability)/$',
+        sequence_logo, name='sequence_logo'),
+    url(r'^metrics/$', metrics, name='metrics'),
 ]
@@ -1,71 +1,176 @@
 import base64
 import codecs
 import csv
-import itertools
 import time
-from collections import deque, OrderedDict
-
-from weblogolib import (
-    Alphabet, ColorScheme, LogoData, LogoFormat, LogoOptions, Seq, SeqList, SymbolColor,
-    png_formatter)
-
-
-def find_compatible_subset(index_set_list, subset_size_list, min_length,
-                           min_distance=3, previous_list=[], timeout=10,
-                           start_time=None):
-
-    find_compatible_subset.timed_out = False
-
-    if start_time is None:
-        start_time = time.time()
-    compatible_subset = []
-
-    index_set_list = deque(index_set_list)
-    subset_size_list = deque(subset_size_list)
-
-    try:
-        index_set = index_set_list.popleft()
-        current_list = [i.sequence for i in index_set.index_set.all()]
-    except:
-        return None
-
-    index_list = remove_incompatible_indexes_from_queryset(
-        current_list, previous_list, length=min_length)
-    subset_size = subset_size_list.popleft()
-
-    if len(index_list) < subset_size:
-        return []
-
-    self_compatible_list = is_self_compatible(index_list, min_distance,
-                                              min_length)
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Each base is packed into 2 bits, 32 bases per 64-bit word
+BASE_CODES = np.zeros(256, dtype=np.uint64)
+for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for base in bases:
+        BASE_CODES[ord(base)] = code
+BASES_PER_WORD = 32
+LOW_BITS = np.uint64(0x5555555555555555)
+
+# Upper bound on the number of words compared in one vectorized block
+BLOCK_SIZE = 2 ** 22
+
+# How the distances between both indexes of dual-indexed pairs are combined
+DUAL_INDEX_RULE_CHOICES = [
+    ('both', 'Both indexes closer than their minimum distances'),
+    ('either', 'Either index closer than its minimum distance'),
+    ('sum', 'Combined distance closer than the index 1 minimum distance'),
+]
+
+INDEX_PAIRING_CHOICES = [
+    ('combinatorial', 'Any index 1 with any index 2'),
+    ('paired', 'Index 1 and index 2 with the same name (unique dual indexes)'),
+]
+
+# Bases that give a signal in each channel at every sequencing cycle. Index
+# reads need a signal in every channel at every cycle (and ideally an even
+# share) for the instrument to register and call its clusters.
+COLOR_CHANNELS = {
+    'two_channel': ['AC', 'AT'],
+    'four_channel': ['AC', 'GT'],
+}
+
+COLOR_BALANCE_CHOICES = [
+    ('', 'Ignore color balance'),
+    ('two_channel', '2-channel (e.g., NextSeq, NovaSeq, iSeq)'),
+    ('four_channel', '4-channel (e.g., MiSeq, HiSeq)'),
+]
+
+COLOR_BALANCE_MODE_CHOICES = [
+    ('enforce', 'Require a signal in every channel at every cycle'),
+    ('optimize', 'Make the weakest channel at any cycle as strong as possible'),
+]
+
+# Lists at least this long are checked for incompatible pairs with a segment
+# index rather than by comparing every pair of indexes, unless the segments
+# leave more than this share of all pairs to compare
+SEGMENT_INDEX_MIN_SIZE = 1000
+SEGMENT_INDEX_MAX_CANDIDATES = 0.25
+
+try:
+    popcount = np.bitwise_count
+except AttributeError:
+    POPCOUNT_TABLE = np.array(
+        [bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        counts = POPCOUNT_TABLE[words.view(np.uint8)]
+        return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def channel_matrix(chemistry):
+    """
+    Return a (base, channel) array that is 1 where the base gives a signal in
+    the channel of ``chemistry`` (see ``COLOR_CHANNELS``).
+    """
+    channels = COLOR_CHANNELS[chemistry]
+    return np.array(
+        [[int(base in channel) for channel in channels] for base in 'ACGT'],
+        dtype=np.int64)
+
+
+def channel_signal(index_list, chemistry, length=None):
+    """
+    Return, for each of the first ``length`` cycles, the number of indexes in
+    ``index_list`` that give a signal in each channel of ``chemistry``.
+    """
+    if length is None:
+        length = minimum_index_length_from_lists(index_list)
+    if not index_list or length == float('inf'):
+        return np.zeros((0, len(COLOR_CHANNELS[chemistry])), dtype=np.int64)
+    codes = encode_index_list(index_list, int(length)).astype(np.intp)
+    counts = np.eye(4, dtype=np.int64)[codes].sum(axis=0)
+    return counts @ channel_matrix(chemistry)
+
+
+def dual_index_incompatibility(distances, distances_2, min_distance,
+                               min_distance_2, rule='both'):
+    """
+    Combine index 1 and index 2 distances into incompatibility flags
+    under ``rule`` (see ``DUAL_INDEX_RULE_CHOICES``).
+    """
+    if rule == 'both':
+        return (distances < min_distance) & (distances_2 < min_distance_2)
+    elif rule == 'either':
+        return (distances < min_distance) | (distances_2 < min_distance_2)
+    elif rule == 'sum':
+        return distances.astype(np.uint32) + distances_2 < min_distance
+    else:
+        raise ValueError('Unknown dual-index rule: {}'.format(rule))
+
+
+def dual_hamming_distance_blocks(packed_index_list, packed_index_list_2):
+    packed = np.hstack([packed_index_list, packed_index_list_2])
+    words_1 = packed_index_list.shape[1]
+
+    rows, words = packed.shape
+    rows_per_block = max(1, BLOCK_SIZE // max(1, rows * words))
+
+    for start in range(0, rows, rows_per_block):
+        block = packed[start:start + rows_per_block]
+        mismatches = block[:, None, :] ^ packed[None, :, :]
+        mismatches = (mismatches | (mismatches >> np.uint64(1))) & LOW_BITS
+        counts = popcount(mismatches)
+        yield (
+            start,
+            counts[:, :, :words_1].sum(axis=2, dtype=np.uint16),
+            counts[:, :, words_1:].sum(axis=2, dtype=np.uint16))
+
+
+def encode_index_list(index_list, length):
+    encoded = ''.join(i[0:length] for i in index_list).encode('ascii')
+    codes = BASE_CODES[np.frombuffer(encoded, dtype=np.uint8)]
+    return codes.reshape(len(index_list), length)
+
+
+def find_incompatible_dual_index_pairs(index_list, index_list_2,
+                                       min_distance=3, min_distance_2=None,
+                                       index_length=None, index_length_2=None,
+                                       rule='both'):
+    """
+    Compare both indexes of every pair of dual-indexed samples at once and
+    return the incompatible pairs under ``rule`` (see
+    ``DUAL_INDEX_RULE_CHOICES``), in order of their positions.
+    """
+    if min_distance_2 is None:
+        min_distance_2 = min_distance
+    if index_length is None:
+        index_length = minimum_index_length_from_lists(index_list)
+    if index_length_2 is None:
+        index_length_2 = minimum_index_length_from_lists(index_list_2)
 
-    for index_subset in itertools.combinations(index_list, subset_size):
+    incompatible_pairs = []
+    if len(index_list) < 2:
+        return incompatible_pairs
 
-        if not self_compatible_list:
-            if not is_self_compatible(index_subset, min_distance, min_length):
-                if is_timed_out(start_time, timeout=timeout):
-                    find_compatible_subset.timed_out = True
-                    return []
+    packed = pack_index_list(index_list, index_length)
+    packed_2 = pack_index_list(index_list_2, index_length_2)
+    for start, distances, distances_2 in dual_hamming_distance_blocks(
+            packed, packed_2):
+        incompatible = dual_index_incompatibility(
+            distances, distances_2, min_distance, min_distance_2, rule)
+
+        rows, columns = np.nonzero(incompatible)
+        for row, j in zip(rows, columns):
+            i = start + row
+            if j <= i:
                 continue
-            else:
-                compatible_subset = list(index_subset)
-        else:
-            compatible_subset = list(index_subset)
-
-        if len(index_set_list) > 0:
-            previous_list.extend(compatible_subset)
-            new_list = find_compatible_subset(
-                index_set_list, subset_size_list, min_length, min_distance,
-                previous_list, timeout, start_time)
-            if new_list:
-                compatible_subset.extend(new_list)
-            elif new_list is not None:
-                compatible_subset = []
-
-        if compatible_subset:
-            break
-
-    return compatible_subset
+            incompatible_pairs.append({
+                'positions': (int(i), int(j)),
+                'pair': (index_list[i], index_list[j]),
+                'pair_2': (index_list_2[i], index_list_2[j]),
+                'distances': (int(distances[row, j]),
+                              int(distances_2[row, j])),
+            })
+    return incompatible_pairs
 
 
 def find_incompatible_index_pairs(index_list, min_distance=3,
@@ -76,13 +181,10 @@ def find_incompatible_index_pairs(index_list, min_distance=3,
 
     incompatible_pairs = []
     incompatible_positions = []
-    for pair in itertools.combinations(enumerate(index_list), 2):
-        distance = hamming_distance(
-            pair[0][1][0:index_length].upper(),
-            pair[1][1][0:index_length].upper())
-        if distance < min_distance:
-            incompatible_pairs.append((pair[0][1], pair[1][1]))
-            incompatible_positions.append((pair[0][0], pair[1][0]))
+    for i, j in zip(*incompatible_position_pairs(
+            index_list, min_distance, index_length)):
+        incompatible_pairs.append((index_list[i], index_list[j]))
+        incompatible_positions.append((int(i), int(j)))
 
     if sequences and positions:
         return (incompatible_pairs, incompatible_positions)
@@ -129,6 +231,71 @@ def hamming_distance(this, that):
         return sum(1 for a, b in zip(this, that) if a != b)
 
 
+def hamming_distance_blocks(packed_index_list, other_packed_index_list=None):
+    if other_packed_index_list is None:
+        other_packed_index_list = packed_index_list
+
+    columns, words = other_packed_index_list.shape
+    rows_per_block = max(1, BLOCK_SIZE // max(1, columns * words))
+
+    for start in range(0, len(packed_index_list), rows_per_block):
+        block = packed_index_list[start:start + rows_per_block]
+        mismatches = block[:, None, :] ^ other_packed_index_list[None, :, :]
+        mismatches = (mismatches | (mismatches >> np.uint64(1))) & LOW_BITS
+        yield start, popcount(mismatches).sum(axis=2, dtype=np.uint16)
+
+
+def hamming_distance_matrix(index_list, other_index_list=None, length=None):
+    if other_index_list is None:
+        index_length = minimum_index_length_from_lists(index_list)
+    else:
+        index_length = minimum_index_length_from_lists(
+            index_list, other_index_list)
+    if length is not None:
+        index_length = min(index_length, length)
+
+    packed = pack_index_list(index_list, index_length)
+    if other_index_list is None:
+        other_packed = packed
+    else:
+        other_packed = pack_index_list(other_index_list, index_length)
+
+    distances = np.zeros((len(packed), len(other_packed)), dtype=np.uint16)
+    for start, block in hamming_distance_blocks(packed, other_packed):
+        distances[start:start + len(block)] = block
+    return distances
+
+
+def index_adjacency(index_list, min_distance=3, length=None):
+    """
+    Return, for each index, the positions of the other indexes that are
+    closer than ``min_distance`` over their first ``length`` bases. Bases
+    missing from the shorter of two sequences count as mismatches.
+    """
+    lengths = np.array([len(index) for index in index_list], dtype=int)
+    if length is None:
+        length = lengths.max() if len(lengths) > 0 else 0
+    lengths = np.minimum(lengths, length)
+
+    neighbors = [[] for _ in index_list]
+    groups = [(l, np.flatnonzero(lengths == l)) for l in np.unique(lengths)]
+    for a, (length_1, rows) in enumerate(groups):
+        for length_2, columns in groups[a:]:
+            distances = hamming_distance_matrix(
+                [index_list[i] for i in rows],
+                [index_list[j] for j in columns],
+                length=length_1)
+            close = distances.astype(int) + (length_2 - length_1) < min_distance
+            for r, c in zip(*np.nonzero(close)):
+                i, j = rows[r], columns[c]
+                if i == j:
+                    continue
+                neighbors[i].append(int(j))
+                if length_1 != length_2:
+                    neighbors[j].append(int(i))
+    return [sorted(n) for n in neighbors]
+
+
 def index_list_from_samplesheet(request=None, files=None):
     if request is None and files is None:
         raise ValueError('Need either a request object or files.')
@@ -178,7 +345,9 @@ def index_list_from_samplesheet(request=None, files=None):
     if dual_indexed:
         index_list = [",".join([i1, i2]) for i1, i2 in zip(index_list, index_list_2)]
         if len(index_list) > len(set(index_list)):
-            raise ValueError('Duplicate pairs of index sequences detected in uploaded sample sheet(s).')
+            raise ValueError(
+                'Duplicate pairs of index sequences detected in uploaded '
+                'sample sheet(s).')
         return OrderedDict(zip(index_list, sample_ids))
     else:
         if len(index_list) > len(set(index_list)):
@@ -206,6 +375,32 @@ def join_two_compatible_sets(a_sequences, b_sequences, b_is_self_compatible,
         return None
 
 
+def minimum_distances_by_length(index_list):
+    """
+    Return the minimum Hamming distance between any two indexes of
+    ``index_list`` compared over their first 1, 2, ... bases, up to the
+    shortest index length (empty for fewer than two indexes).
+    """
+    length = minimum_index_length_from_lists(index_list)
+    if len(index_list) < 2 or length == float('inf'):
+        return []
+
+    length = int(length)
+    codes = encode_index_list(index_list, length)
+    minimums = np.full(length, length, dtype=np.uint16)
+    rows = max(1, BLOCK_SIZE // (len(index_list) * max(length, 1)))
+    for start in range(0, len(index_list) - 1, rows):
+        # Only compare each index to those after it
+        block = codes[start:start + rows]
+        others = codes[start + 1:]
+        distances = np.cumsum(
+            block[:, None, :] != others[None, :, :], axis=2, dtype=np.uint16)
+        after = (np.arange(len(others))[None, :]
+                 >= np.arange(len(block))[:, None])
+        minimums = np.minimum(minimums, distances[after].min(axis=0))
+    return minimums.tolist()
+
+
 def minimum_index_length_from_lists(*index_list):
     index_list = [item for sublist in index_list for item in sublist]
     if len(index_list) > 0:
@@ -215,28 +410,100 @@ def minimum_index_length_from_lists(*index_list):
 
 
 def minimum_index_length_from_sets(index_set_list):
+    """
+    Return the shortest index length of the selected (not None) index sets
+    that have indexes, or infinity if none do.
+    """
     min_length = float('inf')
     for index_set in index_set_list:
+        if index_set is None:
+            continue
         try:
             min_length = min(index_set.min_length(), min_length)
-        except:
+        except ValueError:
+            # The set has no indexes
             pass
     return min_length
 
 
+def incompatible_position_pairs(index_list, min_distance=3, length=None):
+    """
+    Return the positions ``(i, j)``, with ``i < j``, of every pair of
+    indexes closer than ``min_distance``, as two arrays sorted by pair.
+
+    Pairs closer than ``min_distance`` agree exactly on at least one of
+    ``min_distance`` segments of their sequences (the pigeonhole
+    principle), so long lists only compare pairs that share a segment.
+    """
+    index_length = minimum_index_length_from_lists(index_list)
+    if length is not None:
+        index_length = min(index_length, length)
+    if index_length == float('inf'):
+        index_length = 0
+    index_length = int(index_length)
+
+    if len(index_list) < 2:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    codes = None
+    if (len(index_list) >= SEGMENT_INDEX_MIN_SIZE
+            and 0 < min_distance <= index_length):
+        codes = encode_index_list(index_list, index_length)
+        buckets = segment_buckets(codes, min_distance)
+        candidates = sum(
+            int((sizes * (sizes - 1) // 2).sum())
+            for sizes in (np.bincount(b) for b in buckets))
+        all_pairs = len(index_list) * (len(index_list) - 1) // 2
+        if candidates > all_pairs * SEGMENT_INDEX_MAX_CANDIDATES:
+            codes = None
+
+    if codes is None:
+        packed = pack_index_list(index_list, index_length)
+        first_list = [np.zeros(0, dtype=np.intp)]
+        second_list = [np.zeros(0, dtype=np.intp)]
+        for start, block in hamming_distance_blocks(packed):
+            rows, columns = np.nonzero(block < min_distance)
+            rows += start
+            # Only keep each sequence's pairs with those after it
+            later = columns > rows
+            first_list.append(rows[later])
+            second_list.append(columns[later])
+        return np.concatenate(first_list), np.concatenate(second_list)
+
+    first, second = segment_index_candidate_pairs(buckets)
+
+    packed = pack_codes(codes)
+    incompatible = np.zeros(len(first), dtype=bool)
+    pairs_per_block = max(1, BLOCK_SIZE // packed.shape[1])
+    for start in range(0, len(first), pairs_per_block):
+        end = start + pairs_per_block
+        mismatches = packed[first[start:end]] ^ packed[second[start:end]]
+        mismatches = (mismatches | (mismatches >> np.uint64(1))) & LOW_BITS
+        incompatible[start:end] = popcount(mismatches).sum(
+            axis=1, dtype=np.uint16) < min_distance
+    first, second = first[incompatible], second[incompatible]
+    order = np.lexsort((second, first))
+    return first[order], second[order]
+
+
 def is_self_compatible(index_list, min_distance=3, length=None):
     if len(index_list) == 0:
         return True
 
-    if length is None:
-        index_length = min(minimum_index_length_from_lists(index_list), float('inf'))
-    else:
-        index_length = length
+    if len(index_list) >= SEGMENT_INDEX_MIN_SIZE:
+        first, _ = incompatible_position_pairs(
+            index_list, min_distance, length)
+        return len(first) == 0
+
+    index_length = minimum_index_length_from_lists(index_list)
+    if length is not None:
+        index_length = min(index_length, length)
 
-    for pair in itertools.combinations(index_list, 2):
-        distance = hamming_distance(
-            pair[0][0:index_length].upper(), pair[1][0:index_length].upper())
-        if distance < min_distance:
+    packed = pack_index_list(index_list, index_length)
+    for start, block in hamming_distance_blocks(packed):
+        # Only compare each sequence to those after it
+        rows, columns = np.nonzero(block < min_distance)
+        if np.any(columns > rows + start):
             return False
     return True
 
@@ -247,39 +514,120 @@ def optimize_set_order(*index_set_list):
     seq_lengths = []
 
     for index_set in index_set_list:
+        if index_set is None:
+            set_lengths.append(float('inf'))
+            seq_lengths.append(0)
+            continue
+        set_lengths.append(index_set.index_count)
         try:
-            set_lengths.append(len(index_set.index_set.all()))
             seq_lengths.append(index_set.min_length())
-        except:
-            set_lengths.append(float('inf'))
+        except ValueError:
+            # The set has no indexes
             seq_lengths.append(0)
 
     return [o for (stl, sql, o) in sorted(
         zip(set_lengths, seq_lengths, ordering), key=lambda x: (-x[1], x[0]))]
 
 
-def remove_incompatible_indexes_from_queryset(index_set, index_list, min_distance=3, length=float('inf')):
+def pack_codes(codes):
+    length = codes.shape[1]
+    words = max(1, -(-length // BASES_PER_WORD))
+    packed = np.zeros((len(codes), words), dtype=np.uint64)
+    for position in range(length):
+        word, offset = divmod(position, BASES_PER_WORD)
+        packed[:, word] |= codes[:, position] << np.uint64(2 * offset)
+    return packed
+
+
+def pack_index_list(index_list, length=None):
+    index_length = minimum_index_length_from_lists(index_list)
+    if length is not None:
+        index_length = min(index_length, length)
+    if index_length == float('inf'):
+        index_length = 0
+    return pack_codes(encode_index_list(index_list, int(index_length)))
+
+
+def remove_incompatible_indexes_from_queryset(index_set, index_list,
+                                              min_distance=3,
+                                              length=float('inf')):
     if index_list == []:
         return index_set
 
-    index_length = min(minimum_index_length_from_lists(index_set, index_list), length)
-    incompatible_indexes = []
-
-    for seq_1, seq_2 in itertools.product(index_set, index_list):
-        distance = hamming_distance(
-            seq_1[0:index_length].upper(),
-            seq_2[0:index_length].upper())
-        if distance < min_distance:
-            incompatible_indexes.append(seq_1)
+    if len(index_set) == 0:
+        return []
 
-    return [i for i in index_set if i not in incompatible_indexes]
+    distances = hamming_distance_matrix(index_set, index_list, length=length)
+    compatible = distances.min(axis=1) >= min_distance
+    return [i for i, c in zip(index_set, compatible) if c]
 
 
 def reverse_complement(seq):
     return seq.translate(str.maketrans('ACGTacgt', 'TGCAtgca'))[::-1]
 
 
+def segment_buckets(codes, segments):
+    """
+    Split encoded indexes into ``segments`` equal parts and number each
+    distinct part, returning one array of bucket numbers per segment.
+    """
+    bounds = np.linspace(0, codes.shape[1], segments + 1).astype(int)
+    buckets = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        _, inverse = np.unique(
+            codes[:, start:end], axis=0, return_inverse=True)
+        buckets.append(inverse.reshape(-1))
+    return buckets
+
+
+def segment_index_candidate_pairs(buckets):
+    """
+    Return the positions ``(i, j)``, with ``i < j``, of every pair of
+    indexes sharing a bucket in at least one segment. Each pair is only
+    returned once, for the first segment it shares.
+    """
+    first_list = []
+    second_list = []
+    for segment, segment_buckets in enumerate(buckets):
+        order = np.argsort(segment_buckets, kind='stable')
+        sorted_buckets = segment_buckets[order]
+        boundaries = np.flatnonzero(np.diff(sorted_buckets)) + 1
+        ends = np.repeat(
+            np.append(boundaries, len(order)),
+            np.diff(np.concatenate([[0], boundaries, [len(order)]])))
+
+        # Pair each sorted position with the later positions in its bucket
+        partners = ends - np.arange(len(order)) - 1
+        first = np.repeat(np.arange(len(order)), partners)
+        offsets = np.arange(len(first)) - np.repeat(
+            np.cumsum(partners) - partners, partners)
+        second = first + offsets + 1
+        first, second = order[first], order[second]
+
+        shared_earlier = np.zeros(len(first), dtype=bool)
+        for earlier_buckets in buckets[:segment]:
+            shared_earlier |= earlier_buckets[first] == earlier_buckets[second]
+        first, second = first[~shared_earlier], second[~shared_earlier]
+
+        first_list.append(np.minimum(first, second))
+        second_list.append(np.maximum(first, second))
+
+    return np.concatenate(first_list), np.concatenate(second_list)
+
+
 def weblogo_base64(index_list):
+    return {
+        unit: base64.b64encode(png)
+        for unit, png in weblogo_png(index_list).items()}
+
+
+def weblogo_png(index_list):
+    # weblogo (and the Ghostscript it renders PNGs with) is only needed when
+    # configured as the logo renderer
+    from weblogolib import (
+        Alphabet, ColorScheme, LogoData, LogoFormat, LogoOptions, Seq, SeqList,
+        SymbolColor, png_formatter)
+
     illumina_colors = ColorScheme(
             [
                 SymbolColor("G", "blue"),
@@ -300,11 +648,9 @@ def weblogo_base64(index_list):
     )
 
     logo = {}
-    png = png_formatter(data, LogoFormat(data, options))
-    logo['bit'] = base64.b64encode(png)
+    logo['bit'] = png_formatter(data, LogoFormat(data, options))
 
     options.unit_name = 'probability'
-    png = png_formatter(data, LogoFormat(data, options))
-    logo['probability'] = base64.b64encode(png)
+    logo['probability'] = png_formatter(data, LogoFormat(data, options))
 
     return logo
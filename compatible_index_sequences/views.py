@@ -1,43 +1,276 @@
 import csv
 import datetime
 import itertools
-
-from django.http import HttpResponse
-from django.shortcuts import render
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.db.models.functions import Length
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+    JsonResponse, StreamingHttpResponse)
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, etag, require_POST
 from django.views.generic import DetailView, ListView
 
+from .batch import BatchError, check_pools
+from .catalog import catalog_state, catalog_version, get_index_catalog
 from .forms import (
     AutoIndexListForm, CompatibilityParameters, CustomIndexListForm,
     HiddenSampleSheetDownloadForm)
-from .models import Index, IndexSet
+from .jobs import create_search_job
+from .logos import (
+    LOGO_CACHE_TIMEOUT, LOGO_CONTENT_TYPES, LOGO_RENDERER, get_logo,
+    register_logo)
+from .metrics import (
+    METRICS_ALLOWED_IPS, PhaseTimer, render_metrics, search_outcome)
+from .models import (
+    INDEX_TYPE_CHOICES, Index, IndexSet, IndexSetDistanceMatrix, SearchJob)
+from .search import (
+    SEARCH_PROCESSES, dual_search_parameters, find_compatible_subset,
+    get_cached_search_result, search_cache_key)
 from .utils import (
-    find_compatible_subset, find_incompatible_index_pairs,
-    generate_incompatible_alignments, hamming_distance,
-    index_list_from_samplesheet, is_self_compatible,
+    COLOR_BALANCE_CHOICES, channel_signal, find_incompatible_dual_index_pairs,
+    find_incompatible_index_pairs, generate_incompatible_alignments,
+    index_adjacency, index_list_from_samplesheet, is_self_compatible,
     minimum_index_length_from_lists, minimum_index_length_from_sets,
-    optimize_set_order, weblogo_base64)
+    optimize_set_order)
+
+
+# Background searches need a run_search_worker process, so they are opt-in
+BACKGROUND_SEARCH = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_BACKGROUND_SEARCH', False)
+
+# Lifetime (in seconds) of cached interactive mode adjacency data
+ADJACENCY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Lifetime (in seconds) of cached catalog page fragments, which are also
+# keyed by catalog version
+FRAGMENT_CACHE_TIMEOUT = getattr(
+    settings, 'COMPATIBLE_INDEX_SEQUENCES_FRAGMENT_CACHE_TIMEOUT',
+    60 * 60 * 24)
+
+
+class Echo(object):
+    """File-like object that returns what is written, for streaming CSV."""
+
+    def write(self, value):
+        return value
+
+
+def auto_form_initial(form, custom_list):
+    initial = {
+        field: form.cleaned_data.get(field)
+        for field in [
+            'config_distance', 'config_length_manual', 'config_length',
+            'config_length_manual_2', 'config_length_2', 'config_dual',
+            'config_distance_2', 'config_dual_rule', 'config_pairing',
+            'config_color_balance', 'config_color_balance_mode',
+            'maximize', 'extend_search_time', 'subset_size_1', 'subset_size_2',
+            'subset_size_3']
+    }
+    for field in ['index_set_1', 'index_set_2', 'index_set_3',
+                  'index_2_set_1', 'index_2_set_2', 'index_2_set_3']:
+        index_set = form.cleaned_data.get(field)
+        initial[field] = index_set.pk if index_set is not None else None
+    initial['index_list'] = '\n'.join(custom_list)
+    return initial
+
+
+def catalog_etag(request, *args, **kwargs):
+    return catalog_version(get_catalog_state(request))
+
+
+def catalog_form_etag(request, *args, **kwargs):
+    # Pages with forms embed a CSRF token, which must match the cookie
+    return '{}-{}'.format(
+        catalog_etag(request),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    last_modified, _, _ = get_catalog_state(request)
+    return last_modified
 
 
 def generate_index_list_with_index_set_data(index_list):
+    catalog = get_index_catalog()
     index_list_with_data = []
     for sequence in index_list:
-        index_set_data = lookup_index_set(sequence)
+        index_set_data = catalog.lookup(sequence)
         index_list_with_data.append(
             {'sequence': sequence, 'index_set_data': index_set_data})
     return index_list_with_data
 
 
-def lookup_index_set(index, complete_index_set=Index):
-    return complete_index_set.objects.filter(sequence__iexact=index)
+def get_catalog_state(request):
+    """
+    Return the catalog state, querying it only once per request.
+    """
+    if not hasattr(request, 'catalog_state'):
+        request.catalog_state = catalog_state()
+    return request.catalog_state
+
+
+def iter_csv_field(value):
+    """Lazily split a comma-separated form field."""
+    start = 0
+    while True:
+        end = value.find(',', start)
+        if end == -1:
+            yield value[start:]
+            return
+        yield value[start:end]
+        start = end + 1
+
+
+def lookup_index_set(index, catalog=None):
+    if catalog is None:
+        catalog = get_index_catalog()
+    return catalog.lookup(index)
+
+
+def generate_missing_index_set_data(index_set_list, missing):
+    index_sets = [index_set for index_set in index_set_list if index_set]
+    return [
+        {'index_set': index_set, 'missing': count}
+        for index_set, count in zip(index_sets, missing) if count > 0
+    ]
+
+
+def render_auto_results(request, form, custom_list, compatible_set,
+                        timed_out, samplesheet_index_set,
+                        missing_index_sets=(), timer=None, dual_indexed=False,
+                        upper_bound=None, color_balance=None,
+                        incomplete=False, **details):
+    if timer is None:
+        timer = PhaseTimer('auto')
+    outcome = search_outcome(
+        compatible_set, timed_out, incomplete or bool(missing_index_sets))
+
+    sequences = list(custom_list) + list(compatible_set or [])
+    if dual_indexed and sequences:
+        sequences, sequences_2 = zip(*[pair.split(',') for pair in sequences])
+    with timer.phase('db'):
+        index_list = []
+        if compatible_set:
+            index_list = generate_index_list_with_index_set_data(sequences)
+            if dual_indexed:
+                index_list_2 = generate_index_list_with_index_set_data(
+                    sequences_2)
+
+    if timed_out and not compatible_set:
+        context = {
+            'form': form,
+            'timed_out': True,
+        }
+        with timer.phase('render'):
+            response = render(
+                request, 'compatible_index_sequences/auto.html', context)
+        timer.finish(outcome, indexes=len(custom_list), **details)
+        return response
+
+    index_list_seqs = [index['sequence'] for index in index_list]
+    index_list_2_seqs = []
+    if dual_indexed and index_list:
+        index_list_2_seqs = [index['sequence'] for index in index_list_2]
+        index_list = list(zip(index_list, index_list_2))
+        sample_ids = [
+            samplesheet_index_set.get(','.join([s1, s2]), '')
+            for s1, s2 in zip(index_list_seqs, index_list_2_seqs)]
+    else:
+        sample_ids = [
+            samplesheet_index_set.get(s, '') for s in index_list_seqs]
+    hidden_download_form = HiddenSampleSheetDownloadForm(
+        initial={
+            'index_list_csv': ','.join(index_list_seqs),
+            'index_list_2_csv': ','.join(index_list_2_seqs),
+            'sample_ids_csv': ','.join(sample_ids),
+            'dual_indexed': dual_indexed,
+        }
+    )
+    context = {
+        'dual_indexed': dual_indexed,
+        'hidden_download_form': hidden_download_form,
+        'index_list': index_list,
+        'missing_index_sets': missing_index_sets,
+    }
+    if upper_bound is not None:
+        found = len(compatible_set or [])
+        context['maximum'] = {
+            'size': len(custom_list) + found,
+            'custom': len(custom_list),
+            'upper_bound': len(custom_list) + upper_bound,
+            'optimal': upper_bound <= found,
+        }
+    if color_balance is not None and index_list_seqs:
+        signal = channel_signal(index_list_seqs, color_balance['chemistry'])
+        dark = signal.min(axis=1) == 0
+        context['color_balance'] = {
+            'chemistry': dict(COLOR_BALANCE_CHOICES)[
+                color_balance['chemistry']],
+            'size': len(index_list_seqs),
+            'weakest': int(signal.min()),
+            'dark_cycles': (np.flatnonzero(dark) + 1).tolist(),
+            'optimized': color_balance['mode'] == 'optimize',
+            'optimal': color_balance['mode'] == 'optimize' and not incomplete,
+        }
+    if index_list_seqs:
+        with timer.phase('logo'):
+            context['logo_key'] = register_logo(index_list_seqs)
+            if index_list_2_seqs:
+                context['logo_key_2'] = register_logo(index_list_2_seqs)
+    with timer.phase('render'):
+        response = render(
+            request, 'compatible_index_sequences/auto_results.html', context)
+    timer.finish(outcome, indexes=len(custom_list), **details)
+    return response
+
+
+@csrf_exempt
+@require_POST
+def api_batch(request):
+    """
+    Check a JSON batch of pools for compatibility, suggesting compatible
+    subsets from index sets for pools that ask for them (or, with background
+    searches, queueing search jobs for them).
+    """
+    timer = PhaseTimer('batch')
+    try:
+        with timer.phase('parse'):
+            data = json.loads(request.body.decode('utf-8'))
+    except ValueError as e:
+        timer.finish('invalid', error=e)
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+    try:
+        results = check_pools(
+            data, timer=timer, background=BACKGROUND_SEARCH)
+    except BatchError as e:
+        timer.finish('invalid', error=e)
+        return JsonResponse({'error': str(e)}, status=400)
+    timer.finish('checked', pools=len(results['pools']))
+    return JsonResponse(results)
 
 
 def auto(request):
     form = AutoIndexListForm(rows=10)
     if request.method == 'POST':
-        form = AutoIndexListForm(request.POST, request.FILES, rows=10)
-        if form.is_valid():
+        timer = PhaseTimer('auto')
+        with timer.phase('parse'):
+            form = AutoIndexListForm(request.POST, request.FILES, rows=10)
+            is_valid = form.is_valid()
+        if is_valid:
             config_distance = form.cleaned_data['config_distance']
             config_length = form.cleaned_data['config_length']
+            dual_indexed = form.cleaned_data['dual_indexed']
+            maximize = form.cleaned_data['maximize']
+            color_balance = form.cleaned_data['color_balance']
             samplesheet_index_set = form.cleaned_data['samplesheet_index_set']
 
             index_set_list = [
@@ -45,6 +278,11 @@ def auto(request):
                 form.cleaned_data['index_set_2'],
                 form.cleaned_data['index_set_3']
             ]
+            index_2_set_list = [
+                form.cleaned_data['index_2_set_1'],
+                form.cleaned_data['index_2_set_2'],
+                form.cleaned_data['index_2_set_3']
+            ]
             subset_size_list = [
                 form.cleaned_data['subset_size_1'],
                 form.cleaned_data['subset_size_2'],
@@ -53,96 +291,253 @@ def auto(request):
 
             order = optimize_set_order(*index_set_list)
 
-            index_list = form.cleaned_data['index_list']
-            index_list = generate_index_list_with_index_set_data(index_list)
-
-            try:
-                custom_list = [i['sequence'] for i in index_list]
-            except:
-                custom_list = []
+            custom_list = form.cleaned_data['index_list']
+            custom_list_1 = custom_list_2 = ()
+            if dual_indexed and custom_list:
+                (custom_list_1, custom_list_2) = zip(
+                    *[pair.split(',') for pair in custom_list])
+            elif not dual_indexed:
+                custom_list_1 = custom_list
 
-            index = {'set': [], 'size': []}
+            index = {'set': [], 'set_2': [], 'size': []}
             for o in order:
                 index['set'].append(index_set_list[o])
+                index['set_2'].append(index_2_set_list[o])
                 index['size'].append(subset_size_list[o])
 
             if config_length is None:
                 min_length = min(
-                    minimum_index_length_from_lists(custom_list),
+                    minimum_index_length_from_lists(custom_list_1),
                     minimum_index_length_from_sets(index['set'])
                 )
             else:
                 min_length = config_length
 
-            if not is_self_compatible(custom_list, config_distance, min_length):
-                incompatible_index_pairs = find_incompatible_index_pairs(
-                    custom_list, min_distance=config_distance,
-                    index_length=min_length)
-                incompatible_alignments = generate_incompatible_alignments(
-                    incompatible_index_pairs, length=min_length)
-                index_list = generate_index_list_with_index_set_data(custom_list)
+            details = {
+                'index_sets': [str(index_set) for index_set in index['set']
+                               if index_set is not None],
+                'subset_sizes': [size for size in index['size']
+                                 if size is not None],
+                'min_distance': config_distance,
+                'length': min_length,
+            }
+            if maximize:
+                details['maximize'] = True
+            if color_balance is not None:
+                details['balance'] = '{chemistry}/{mode}'.format(
+                    **color_balance)
+
+            dual = None
+            if dual_indexed:
+                config_length_2 = form.cleaned_data['config_length_2']
+                if config_length_2 is None:
+                    min_length_2 = min(
+                        minimum_index_length_from_lists(custom_list_2),
+                        minimum_index_length_from_sets(index['set_2'])
+                    )
+                else:
+                    min_length_2 = config_length_2
+                dual = dual_search_parameters(
+                    index['set'], index['set_2'], min_length_2,
+                    pairing=form.cleaned_data['config_pairing'],
+                    min_distance_2=form.cleaned_data['config_distance_2'],
+                    rule=form.cleaned_data['config_dual_rule'])
+                details.update({
+                    'index_sets_2': [
+                        str(index_set) for index_set in index['set_2']
+                        if index_set is not None],
+                    'length_2': min_length_2,
+                    'pairing': dual['pairing'],
+                })
+
+            with timer.phase('distance'):
+                if dual_indexed:
+                    incompatible_dual_index_pairs = find_incompatible_dual_index_pairs(
+                        custom_list_1, custom_list_2,
+                        min_distance=config_distance,
+                        min_distance_2=dual['min_distance_2'],
+                        index_length=min_length, index_length_2=min_length_2,
+                        rule=dual['rule'])
+                    self_compatible = not incompatible_dual_index_pairs
+                else:
+                    self_compatible = is_self_compatible(
+                        custom_list, config_distance, min_length)
+            if not self_compatible:
+                with timer.phase('distance'):
+                    if dual_indexed:
+                        incompatible_index_pairs = [
+                            pair['pair'] for pair in incompatible_dual_index_pairs]
+                        incompatible_index_pairs_2 = [
+                            pair['pair_2'] for pair in incompatible_dual_index_pairs]
+                        incompatible_alignments = [
+                            '{} + {}'.format(a[0], a[1]) for a in zip(
+                                generate_incompatible_alignments(
+                                    incompatible_index_pairs, length=min_length),
+                                generate_incompatible_alignments(
+                                    incompatible_index_pairs_2,
+                                    length=min_length_2))]
+                        incompatible_index_pairs = [
+                            ['{}   {}'.format(i[0], i[1])
+                             for i in zip(pair_1, pair_2)]
+                            for pair_1, pair_2 in zip(
+                                incompatible_index_pairs,
+                                incompatible_index_pairs_2)]
+                    else:
+                        incompatible_index_pairs = find_incompatible_index_pairs(
+                            custom_list, min_distance=config_distance,
+                            index_length=min_length)
+                        incompatible_alignments = generate_incompatible_alignments(
+                            incompatible_index_pairs, length=min_length)
+
+                with timer.phase('db'):
+                    index_list = generate_index_list_with_index_set_data(
+                        custom_list_1)
+                    if dual_indexed:
+                        index_list = list(zip(
+                            index_list,
+                            generate_index_list_with_index_set_data(
+                                custom_list_2)))
+                with timer.phase('logo'):
+                    logo_key = register_logo(custom_list_1)
+                    logo_key_2 = (
+                        register_logo(custom_list_2) if dual_indexed else None)
 
                 context = {
+                    'dual_indexed': dual_indexed,
+                    'index_length': min_length,
+                    'index_length_2': min_length_2 if dual_indexed else None,
                     'index_list': index_list,
                     'incompatible_indexes':
                         [item for sublist in incompatible_index_pairs for item in sublist],
                     'incompatible_index_pairs':
                         zip(incompatible_index_pairs, incompatible_alignments),
+                    'logo_key': logo_key,
+                    'logo_key_2': logo_key_2,
                 }
-                return render(
-                    request, 'compatible_index_sequences/custom_results.html', context)
+                with timer.phase('render'):
+                    response = render(
+                        request,
+                        'compatible_index_sequences/custom_results.html',
+                        context)
+                timer.finish(
+                    'incompatible_input', indexes=len(custom_list), **details)
+                return response
 
             if form.cleaned_data['extend_search_time']:
                 timeout = 60
             else:
                 timeout = 10
 
+            if BACKGROUND_SEARCH:
+                cached = get_cached_search_result(
+                    search_cache_key(
+                        index['set'], index['size'], min_length,
+                        config_distance, custom_list, dual=dual,
+                        maximize=maximize, color_balance=color_balance,
+                        anytime=True, processes=SEARCH_PROCESSES),
+                    timeout)
+                if cached is not None:
+                    return render_auto_results(
+                        request, form, custom_list, cached['result'],
+                        cached['timed_out'], samplesheet_index_set,
+                        generate_missing_index_set_data(
+                            index['set'], cached['missing']),
+                        timer=timer, dual_indexed=dual_indexed,
+                        upper_bound=cached.get('upper_bound'),
+                        color_balance=color_balance,
+                        incomplete=cached['incomplete'], cached=True,
+                        **details)
+
+                with timer.phase('db'):
+                    job = create_search_job(
+                        index['set'], index['size'], min_length,
+                        config_distance, custom_list, timeout,
+                        samplesheet_index_set,
+                        auto_form_initial(form, custom_list), dual=dual,
+                        maximize=maximize, color_balance=color_balance)
+                timer.finish(
+                    'queued', job=job.pk, indexes=len(custom_list), **details)
+                return redirect('compatible_index_sequences:auto_job', pk=job.pk)
+
             compatible_set = find_compatible_subset(
                 index['set'], index['size'], min_length=min_length,
                 min_distance=config_distance, previous_list=custom_list,
-                timeout=timeout)
+                timeout=timeout, processes=SEARCH_PROCESSES, use_cache=True,
+                anytime=True, timer=timer, dual=dual, maximize=maximize,
+                color_balance=color_balance)
+
+            return render_auto_results(
+                request, form, custom_list, compatible_set,
+                find_compatible_subset.timed_out, samplesheet_index_set,
+                generate_missing_index_set_data(
+                    index['set'], find_compatible_subset.missing),
+                timer=timer, dual_indexed=dual_indexed,
+                upper_bound=find_compatible_subset.upper_bound,
+                color_balance=color_balance,
+                incomplete=find_compatible_subset.incomplete, **details)
+        else:
+            timer.finish('invalid', errors=form.errors.as_json())
 
-            if compatible_set:
-                index_list.extend(
-                    generate_index_list_with_index_set_data(compatible_set))
-            else:
-                index_list = []
-                print('WARNING: NO COMPATIBLE SETS FOUND')
+    return render(request, 'compatible_index_sequences/auto.html', {'form': form})
 
-            if find_compatible_subset.timed_out:
-                context = {
-                    'form': form,
-                    'timed_out': True,
-                }
-                print('WARNING: TIMED OUT')
-                return render(
-                    request, 'compatible_index_sequences/auto.html', context)
 
-            index_list_seqs = [index['sequence'] for index in index_list]
-            sample_ids = [samplesheet_index_set.get(s, '') for s in index_list_seqs]
-            hidden_download_form = HiddenSampleSheetDownloadForm(
-                initial={
-                    'index_list_csv': ','.join(index_list_seqs),
-                    'sample_ids_csv': ','.join(sample_ids),
-                }
-            )
-            context = {
-                'hidden_download_form': hidden_download_form,
-                'index_list': index_list,
-                'weblogo_base64': weblogo_base64([index['sequence'] for index in index_list]),
-            }
-            return render(request, 'compatible_index_sequences/auto_results.html', context)
-        else:
-            print("INVALID INPUT")
+def auto_job(request, pk):
+    job = get_object_or_404(SearchJob, pk=pk)
+    if job.status == 'done':
+        parameters = job.get_parameters()
+        form = AutoIndexListForm(initial=parameters['initial'], rows=10)
+        index_sets = IndexSet.objects.in_bulk(parameters['index_sets'])
+        return render_auto_results(
+            request, form, parameters['custom_list'], job.get_result(),
+            job.timed_out, parameters['samplesheet_index_set'],
+            generate_missing_index_set_data(
+                [index_sets.get(pk) for pk in parameters['index_sets']],
+                job.get_missing()),
+            timer=PhaseTimer('auto_job'),
+            dual_indexed=parameters.get('dual') is not None,
+            upper_bound=(
+                job.target_size if parameters.get('maximize') else None),
+            color_balance=parameters.get('color_balance'),
+            incomplete=job.incomplete, job=job.pk)
 
-    return render(request, 'compatible_index_sequences/auto.html', {'form': form})
+    return render(
+        request, 'compatible_index_sequences/auto_job.html', {
+            'job': job,
+            'maximize': job.get_parameters().get('maximize', False),
+        })
+
+
+def auto_job_status(request, pk):
+    job = get_object_or_404(SearchJob, pk=pk)
+    best_partial = job.get_best_partial()
+
+    if job.estimated_finish is None:
+        estimated_seconds_remaining = None
+    else:
+        estimated_seconds_remaining = max(
+            0, (job.estimated_finish - timezone.now()).total_seconds())
+
+    return JsonResponse({
+        'status': job.status,
+        'nodes_explored': job.nodes_explored,
+        'target_size': job.target_size,
+        'best_partial': best_partial,
+        'best_partial_size': len(best_partial),
+        'result': job.get_result(),
+        'estimated_seconds_remaining': estimated_seconds_remaining,
+        'finished': job.is_finished,
+        'incomplete': job.incomplete,
+    })
 
 
 def custom(request):
     form = CustomIndexListForm()
     if request.method == 'POST':
-        form = CustomIndexListForm(request.POST, request.FILES)
-        if form.is_valid():
+        timer = PhaseTimer('custom')
+        with timer.phase('parse'):
+            form = CustomIndexListForm(request.POST, request.FILES)
+            is_valid = form.is_valid()
+        if is_valid:
             config_distance = form.cleaned_data['config_distance']
             dual_indexed = form.cleaned_data['dual_indexed']
             config_length = form.cleaned_data['config_length']
@@ -164,33 +559,22 @@ def custom(request):
             else:
                 index_length = config_length
 
-            incompat_seqs_1, incompat_poss_1 = find_incompatible_index_pairs(
-                custom_index_list, min_distance=config_distance,
-                index_length=index_length, sequences=True,
-                positions=True)
-
-            if dual_indexed:
-                subset_seq_2 = {
-                    e: [custom_index_list_2[i] for i in p]
-                    for e, p in enumerate(incompat_poss_1)
-                }
-
-                both_incompatible = []
-                for i, pair in subset_seq_2.items():
-                    distance = hamming_distance(
-                        pair[0][0:index_length_2].upper(),
-                        pair[1][0:index_length_2].upper())
-                    if distance < config_distance:
-                        both_incompatible.append(i)
-
-                incompatible_index_pairs = []
-                incompatible_index_pairs_2 = []
-                for i in both_incompatible:
-                    incompatible_index_pairs.append(incompat_seqs_1[i])
-                    incompatible_index_pairs_2.append(subset_seq_2[i])
-
-            else:
-                incompatible_index_pairs = incompat_seqs_1
+            with timer.phase('distance'):
+                if dual_indexed:
+                    incompatible_dual_index_pairs = find_incompatible_dual_index_pairs(
+                        custom_index_list, custom_index_list_2,
+                        min_distance=config_distance,
+                        min_distance_2=form.cleaned_data['config_distance_2'],
+                        index_length=index_length, index_length_2=index_length_2,
+                        rule=form.cleaned_data['config_dual_rule'])
+                    incompatible_index_pairs = [
+                        pair['pair'] for pair in incompatible_dual_index_pairs]
+                    incompatible_index_pairs_2 = [
+                        pair['pair_2'] for pair in incompatible_dual_index_pairs]
+                else:
+                    incompatible_index_pairs = find_incompatible_index_pairs(
+                        custom_index_list, min_distance=config_distance,
+                        index_length=index_length)
 
             incompatible_alignments = generate_incompatible_alignments(
                 incompatible_index_pairs, length=index_length)
@@ -212,13 +596,15 @@ def custom(request):
             else:
                 incompatible_alignments_seqs = incompatible_index_pairs
 
-            index_list = generate_index_list_with_index_set_data(
-                custom_index_list)
+            with timer.phase('db'):
+                index_list = generate_index_list_with_index_set_data(
+                    custom_index_list)
+                if dual_indexed:
+                    index_list_2 = generate_index_list_with_index_set_data(
+                        custom_index_list_2)
             index_list_seqs = [index['sequence'] for index in index_list]
             index_list_csv = ','.join(index_list_seqs)
             if dual_indexed:
-                index_list_2 = generate_index_list_with_index_set_data(
-                    custom_index_list_2)
                 index_list_2_seqs = [index['sequence'] for index in index_list_2]
                 index_list_2_csv = ','.join(index_list_2_seqs)
                 index_list = list(zip(index_list, index_list_2))
@@ -237,23 +623,40 @@ def custom(request):
                 }
             )
 
+            with timer.phase('logo'):
+                logo_key = register_logo(index_list_seqs)
+                if dual_indexed:
+                    logo_key_2 = register_logo(index_list_2_seqs)
+
             context = {
                 'dual_indexed': dual_indexed,
                 'index_length': index_length,
                 'index_list': index_list,
-                'incompatible_indexes': [item for sublist in incompatible_alignments_seqs for item in sublist],
-                'incompatible_index_pairs': zip(incompatible_alignments_seqs, incompatible_alignments),
+                'incompatible_indexes': {
+                    item for sublist in incompatible_alignments_seqs
+                    for item in sublist},
+                'incompatible_index_pairs': zip(
+                    incompatible_alignments_seqs, incompatible_alignments),
                 'hidden_download_form': hidden_download_form,
-                'weblogo_base64': weblogo_base64(index_list_seqs),
+                'logo_key': logo_key,
             }
             if dual_indexed:
                 context.update({
                     'index_length_2': index_length_2,
-                    'weblogo_base64_2': weblogo_base64(index_list_2_seqs),
+                    'logo_key_2': logo_key_2,
                 })
-            return render(request, 'compatible_index_sequences/custom_results.html', context)
+            with timer.phase('render'):
+                response = render(
+                    request, 'compatible_index_sequences/custom_results.html',
+                    context)
+            timer.finish(
+                'incompatible' if incompatible_index_pairs else 'compatible',
+                indexes=len(index_list_seqs), dual_indexed=dual_indexed,
+                min_distance=config_distance, length=index_length,
+                incompatible_pairs=len(incompatible_index_pairs))
+            return response
         else:
-            print("INVALID INPUT")
+            timer.finish('invalid', errors=form.errors.as_json())
 
     return render(
         request, 'compatible_index_sequences/custom.html', {'form': form})
@@ -287,7 +690,9 @@ def export_samplesheet(request):
     else:
         dual_indexed = False
 
-    header_row = ['Sample_ID', 'Sample_Name', 'Sample_Plate', 'Sample_Well', 'I7_Index_ID', 'index']
+    header_row = [
+        'Sample_ID', 'Sample_Name', 'Sample_Plate', 'Sample_Well',
+        'I7_Index_ID', 'index']
 
     if dual_indexed:
         for row in data:
@@ -298,67 +703,209 @@ def export_samplesheet(request):
         header_row.extend(['Sample_Project', 'Description'])
         data.append(header_row)
 
-    sample_ids_csv = request.POST.get('sample_ids_csv')
-    index_list_csv = request.POST.get('index_list_csv')
-    index_list_2_csv = request.POST.get('index_list_2_csv')
+    sample_ids_csv = request.POST.get('sample_ids_csv', '')
+    index_list_csv = request.POST.get('index_list_csv', '')
+    index_list_2_csv = request.POST.get('index_list_2_csv', '')
 
-    if dual_indexed:
-        zipped_index_data = zip(
-            sample_ids_csv.split(','),
-            index_list_csv.split(','),
-            index_list_2_csv.split(',')
-        )
-        for sample_id, index, index2 in zipped_index_data:
-            hit_list = []
-            hit2_list = []
-            for hit in lookup_index_set(index):
-                hit_list.append('{}:{}'.format(hit.index_set, hit.name))
-            for hit2 in lookup_index_set(index2):
-                hit2_list.append('{}:{}'.format(hit2.index_set, hit2.name))
-            data.append(
-                [sample_id, '', '', '', ', '.join(hit_list), index, ', '.join(hit2_list), index2, '', ''])
-    else:
-        zipped_index_data = zip(
-            sample_ids_csv.split(','),
-            index_list_csv.split(',')
-        )
-        for sample_id, index in zipped_index_data:
-            hit_list = []
-            for hit in lookup_index_set(index):
-                hit_list.append('{}:{}'.format(hit.index_set, hit.name))
-            data.append([sample_id, '', '', '', ', '.join(hit_list), index, '', ''])
+    catalog = get_index_catalog()
+
+    def index_id(index):
+        return ', '.join(
+            '{}:{}'.format(hit.index_set, hit.name)
+            for hit in lookup_index_set(index, catalog))
+
+    def generate_rows():
+        for row in data:
+            yield row
+        if dual_indexed:
+            zipped_index_data = zip(
+                iter_csv_field(sample_ids_csv),
+                iter_csv_field(index_list_csv),
+                iter_csv_field(index_list_2_csv)
+            )
+            for sample_id, index, index2 in zipped_index_data:
+                yield [sample_id, '', '', '', index_id(index), index,
+                       index_id(index2), index2, '', '']
+        else:
+            zipped_index_data = zip(
+                iter_csv_field(sample_ids_csv),
+                iter_csv_field(index_list_csv)
+            )
+            for sample_id, index in zipped_index_data:
+                yield [sample_id, '', '', '', index_id(index), index, '', '']
 
     filename = request.POST.get('filename')
-    if filename == '':
+    if not filename:
         filename = 'SampleSheet.{:%Y%m%d.%H%M%S}.csv'.format(datetime.datetime.now())
-    response = HttpResponse(content_type='text/csv')
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in generate_rows()),
+        content_type='text/csv')
     response[
         'Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
-    writer = csv.writer(response)
-    writer.writerows(data)
 
     return response
 
 
+def index_set_compatibility(request):
+    try:
+        min_distance = int(request.GET.get('distance', 3))
+    except ValueError:
+        min_distance = 3
+
+    index_types = []
+    for index_type, index_type_name in INDEX_TYPE_CHOICES:
+        index_sets = list(IndexSet.objects.filter(index_type=index_type))
+        rows = []
+        for index_set_1 in index_sets:
+            row = []
+            for index_set_2 in index_sets:
+                _, _, distances = IndexSetDistanceMatrix.objects.get_distances(
+                    index_set_1, index_set_2)
+                if index_set_1 == index_set_2:
+                    distances = distances[np.triu_indices(len(distances), k=1)]
+                if distances.size > 0:
+                    row.append({
+                        'index_set': index_set_2,
+                        'min_distance': int(distances.min()),
+                        'incompatible_pairs': int(
+                            (distances < min_distance).sum()),
+                    })
+                else:
+                    row.append({'index_set': index_set_2})
+            rows.append({'index_set': index_set_1, 'cells': row})
+        if index_sets:
+            index_types.append({
+                'name': index_type_name,
+                'index_sets': index_sets,
+                'rows': rows,
+            })
+
+    context = {
+        'min_distance': min_distance,
+        'index_types': index_types,
+    }
+    return render(
+        request, 'compatible_index_sequences/index_set_compatibility.html',
+        context)
+
+
+@etag(lambda request: '{}-{}'.format(
+    catalog_etag(request), request.GET.urlencode()))
+def interactive_adjacency(request):
+    """
+    Map the ID of each index in the ``index_sets`` being shown to the IDs of
+    the indexes closer than ``distance`` over their first ``length`` bases,
+    for interactive mode.
+    """
+    try:
+        distance = int(request.GET['distance'])
+        length = int(request.GET['length'])
+        index_set_ids = sorted(set(
+            int(pk) for pk in request.GET['index_sets'].split(',')))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest(
+            'Expected integer distance and length, and index set IDs.')
+    if distance < 0 or length < 1:
+        return HttpResponseBadRequest(
+            'Distance must be positive and length at least 1.')
+
+    index_set_ids = list(IndexSet.objects.filter(
+        pk__in=index_set_ids).order_by('pk').values_list('pk', flat=True))
+    # Comparing beyond the longest index changes nothing
+    indexes = Index.objects.filter(index_set__in=index_set_ids)
+    longest = indexes.aggregate(longest=Max(Length('sequence')))['longest']
+    length = min(length, longest or 0)
+    if longest is not None and distance > length:
+        return HttpResponseBadRequest(
+            'Distance cannot be greater than the length compared.')
+
+    key = 'compatible_index_sequences:adjacency:{}:{}:{}:{}'.format(
+        catalog_etag(request), distance, length,
+        ','.join(str(pk) for pk in index_set_ids))
+    adjacency = cache.get(key)
+    if adjacency is None:
+        indexes = list(indexes.values_list('id', 'sequence'))
+        index_ids = [index_id for index_id, _ in indexes]
+        sequences = [sequence for _, sequence in indexes]
+        neighbors = index_adjacency(sequences, distance, length)
+        adjacency = {
+            'distance': distance,
+            'length': length,
+            'neighbors': {
+                index_id: [index_ids[n] for n in index_neighbors]
+                for index_id, index_neighbors in zip(index_ids, neighbors)
+                if index_neighbors},
+        }
+        cache.set(key, adjacency, ADJACENCY_CACHE_TIMEOUT)
+
+    return JsonResponse(adjacency)
+
+
+def metrics(request):
+    """
+    Expose this process's request and search metrics in the Prometheus text
+    format, to clients in ``COMPATIBLE_INDEX_SEQUENCES_METRICS_ALLOWED_IPS``.
+    """
+    if request.META.get('REMOTE_ADDR') not in METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type='text/plain; version=0.0.4')
+
+
 def select_mode(request):
     return render(request, 'compatible_index_sequences/select_mode.html')
 
 
+@cache_control(public=True, max_age=LOGO_CACHE_TIMEOUT)
+@etag(lambda request, key, unit: '{}-{}-{}'.format(key, unit, LOGO_RENDERER))
+def sequence_logo(request, key, unit):
+    timer = PhaseTimer('logo')
+    with timer.phase('logo'):
+        logo = get_logo(key, unit)
+    if logo is None:
+        timer.finish('not_found', key=key)
+        raise Http404('Unknown sequence logo.')
+    timer.finish('served', key=key, unit=unit, renderer=LOGO_RENDERER)
+    return HttpResponse(logo, content_type=LOGO_CONTENT_TYPES[LOGO_RENDERER])
+
+
+@method_decorator(cache_control(no_cache=True), name='dispatch')
+@method_decorator(
+    condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified),
+    name='dispatch')
 class IndexSetDetailView(DetailView):
 
     model = IndexSet
     template_name = 'compatible_index_sequences/index_set_detail_view.html'
 
+    def get_context_data(self, **kwargs):
+        context = super(IndexSetDetailView, self).get_context_data(**kwargs)
+        context.update({
+            'catalog_version': catalog_version(
+                get_catalog_state(self.request)),
+            'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
+        })
+        return context
+
 
+@method_decorator(cache_control(private=True, no_cache=True), name='dispatch')
+@method_decorator(
+    condition(
+        etag_func=catalog_form_etag, last_modified_func=catalog_last_modified),
+    name='dispatch')
 class InteractiveView(ListView):
 
-    model = IndexSet
+    queryset = IndexSet.objects.prefetch_related('index_set')
     template_name = 'compatible_index_sequences/interactive.html'
 
     def get_context_data(self, **kwargs):
         context = super(InteractiveView, self).get_context_data(**kwargs)
         context.update({
+            'catalog_version': catalog_version(
+                get_catalog_state(self.request)),
             'form': CompatibilityParameters(),
+            'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
             'hidden_download_form': HiddenSampleSheetDownloadForm(),
         })
         return context